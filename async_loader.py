@@ -0,0 +1,314 @@
+import asyncio
+import json
+import random
+import threading
+import time
+import urllib.request
+
+import pandas as pd
+
+from company_fs import CompanyFS
+from instrumentation import count, stage
+from statement_maps import DEFAULT_CONFIG_DIR
+from statement_store import (
+    FREQUENCY_STATEMENTS,
+    STATEMENTS,
+    StatementNotCachedError,
+    StatementSource,
+    default_store,
+    yfinance_fetcher,
+)
+
+# Errors a retry cannot fix
+NON_RETRYABLE_ERRORS = (StatementNotCachedError, AssertionError, KeyError)
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter for coroutines: up to capacity requests at
+    once, refilled at rate requests per second.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        assert rate > 0, "Rate must be greater than 0"
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Waits until a token is available and takes it."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ThreadTransport:
+    """
+    Runs a blocking fetcher (ticker, statement) -> DataFrame in a worker
+    thread, yfinance_fetcher by default.
+    """
+
+    def __init__(self, fetcher=None):
+        self.fetcher = fetcher if fetcher is not None else yfinance_fetcher
+
+    async def __call__(self, ticker: str, statement: str) -> pd.DataFrame:
+        return await asyncio.to_thread(self.fetcher, ticker, statement)
+
+
+class HTTPTransport:
+    """
+    Fetches statements from an HTTP endpoint serving
+    GET <base_url>/<TICKER>/<statement> as pandas "split" JSON
+    ({"index": [...], "columns": [dates], "data": [[...], ...]}),
+    e.g. a local stub server standing in for Yahoo.
+    """
+
+    def __init__(self, base_url: str, timeout: float = 30.0):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def _get(self, ticker: str, statement: str) -> pd.DataFrame:
+        url = f"{self.base_url}/{ticker}/{statement}"
+        with urllib.request.urlopen(url, timeout=self.timeout) as response:
+            payload = json.load(response)
+        return pd.DataFrame(
+            payload["data"],
+            index=pd.Index(payload["index"], dtype=object),
+            columns=pd.DatetimeIndex(payload["columns"]),
+        )
+
+    async def __call__(self, ticker: str, statement: str) -> pd.DataFrame:
+        return await asyncio.to_thread(self._get, ticker, statement)
+
+
+class LoadResult:
+    """
+    Result of a concurrent load.
+
+    Attributes:
+        companies: ticker -> CompanyFS with every statement loaded
+        errors: ticker -> "statement: ErrorType: message" of the first
+            statement that failed after all retries
+        stats: Request, retry and throughput statistics
+    """
+
+    def __init__(self, companies: dict, errors: dict, stats: dict):
+        self.companies = companies
+        self.errors = errors
+        self.stats = stats
+
+    def __repr__(self):
+        return (
+            f"LoadResult({len(self.companies)} loaded, {len(self.errors)} failed, "
+            f"{self.stats['elapsed_seconds']:.2f}s)"
+        )
+
+
+class _Loader:
+    """State shared by the coroutines of one load."""
+
+    def __init__(
+        self,
+        store: StatementSource,
+        transport,
+        concurrency: int,
+        rate: float,
+        burst: float,
+        retries: int,
+        backoff: float,
+        max_backoff: float,
+    ):
+        self.store = store
+        self.transport = transport
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stats = {"requests": 0, "retries": 0, "cache_hits": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+
+    async def statement(self, ticker: str, statement: str) -> pd.DataFrame:
+        """Serves a statement from the store or fetches it with retries."""
+        frame = await asyncio.to_thread(self.store.cached, ticker, statement)
+        if frame is not None:
+            self._count("cache_hits")
+            return frame
+
+        frame = await self.fetch(ticker, statement)
+        return await asyncio.to_thread(self.store.write, ticker, statement, frame)
+
+    async def fetch(self, ticker: str, statement: str) -> pd.DataFrame:
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.semaphore:
+                    if self.bucket is not None:
+                        await self.bucket.acquire()
+                    self._count("requests")
+                    with stage(f"fetch.{statement}", ticker):
+                        frame = await self.transport(ticker, statement)
+                assert isinstance(frame, pd.DataFrame), (
+                    "Transport must return a DataFrame"
+                )
+                assert not frame.empty, f"No {statement} data for {ticker}"
+                return frame
+            except NON_RETRYABLE_ERRORS:
+                raise
+            except Exception:
+                if attempt == self.retries:
+                    raise
+                self._count("retries")
+                count("fetch.retries", ticker)
+                # exponential backoff with full jitter
+                delay = min(self.max_backoff, self.backoff * 2**attempt)
+                await asyncio.sleep(random.uniform(0, delay))
+
+    async def company(
+        self,
+        ticker: str,
+        statements: tuple,
+        frequency: str,
+        company_kwargs: dict,
+    ) -> CompanyFS:
+        sources = FREQUENCY_STATEMENTS[frequency]
+        frames = await asyncio.gather(
+            *(self.statement(ticker, sources[statement]) for statement in statements),
+            return_exceptions=True,
+        )
+        for statement, frame in zip(statements, frames):
+            if isinstance(frame, BaseException):
+                raise _StatementError(statement, frame)
+
+        company = CompanyFS(
+            ticker, store=self.store, frequency=frequency, **company_kwargs
+        )
+        company._statements.update(zip(statements, frames))
+        return company
+
+
+class _StatementError(Exception):
+    def __init__(self, statement: str, error: BaseException):
+        super().__init__(f"{statement}: {type(error).__name__}: {error}")
+
+
+async def load_companies_async(
+    tickers: list,
+    store: StatementSource = None,
+    transport=None,
+    statements=None,
+    concurrency: int = 16,
+    rate: float = None,
+    burst: float = None,
+    retries: int = 3,
+    backoff: float = 0.5,
+    max_backoff: float = 8.0,
+    config_dir: str = DEFAULT_CONFIG_DIR,
+    validation: str = "full",
+    frequency: str = "annual",
+    estimator=None,
+    cache=None,
+) -> LoadResult:
+    """
+    Loads the statements of many tickers concurrently and builds CompanyFS
+    objects with them already in memory.
+
+    Statements still fresh in the store are served from disk; the others
+    are fetched through the transport, at most concurrency at a time and
+    at most rate per second, and written back to the store. Failed fetches
+    are retried with exponential backoff. A ticker whose statements cannot
+    all be loaded is reported in the errors and never aborts the load.
+
+    Args:
+        tickers: Ticker symbols
+        store: Statement store, defaults to the shared on-disk store
+        transport: Coroutine function (ticker, statement) -> DataFrame,
+            defaults to running the store's fetcher in a thread
+        statements: Statements to load, all three when None
+        concurrency: Maximum number of requests in flight
+        rate: Maximum requests per second, None for no limit
+        burst: Token bucket capacity, defaults to one second of rate
+        retries: Retries per statement after the first attempt
+        backoff: Base delay in seconds, doubled on every retry
+        max_backoff: Maximum delay in seconds between retries
+        config_dir: Directory holding the <TICKER>/*_map.json files
+        validation: Validation level of the CompanyFS objects
+        frequency: "annual" or "quarterly" statements
+        estimator: DriverEstimator of the CompanyFS objects
+        cache: ForecastCache of the CompanyFS objects
+
+    Returns:
+        LoadResult with companies, errors and statistics
+    """
+    assert isinstance(tickers, (list, tuple)), "Tickers must be a list"
+    assert concurrency > 0, "Concurrency must be greater than 0"
+    assert retries >= 0, "Retries must not be negative"
+    store = store if store is not None else default_store()
+    if transport is None and store.fetcher is not None:
+        # an offline source has no fetcher and never fetches
+        transport = ThreadTransport(store.fetcher)
+    assert frequency in FREQUENCY_STATEMENTS, f"Unknown frequency {frequency}"
+    statements = tuple(statements or STATEMENTS)
+    for statement in statements:
+        assert statement in STATEMENTS, f"Unknown statement {statement}"
+
+    loader = _Loader(
+        store, transport, concurrency, rate, burst, retries, backoff, max_backoff
+    )
+    tickers = list(dict.fromkeys(ticker.upper() for ticker in tickers))
+    company_kwargs = {
+        "config_dir": config_dir,
+        "validation": validation,
+        "estimator": estimator,
+        "cache": cache,
+    }
+
+    start = time.perf_counter()
+    outcomes = await asyncio.gather(
+        *(
+            loader.company(ticker, statements, frequency, company_kwargs)
+            for ticker in tickers
+        ),
+        return_exceptions=True,
+    )
+    elapsed = time.perf_counter() - start
+
+    companies, errors = {}, {}
+    for ticker, outcome in zip(tickers, outcomes):
+        if isinstance(outcome, _StatementError):
+            errors[ticker] = str(outcome)
+        elif isinstance(outcome, BaseException):
+            errors[ticker] = f"{type(outcome).__name__}: {outcome}"
+        else:
+            companies[ticker] = outcome
+
+    stats = {
+        "tickers": len(tickers),
+        "succeeded": len(companies),
+        "failed": len(errors),
+        **loader.stats,
+        "elapsed_seconds": elapsed,
+        "tickers_per_second": len(tickers) / elapsed if elapsed > 0 else float("inf"),
+    }
+    return LoadResult(companies, errors, stats)
+
+
+def load_companies(tickers: list, **kwargs) -> LoadResult:
+    """
+    Blocking wrapper of load_companies_async, see its arguments. Inside a
+    running event loop (e.g. Jupyter) await load_companies_async instead.
+    """
+    return asyncio.run(load_companies_async(tickers, **kwargs))
@@ -0,0 +1,508 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+import instrumentation
+from company_fs import CompanyFS
+from driver_estimation import period_positions, reported_dates
+from balance_sheet import CompactBalanceSheet
+from forecast_engine import (
+    BALANCE_TOLERANCE,
+    DEFAULT_SALES_GROWTH_RATE,
+    DRIVER_ATTRIBUTES,
+    assert_balanced,
+    build_driver_table,
+    forecast_scenarios,
+)
+from instrumentation import stage
+from statement_maps import DEFAULT_CONFIG_DIR
+from statement_store import StatementSource, default_store
+
+# Forecast drivers compared with the statement line item they forecast,
+# the line items CompanyFS._forecast_base derives the drivers from
+ACTUAL_DRIVER_ITEMS = {
+    "sales": ("incomestatement", "total_revenue"),
+    "operating_income": ("incomestatement", "operating_income"),
+    "depreciation": ("cashflow", "depreciation_amortization_depletion"),
+    "interest_expense": ("incomestatement", "net_non_operating_interest_income_expense"),
+    "pretax_income": ("incomestatement", "pretax_income"),
+    "tax_provision": ("incomestatement", "tax_provision"),
+    "net_income": ("incomestatement", "net_income_common_stockholders"),
+    "capex": ("cashflow", "capital_expenditure"),
+    "dividends_paid": ("cashflow", "cash_dividends_paid"),
+}
+
+BALANCE_SHEET_TOTALS = ("total_assets", "total_liabilities", "total_equity")
+
+# Columns of BacktestResult.errors, one row per compared value
+ERROR_COLUMNS = (
+    "ticker",
+    "estimator",
+    "scenario",
+    "base_date",
+    "target_date",
+    "horizon",
+    "line_item",
+    "forecast",
+    "actual",
+    "error",
+    "abs_error",
+    "ape",
+)
+
+
+class BacktestResult:
+    """
+    Results of a walk-forward backtest.
+
+    Attributes:
+        errors: One row per (ticker, estimator, scenario, base date, horizon,
+            line item) with the forecast, the actual value, the error
+            (forecast - actual), its absolute value and the absolute
+            percentage error (NaN where the actual value is 0)
+        settings: Driver overrides of every scenario, NaN where a driver is
+            not overridden
+        failures: (ticker, base_date, estimator) -> "ErrorType: message",
+            with base_date None when the ticker itself could not be loaded
+        stats: Throughput statistics of the run
+    """
+
+    def __init__(
+        self, errors: pd.DataFrame, settings: pd.DataFrame, failures: dict, stats: dict
+    ):
+        self.errors = errors
+        self.settings = settings
+        self.failures = failures
+        self.stats = stats
+
+    def __repr__(self):
+        return (
+            f"BacktestResult({len(self.errors)} comparisons, "
+            f"{len(self.failures)} failed, {self.stats['elapsed_seconds']:.2f}s)"
+        )
+
+    def metrics(self, by=("line_item",)) -> pd.DataFrame:
+        """
+        Aggregates the errors.
+
+        Args:
+            by: Columns to group by, e.g. ("ticker", "line_item"),
+                ("horizon", "line_item"), ("estimator", "scenario",
+                "line_item") or "base_year" for the calendar year of the
+                base date
+
+        Returns:
+            DataFrame with count, mae, mape (mean absolute percentage
+            error, as a fraction, over the non-zero actual values), bias
+            (mean signed error) and rmse per group
+        """
+        by = [by] if isinstance(by, str) else list(by)
+        errors = self.errors
+        if "base_year" in by:
+            errors = errors.assign(base_year=errors["base_date"].dt.year)
+        squared = errors["error"] ** 2
+        grouped = errors.assign(squared_error=squared).groupby(
+            by, observed=True, sort=True
+        )
+        metrics = grouped.agg(
+            count=("error", "size"),
+            mae=("abs_error", "mean"),
+            mape=("ape", "mean"),
+            bias=("error", "mean"),
+            rmse=("squared_error", "mean"),
+        )
+        metrics["rmse"] = np.sqrt(metrics["rmse"])
+        return metrics
+
+
+def _ticker_errors(
+    company: CompanyFS, horizons: tuple, settings: pd.DataFrame, estimators: dict
+):
+    """
+    Backtests one ticker from every base date with later statements.
+
+    The base balance sheets, sales and drivers of every base date come from
+    the statement histories (the same ratios CompanyFS._forecast_base takes
+    from one date), and every (base date, driver setting) runs as one row
+    of a single forecast per estimator.
+
+    Returns:
+        Tuple of (columns, failures) with columns a dict of equally long
+        arrays named like ERROR_COLUMNS, without ticker and the derived
+        error columns
+    """
+    ticker = company.ticker_name
+    with stage("backtest.actuals", ticker):
+        balance_sheet = company.get_bs_history(reported_dates(company.balancesheet))
+        histories = {
+            "incomestatement": company.get_pnl_history(
+                reported_dates(company.incomestatement)
+            ),
+            "cashflow": company.get_cf_history(reported_dates(company.cashflow)),
+        }
+        # dates with both a balance sheet and an income statement, oldest first
+        dates = balance_sheet.columns.intersection(
+            histories["incomestatement"].columns
+        ).sort_values()
+
+        # actual values, shape (dates, line items)
+        bs_actuals = balance_sheet.reindex(columns=dates).to_numpy(dtype="float64").T
+        totals = [
+            balance_sheet.index.str.startswith(f"{total}.") for total in BALANCE_SHEET_TOTALS
+        ]
+        # line items x dates, NaN where a statement has no such date
+        statement_values = {
+            statement: history.reindex(columns=dates).to_numpy(dtype="float64")
+            for statement, history in histories.items()
+        }
+        driver_actuals = np.column_stack(
+            [
+                statement_values[statement][histories[statement].index.get_loc(item)]
+                for statement, item in ACTUAL_DRIVER_ITEMS.values()
+            ]
+        )
+        actuals = np.concatenate(
+            [
+                bs_actuals,
+                np.column_stack([bs_actuals[:, mask].sum(axis=1) for mask in totals]),
+                driver_actuals,
+            ],
+            axis=1,
+        )
+    line_items = (
+        list(balance_sheet.index) + list(BALANCE_SHEET_TOTALS) + list(ACTUAL_DRIVER_ITEMS)
+    )
+
+    columns = {name: [] for name in ERROR_COLUMNS[1:9]}
+    failures = {}
+    # date -> the date each horizon later, -1 where there is no statement
+    horizons = np.asarray(horizons)
+    targets = np.column_stack(
+        [
+            period_positions(dates, company.periods_per_year, horizon)
+            for horizon in horizons
+        ]
+    ).reshape(len(dates), len(horizons))
+    compared = np.where(targets >= 0, horizons, 0).max(axis=1, initial=0)
+    # base dates with at least one compared horizon, and their last one
+    bases = np.flatnonzero(compared)
+    num_bases = len(bases)
+    compared_years = compared[bases]
+    max_horizon = int(compared_years.max(initial=0))
+
+    with stage("backtest.bases", ticker):
+        program = company.forecast_program
+        bs_layout = program.layout
+        base_values = bs_actuals[bases]
+        base_sales = statement_values["incomestatement"][
+            histories["incomestatement"].index.get_loc("total_revenue"), bases
+        ]
+        history = company.driver_history()
+        base_drivers = history.ratios.xs(ticker, level="ticker").reindex(
+            index=dates[bases], columns=list(DRIVER_ATTRIBUTES)
+        )
+        base_drivers["sales_growth_rate"] = DEFAULT_SALES_GROWTH_RATE ** (
+            1 / company.periods_per_year
+        )
+        base_drivers["minimum_cash_required"] = base_values[:, program.plug_position]
+
+    num_scenarios = len(settings)
+    overridden = settings.to_numpy(dtype="float64")
+    bs_positions = [bs_layout.positions[key] for key in balance_sheet.index]
+    for estimator_name, estimator in estimators.items():
+        drivers = base_drivers.copy()
+        if estimator is not None and num_bases:
+            estimates = company.estimate_drivers(estimator, history).reindex(
+                dates[bases]
+            )
+            drivers[list(estimator.drivers)] = estimates[list(estimator.drivers)]
+
+        # rows are (base date, scenario), base date major
+        table = np.where(
+            np.isnan(overridden)[np.newaxis],
+            drivers.to_numpy(dtype="float64")[:, np.newaxis],
+            overridden[np.newaxis],
+        ).reshape(num_bases * num_scenarios, len(DRIVER_ATTRIBUTES))
+        if not len(table):
+            continue
+        with stage("backtest.forecast", ticker):
+            result = forecast_scenarios(
+                CompactBalanceSheet(np.repeat(base_values, num_scenarios, axis=0), bs_layout),
+                np.repeat(base_sales, num_scenarios),
+                pd.DataFrame(table, columns=list(DRIVER_ATTRIBUTES)),
+                num_years=max_horizon,
+                tolerance=None,
+                program=program,
+            )
+
+        # the balance check forecast_balancesheet would run, per base date
+        imbalance = result.imbalance.reshape(num_bases, num_scenarios, max_horizon)
+        balanced = np.ones(num_bases, dtype=bool)
+        for position in np.flatnonzero(
+            ~(np.abs(imbalance) < BALANCE_TOLERANCE).all(axis=1).all(axis=1)
+        ):
+            for year in range(compared_years[position]):
+                try:
+                    assert_balanced(imbalance[position, :, year], year + 1)
+                except AssertionError as e:
+                    base_date = dates[bases[position]].strftime("%Y-%m-%d")
+                    failures[(ticker, base_date, estimator_name)] = f"AssertionError: {e}"
+                    balanced[position] = False
+                    break
+
+        # every compared (base date, horizon) pair
+        positions, horizon_positions = np.nonzero(
+            (targets[bases] >= 0) & balanced[:, np.newaxis]
+        )
+        if not len(positions):
+            continue
+        steps = horizons[horizon_positions]
+        target_rows = targets[bases[positions], horizon_positions]
+        rows = positions[:, np.newaxis] * num_scenarios + np.arange(num_scenarios)
+        selected = result.values[rows, (steps - 1)[:, np.newaxis]]  # (pairs, scenarios, items)
+        bs = CompactBalanceSheet(selected[:, :, : len(bs_layout)], bs_layout)
+        forecast = np.concatenate(
+            [
+                selected[:, :, bs_positions],
+                np.stack([bs.subtotal(total) for total in BALANCE_SHEET_TOTALS], axis=2),
+                selected[:, :, [result.line_items.index(item) for item in ACTUAL_DRIVER_ITEMS]],
+            ],
+            axis=2,
+        )
+        actual = np.broadcast_to(actuals[target_rows][:, np.newaxis], forecast.shape)
+
+        num_pairs, _, num_items = forecast.shape
+        per_pair = num_scenarios * num_items
+        columns["estimator"].append(np.full(forecast.size, estimator_name, dtype=object))
+        columns["scenario"].append(
+            np.tile(np.repeat(np.arange(num_scenarios), num_items), num_pairs)
+        )
+        columns["base_date"].append(
+            np.repeat(dates[bases[positions]].to_numpy(), per_pair)
+        )
+        columns["target_date"].append(np.repeat(dates[target_rows].to_numpy(), per_pair))
+        columns["horizon"].append(np.repeat(steps, per_pair))
+        columns["line_item"].append(np.tile(np.arange(num_items), num_pairs * num_scenarios))
+        columns["forecast"].append(forecast.ravel())
+        columns["actual"].append(actual.ravel())
+
+    columns = {
+        name: np.concatenate(values) if values else np.array([])
+        for name, values in columns.items()
+    }
+    columns["line_item"] = np.asarray(line_items, dtype=object)[
+        columns["line_item"].astype(int)
+    ]
+    return columns, failures
+
+
+def _backtest_chunk(
+    tickers: list,
+    horizons: tuple,
+    settings: pd.DataFrame,
+    estimators: dict,
+    store: StatementSource,
+    config_dir: str,
+    frequency: str,
+    instrument: bool = False,
+    companies: dict = None,
+):
+    """
+    Backtests a chunk of tickers in a worker, capturing errors per ticker.
+
+    Returns:
+        Tuple of (outcomes, instrumentation snapshot or None), outcomes a
+        list of (ticker, columns, failures, elapsed_seconds)
+    """
+    recorder = instrumentation.enable() if instrument else None
+    outcomes = []
+    for ticker in tickers:
+        start = time.perf_counter()
+        try:
+            company = (companies or {}).get(ticker) or CompanyFS(
+                ticker, store=store, config_dir=config_dir, frequency=frequency
+            )
+            columns, failures = _ticker_errors(company, horizons, settings, estimators)
+        except Exception as e:
+            columns, failures = None, {(ticker, None, None): f"{type(e).__name__}: {e}"}
+        outcomes.append((ticker, columns, failures, time.perf_counter() - start))
+    if recorder is None:
+        return outcomes, None
+    instrumentation.disable()
+    return outcomes, recorder.snapshot()
+
+
+def backtest(
+    tickers,
+    horizons=(1, 2, 3),
+    overrides=None,
+    grid: bool = False,
+    estimators: dict = None,
+    workers: int = None,
+    chunksize: int = 16,
+    store: StatementSource = None,
+    config_dir: str = DEFAULT_CONFIG_DIR,
+    frequency: str = "annual",
+) -> BacktestResult:
+    """
+    Walk-forward backtest: forecasts from every historical base date and
+    compares each forecast year with the statements actually reported.
+
+    All base dates, driver settings and horizons of a ticker run in a
+    single vectorized forecast per estimator. Each ticker's statements are loaded once,
+    from the store (use an offline store to backtest cached data only) or
+    from the CompanyFS objects passed in. Tickers are spread over a
+    process pool in chunks, like run_universe.
+
+    Args:
+        tickers: Ticker symbols, or CompanyFS objects (a list or a ticker ->
+            CompanyFS dict) whose loaded statements are reused; these run
+            in the current process
+        horizons: Forecast years (quarters for quarterly statements) to
+            compare, e.g. (1, 2, 3). A forecast is compared with the
+            statement that many periods after its base date, matched by
+            date; pairs without such a statement are skipped
+        overrides: Driver settings, anything CompanyFS.forecast_scenarios
+            accepts; every override set is a scenario
+        grid: Take the cartesian product of a dict of arrays
+        estimators: Name -> DriverEstimator (None for base year drivers),
+            defaults to {"base_year": None}
+        workers: Number of worker processes, defaults to the CPU count;
+            0 or 1 runs in the current process
+        chunksize: Number of tickers sent to a worker at once
+        store: Statement store used by the workers, it must be picklable
+        config_dir: Directory holding the <TICKER>/*_map.json files
+        frequency: "annual" or "quarterly" statements
+
+    Returns:
+        BacktestResult with the errors, failures and throughput statistics
+    """
+    horizons = tuple(sorted(set(horizons)))
+    assert horizons and all(
+        isinstance(h, int) and h > 0 for h in horizons
+    ), "Horizons must be positive integers"
+    assert chunksize > 0, "Chunk size must be greater than 0"
+    estimators = estimators if estimators is not None else {"base_year": None}
+    assert estimators, "At least one estimator is required"
+
+    companies = None
+    if isinstance(tickers, dict):
+        tickers = list(tickers.values())
+    if tickers and isinstance(tickers[0], CompanyFS):
+        companies = {company.ticker_name: company for company in tickers}
+        tickers = list(companies)
+        workers = 0
+    else:
+        assert isinstance(tickers, (list, tuple)), "Tickers must be a list"
+        tickers = list(dict.fromkeys(ticker.upper() for ticker in tickers))
+    store = store if store is not None else default_store()
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    chunks = [tickers[i : i + chunksize] for i in range(0, len(tickers), chunksize)]
+    # driver overrides of every scenario, NaN where the base driver is kept
+    settings = build_driver_table(
+        {driver: np.nan for driver in DRIVER_ATTRIBUTES}, overrides, grid=grid
+    )
+    settings.index.name = "scenario"
+    arguments = (horizons, settings, estimators, store, config_dir, frequency)
+
+    start = time.perf_counter()
+    outcomes = []
+    if workers <= 1:
+        for chunk in chunks:
+            outcomes.extend(
+                _backtest_chunk(chunk, *arguments, companies=companies)[0]
+            )
+    else:
+        # workers record into their own recorder, merged into the caller's
+        recorder = instrumentation.recorder()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(
+                    _backtest_chunk, chunk, *arguments, recorder is not None
+                ): chunk
+                for chunk in chunks
+            }
+            for future in as_completed(futures):
+                try:
+                    chunk_outcomes, snapshot = future.result()
+                    outcomes.extend(chunk_outcomes)
+                    if snapshot is not None:
+                        recorder.merge(snapshot)
+                except Exception as e:
+                    # the worker itself died, fail every ticker of the chunk
+                    error = f"{type(e).__name__}: {e}"
+                    outcomes.extend(
+                        (ticker, None, {(ticker, None, None): error}, 0.0)
+                        for ticker in futures[future]
+                    )
+
+    with stage("backtest.errors"):
+        errors, failures, ticker_seconds = _error_frame(outcomes, estimators)
+    elapsed = time.perf_counter() - start
+
+    stats = {
+        "tickers": len(tickers),
+        "succeeded": sum(1 for outcome in outcomes if outcome[1] is not None),
+        "failed_forecasts": len(failures),
+        "comparisons": len(errors),
+        "workers": max(workers, 1),
+        "chunksize": chunksize,
+        "elapsed_seconds": elapsed,
+        "tickers_per_second": len(tickers) / elapsed if elapsed > 0 else float("inf"),
+        "mean_ticker_seconds": (
+            sum(ticker_seconds) / len(ticker_seconds) if ticker_seconds else 0.0
+        ),
+        "max_ticker_seconds": max(ticker_seconds, default=0.0),
+    }
+    return BacktestResult(errors, settings, failures, stats)
+
+
+def _error_frame(outcomes: list, estimators: dict):
+    """Stacks the per-ticker columns into the errors DataFrame."""
+    outcomes = sorted(outcomes, key=lambda outcome: outcome[0])
+    columns = {name: [] for name in ERROR_COLUMNS[:9]}
+    failures, ticker_seconds = {}, []
+    for ticker, ticker_columns, ticker_failures, seconds in outcomes:
+        failures.update(ticker_failures)
+        ticker_seconds.append(seconds)
+        if ticker_columns is None or not len(ticker_columns["forecast"]):
+            continue
+        columns["ticker"].append(np.full(len(ticker_columns["forecast"]), ticker, dtype=object))
+        for name, values in ticker_columns.items():
+            columns[name].append(values)
+
+    def stacked(name: str, dtype=None):
+        values = columns[name]
+        return np.concatenate(values) if values else np.array([], dtype=dtype)
+
+    forecast = stacked("forecast", "float64").astype("float64")
+    actual = stacked("actual", "float64").astype("float64")
+    error = forecast - actual
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ape = np.where(actual != 0, np.abs(error) / np.abs(actual), np.nan)
+
+    frame = pd.DataFrame(
+        {
+            "ticker": pd.Categorical(stacked("ticker", object)),
+            "estimator": pd.Categorical(
+                stacked("estimator", object), categories=list(estimators)
+            ),
+            "scenario": stacked("scenario", "int64").astype("int64"),
+            "base_date": pd.to_datetime(stacked("base_date", "datetime64[ns]")),
+            "target_date": pd.to_datetime(stacked("target_date", "datetime64[ns]")),
+            "horizon": stacked("horizon", "int64").astype("int64"),
+            "line_item": pd.Categorical(stacked("line_item", object)),
+            "forecast": forecast,
+            "actual": actual,
+            "error": error,
+            "abs_error": np.abs(error),
+            "ape": ape,
+        },
+        columns=list(ERROR_COLUMNS),
+    )
+    # comparisons without a reported actual value are not errors
+    frame = frame[~np.isnan(actual)].reset_index(drop=True)
+    return frame, failures, ticker_seconds
@@ -0,0 +1,149 @@
+import numpy as np
+
+from utils import build_from_layout, flatten_nested, sum_layout
+
+
+class BalanceSheetLayout:
+    """
+    Fixed layout of a balance sheet: dotted line item keys in map order, the
+    nested layout descriptor and the contiguous column range of every section.
+    """
+
+    def __init__(self, keys: list, layout: dict):
+        self.keys = list(keys)
+        self.layout = layout
+        self.positions = {key: position for position, key in enumerate(self.keys)}
+        self.sections = {}
+        self.section_slices = {}
+        self._index_sections(layout, "")
+
+    def _index_sections(self, layout: dict, prefix: str) -> list:
+        """Indexes sections below layout and returns their leaf positions."""
+        positions = []
+        for key, value in layout.items():
+            if isinstance(value, dict):
+                path = f"{prefix}{key}"
+                section_positions = self._index_sections(value, f"{path}.")
+                self.sections[path] = value
+                self.section_slices[path] = slice(
+                    min(section_positions), max(section_positions) + 1
+                )
+                positions.extend(section_positions)
+            else:
+                positions.append(value)
+        return positions
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def section_slice(self, path: str) -> slice:
+        """Returns the column range of a section (sections are contiguous)."""
+        assert path in self.sections, f"{path} is not a balance sheet section"
+        return self.section_slices[path]
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "BalanceSheetLayout":
+        keys, _, layout = flatten_nested(d)
+        return layout_for(keys, layout)
+
+    @classmethod
+    def from_map(cls, compiled_map) -> "BalanceSheetLayout":
+        return layout_for(list(compiled_map.keys), compiled_map.layout)
+
+
+_layouts = {}
+
+
+def layout_for(keys: list, layout: dict) -> BalanceSheetLayout:
+    """Returns a shared layout instance, the dotted keys identify the tree."""
+    cache_key = tuple(keys)
+    if cache_key not in _layouts:
+        _layouts[cache_key] = BalanceSheetLayout(keys, layout)
+    return _layouts[cache_key]
+
+
+class CompactBalanceSheet:
+    """
+    Balance sheet backed by a float64 array whose last axis follows a fixed
+    BalanceSheetLayout. Leading axes hold scenarios, years, dates, etc.
+
+    Line items and sections are addressed by dotted keys, e.g.
+    bs["total_assets.current_assets.cash_and_equivalents"] or
+    bs.section("total_assets.current_assets"). Subtotals are cached until
+    the next write through __setitem__.
+    """
+
+    def __init__(self, values: np.ndarray, layout: BalanceSheetLayout):
+        values = np.asarray(values, dtype="float64")
+        assert values.shape[-1] == len(
+            layout
+        ), "Balance sheet values do not match the layout"
+        self.values = values
+        self.layout = layout
+        self._subtotals = {}
+
+    @property
+    def shape(self) -> tuple:
+        return self.values.shape[:-1]
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        if key in self.layout.positions:
+            return self.values[..., self.layout.positions[key]]
+        return self.section(key)
+
+    def __setitem__(self, key: str, value):
+        self.values[..., self.layout.positions[key]] = value
+        self._subtotals.clear()
+
+    def section(self, path: str) -> np.ndarray:
+        """Returns a read-only view of the line items of a section."""
+        view = self.values[..., self.layout.section_slice(path)]
+        view.flags.writeable = False
+        return view
+
+    def subtotal(self, path: str = None):
+        """
+        Sums a section in the same order as sum_dict_values, the whole
+        balance sheet when path is None. Results are cached.
+        """
+        if path not in self._subtotals:
+            layout = self.layout.layout if path is None else self.layout.sections[path]
+            self._subtotals[path] = sum_layout(self.values, layout)
+        return self._subtotals[path]
+
+    @property
+    def total_assets(self):
+        return self.subtotal("total_assets")
+
+    @property
+    def total_liabilities(self):
+        return self.subtotal("total_liabilities")
+
+    @property
+    def total_equity(self):
+        return self.subtotal("total_equity")
+
+    def balance_check(self):
+        """Returns total assets - total liabilities - total equity."""
+        return self.total_assets - self.total_liabilities - self.total_equity
+
+    def copy(self) -> "CompactBalanceSheet":
+        return CompactBalanceSheet(self.values.copy(), self.layout)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def row(self, index) -> "CompactBalanceSheet":
+        """Returns a view of one entry along the leading axes."""
+        return CompactBalanceSheet(self.values[index], self.layout)
+
+    def to_dict(self) -> dict:
+        """Converts a single balance sheet to the legacy nested dict format."""
+        assert self.values.ndim == 1, "Only a single balance sheet converts to a dict"
+        return build_from_layout(self.layout.layout, self.values.tolist())
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "CompactBalanceSheet":
+        """Builds a single balance sheet from the legacy nested dict format."""
+        _, values, _ = flatten_nested(d)
+        return cls(np.array(values, dtype="float64"), BalanceSheetLayout.from_dict(d))
@@ -0,0 +1,326 @@
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from company_fs import CompanyFS
+from statement_maps import load_map
+from statement_store import StatementStore
+from synthetic import SyntheticFetcher, synthetic_tickers, write_synthetic_config
+from utils import build_recursively, sum_dict_values
+from validation import validate_companies
+
+SUITES = ("extraction", "validation", "forecasting")
+
+
+def measure(name: str, function, repeat: int, items: int = 1) -> dict:
+    """
+    Times repeat calls of function, then measures peak memory of one more
+    call with tracemalloc (kept out of the timings, it slows allocation).
+
+    Args:
+        name: Benchmark name
+        function: Callable without arguments
+        repeat: Number of timed calls
+        items: Units of work per call, e.g. tickers, used for throughput
+
+    Returns:
+        Dict of latency (seconds), throughput (items per second) and peak
+        memory (bytes)
+    """
+    function()  # warm-up, fills the map and layout caches
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings = np.array(timings)
+    return {
+        "name": name,
+        "repeat": repeat,
+        "items": items,
+        "mean_seconds": float(timings.mean()),
+        "p50_seconds": float(np.percentile(timings, 50)),
+        "p95_seconds": float(np.percentile(timings, 95)),
+        "min_seconds": float(timings.min()),
+        "items_per_second": float(items / timings.mean()) if timings.mean() > 0 else None,
+        "peak_memory_bytes": int(peak),
+    }
+
+
+def extraction_benchmarks(companies: list, dates: list, repeat: int) -> list:
+    """Single-date and history extraction of all three statements."""
+    date = dates[0]
+
+    def single_date():
+        for company in companies:
+            company.get_bs(date)
+            company.get_pnl(date)
+            company.get_cf(date)
+
+    def history():
+        for company in companies:
+            company.get_bs_history()
+            company.get_pnl_history()
+            company.get_cf_history()
+
+    return [
+        measure("extraction.single_date", single_date, repeat, len(companies)),
+        measure("extraction.history", history, repeat, len(companies) * len(dates)),
+    ]
+
+
+def validation_benchmarks(companies: list, dates: list, repeat: int) -> list:
+    """Balance sheet validation and the nested dict helpers it replaced."""
+    date = dates[0]
+    nested = [company.get_bs(date, as_dict=True) for company in companies]
+    compact = [
+        (company.get_compact_bs(date), company.balancesheet[date])
+        for company in companies
+    ]
+    statements = [
+        (
+            load_map(company.ticker_name, "balancesheet", company.config_dir).tree,
+            company.balancesheet[date].to_dict(),
+        )
+        for company in companies
+    ]
+
+    def nested_sums():
+        for bs in nested:
+            sum_dict_values(bs)
+
+    def nested_build():
+        for tree, data_source in statements:
+            build_recursively(tree, data_source)
+
+    def compact_validation():
+        for bs, bs_df_series in compact:
+            CompanyFS._validate_bs(bs, bs_df_series)
+
+    def universe_validation():
+        validate_companies(companies, level="full")
+
+    return [
+        measure("validation.sum_dict_values", nested_sums, repeat, len(companies)),
+        measure("validation.build_recursively", nested_build, repeat, len(companies)),
+        measure("validation.validate_bs", compact_validation, repeat, len(companies)),
+        measure(
+            "validation.validate_companies",
+            universe_validation,
+            repeat,
+            len(companies) * len(dates),
+        ),
+    ]
+
+
+def forecasting_benchmarks(
+    companies: list,
+    dates: list,
+    horizon: int,
+    scenarios: int,
+    repeat: int,
+    long_horizon: int = 400,
+) -> list:
+    """
+    Single forecasts, a batch of growth scenarios per company and a long
+    horizon batch on the recurrence fast path.
+    """
+    base_year = dates[0]
+    overrides = {"sales_growth_rate": np.linspace(0.95, 1.2, scenarios)}
+
+    def single():
+        for company in companies:
+            company.forecast_balancesheet(base_year, num_years=horizon)
+
+    def batch():
+        for company in companies:
+            company.forecast_scenarios(base_year, num_years=horizon, overrides=overrides)
+
+    def long():
+        for company in companies:
+            company.forecast_long(base_year, long_horizon, overrides=overrides)
+
+    return [
+        measure(
+            "forecasting.forecast_balancesheet",
+            single,
+            repeat,
+            len(companies) * horizon,
+        ),
+        measure(
+            "forecasting.forecast_scenarios",
+            batch,
+            repeat,
+            len(companies) * horizon * scenarios,
+        ),
+        measure(
+            "forecasting.forecast_long",
+            long,
+            repeat,
+            len(companies) * long_horizon * scenarios,
+        ),
+    ]
+
+
+def run_benchmarks(
+    num_tickers: int = 10,
+    num_dates: int = 4,
+    horizon: int = 5,
+    scenarios: int = 100,
+    repeat: int = 10,
+    suites=SUITES,
+    seed: int = 0,
+    long_horizon: int = 400,
+) -> dict:
+    """
+    Runs the benchmark suites on synthetic statements, entirely offline.
+
+    Statements are generated into a temporary store and maps are copied
+    into a temporary config directory, so nothing touches the real caches.
+    Items per second count tickers for extraction and validation, tickers
+    x dates for history extraction and ticker-years (x scenarios for the
+    batch) for forecasting, with long_horizon periods for forecast_long.
+
+    Returns:
+        Dict with the parameters, environment and one entry per benchmark
+    """
+    for suite in suites:
+        assert suite in SUITES, f"Unknown benchmark suite {suite}"
+
+    with tempfile.TemporaryDirectory() as root:
+        tickers = synthetic_tickers(num_tickers)
+        config_dir = f"{root}/config"
+        write_synthetic_config(tickers, config_dir)
+        store = StatementStore(
+            f"{root}/store", ttl=None, fetcher=SyntheticFetcher(num_dates, seed)
+        )
+        companies = [
+            CompanyFS(ticker, store=store, config_dir=config_dir).prefetch()
+            for ticker in tickers
+        ]
+        dates = [
+            date.strftime("%Y-%m-%d") for date in companies[0].balancesheet.columns
+        ]
+
+        results = []
+        if "extraction" in suites:
+            results.extend(extraction_benchmarks(companies, dates, repeat))
+        if "validation" in suites:
+            results.extend(validation_benchmarks(companies, dates, repeat))
+        if "forecasting" in suites:
+            results.extend(
+                forecasting_benchmarks(
+                    companies, dates, horizon, scenarios, repeat, long_horizon
+                )
+            )
+
+    return {
+        "parameters": {
+            "tickers": num_tickers,
+            "dates": num_dates,
+            "horizon": horizon,
+            "long_horizon": long_horizon,
+            "scenarios": scenarios,
+            "repeat": repeat,
+            "seed": seed,
+        },
+        "environment": {
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+        },
+        "benchmarks": results,
+    }
+
+
+def compare(report: dict, baseline: dict) -> list:
+    """
+    Returns (name, baseline mean, mean, ratio) for every benchmark found in
+    both reports, ratio > 1 meaning slower than the baseline.
+    """
+    baseline_means = {
+        benchmark["name"]: benchmark["mean_seconds"]
+        for benchmark in baseline["benchmarks"]
+    }
+    rows = []
+    for benchmark in report["benchmarks"]:
+        if benchmark["name"] in baseline_means:
+            before = baseline_means[benchmark["name"]]
+            after = benchmark["mean_seconds"]
+            rows.append((benchmark["name"], before, after, after / before))
+    return rows
+
+
+def print_report(report: dict):
+    print(f"{'benchmark':<36}{'mean ms':>10}{'p95 ms':>10}{'items/s':>14}{'peak KiB':>11}")
+    for benchmark in report["benchmarks"]:
+        print(
+            f"{benchmark['name']:<36}"
+            f"{benchmark['mean_seconds'] * 1e3:>10.3f}"
+            f"{benchmark['p95_seconds'] * 1e3:>10.3f}"
+            f"{benchmark['items_per_second']:>14,.0f}"
+            f"{benchmark['peak_memory_bytes'] / 1024:>11,.0f}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Offline benchmarks of extraction, validation and forecasting."
+    )
+    parser.add_argument("--tickers", type=int, default=10, help="Synthetic tickers")
+    parser.add_argument("--dates", type=int, default=4, help="Statement dates per ticker")
+    parser.add_argument("--horizon", type=int, default=5, help="Forecast years")
+    parser.add_argument(
+        "--long-horizon", type=int, default=400, help="Periods of forecast_long"
+    )
+    parser.add_argument("--scenarios", type=int, default=100, help="Batch scenarios")
+    parser.add_argument("--repeat", type=int, default=10, help="Timed calls per benchmark")
+    parser.add_argument("--seed", type=int, default=0, help="Synthetic data seed")
+    parser.add_argument(
+        "--suite", action="append", choices=SUITES, help="Suites to run, default all"
+    )
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    parser.add_argument("--compare", help="Baseline JSON report to compare against")
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(
+        num_tickers=args.tickers,
+        num_dates=args.dates,
+        horizon=args.horizon,
+        scenarios=args.scenarios,
+        repeat=args.repeat,
+        suites=args.suite or SUITES,
+        seed=args.seed,
+        long_horizon=args.long_horizon,
+    )
+    print_report(report)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print()
+        if baseline["parameters"] != report["parameters"]:
+            print("Warning: baseline was run with different parameters.")
+        print(f"{'benchmark':<36}{'baseline ms':>12}{'current ms':>12}{'ratio':>8}")
+        for name, before, after, ratio in compare(report, baseline):
+            print(f"{name:<36}{before * 1e3:>12.3f}{after * 1e3:>12.3f}{ratio:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
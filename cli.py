@@ -0,0 +1,273 @@
+import argparse
+import json
+import sys
+import time
+
+# Heavy modules (pandas, the forecast engine) are imported inside the
+# functions that need them, so --help and argument errors return at once.
+# yfinance is only imported if a statement has to be fetched.
+
+ESTIMATOR_METHODS = ("latest", "mean", "median", "trimmed")
+
+
+def read_overrides(path: str):
+    """
+    Reads override sets from a file: a .json file holding an override dict,
+    a list of override dicts or a dict of arrays per driver, or a .csv file
+    with one override set per row.
+    """
+    if path.lower().endswith(".csv"):
+        import pandas as pd
+
+        return pd.read_csv(path)
+    with open(path) as f:
+        return json.load(f)
+
+
+def read_tickers(path: str) -> list:
+    """Reads one ticker per line, ignoring blank lines and # comments."""
+    with open(path) as f:
+        lines = [line.split("#")[0].strip() for line in f]
+    return [line for line in lines if line]
+
+
+def grid_requests(tickers: list, dates, horizons: list, overrides, grid: bool):
+    """Yields one request per ticker and base date (None for the latest)."""
+    for ticker in tickers:
+        for date in dates or [None]:
+            yield {
+                "ticker": ticker,
+                "base_year": date,
+                "horizons": horizons,
+                "overrides": overrides,
+                "grid": grid,
+            }
+
+
+def stream_requests(lines, horizons: list, overrides, grid: bool):
+    """
+    Yields requests parsed from JSON lines such as
+    {"ticker": "MSFT", "base_year": "2023-06-30", "num_years": 3,
+    "overrides": {"sales_growth_rate": 1.1}}. Missing fields default to
+    the command line arguments; num_years stands for horizons 1..num_years.
+    A line that is not valid JSON is yielded as the error it raises.
+    """
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line)
+            assert isinstance(request, dict), "Request must be a JSON object"
+            assert "ticker" in request, "Request has no ticker"
+        except (ValueError, AssertionError) as e:
+            yield e
+            continue
+        if "num_years" in request:
+            request["horizons"] = list(range(1, request.pop("num_years") + 1))
+        request.setdefault("base_year", None)
+        request.setdefault("horizons", horizons)
+        request.setdefault("overrides", overrides)
+        request.setdefault("grid", grid)
+        yield request
+
+
+class Server:
+    """
+    Serves forecast requests one after another in a single process,
+    writing the rows of each to a sink as soon as it is computed. The
+    CompanyFS objects of the most recently used tickers are kept in a
+    CompanyPool, so their statements, driver estimates and cached forecasts
+    are reused.
+    """
+
+    def __init__(
+        self, sink, errors=sys.stderr, max_companies: int = 256, **company_kwargs
+    ):
+        """
+        Args:
+            sink: forecast_output.ForecastSink receiving the rows
+            errors: Text stream receiving one JSON line per failed request
+            max_companies: Maximum number of CompanyFS objects kept
+            company_kwargs: Keyword arguments of every CompanyFS
+        """
+        from company_pool import CompanyPool
+
+        self.sink = sink
+        self.errors = errors
+        self.companies = CompanyPool(max_companies, **company_kwargs)
+        self.stats = {"requests": 0, "succeeded": 0, "failed": 0}
+
+    def add_companies(self, companies: dict):
+        """
+        Adds already loaded CompanyFS objects, e.g. from load_companies
+        called with the server's CompanyFS keyword arguments.
+        """
+        for company in companies.values():
+            self.companies.add(company)
+
+    def company(self, ticker: str):
+        return self.companies.get(ticker)
+
+    def serve(self, request: dict):
+        """Serves a single request, reporting a failure instead of raising."""
+        from forecast_output import forecast_frame
+        from universe import latest_date
+
+        self.stats["requests"] += 1
+        ticker, base_date = None, None
+        try:
+            if isinstance(request, Exception):
+                raise request
+            ticker = request["ticker"].upper()
+            base_date = request["base_year"]
+            horizons = sorted(set(request["horizons"]))
+            assert horizons and horizons[0] > 0, "Horizons must be positive"
+            company = self.company(ticker)
+            if base_date is None:
+                base_date = latest_date(company)
+            forecast = company.forecast_scenarios(
+                base_date,
+                num_years=horizons[-1],
+                overrides=request["overrides"],
+                grid=request["grid"],
+            )
+            self.sink.write(forecast_frame(ticker, base_date, forecast, horizons))
+            self.stats["succeeded"] += 1
+        except Exception as e:
+            self.fail(ticker, base_date, f"{type(e).__name__}: {e}")
+
+    def fail(self, ticker: str, base_date: str, error: str):
+        """Reports a failed request on the error stream."""
+        self.stats["failed"] += 1
+        record = {"ticker": ticker, "base_date": base_date, "error": error}
+        self.errors.write(json.dumps(record) + "\n")
+        self.errors.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=(
+            "Forecasts balance sheets for many tickers, dates, horizons and "
+            "override sets in one process, streaming the rows as they are "
+            "computed. Failed requests are reported as JSON lines on stderr."
+        )
+    )
+    parser.add_argument("tickers", nargs="*", help="Ticker symbols")
+    parser.add_argument("--tickers-file", help="File with one ticker per line")
+    parser.add_argument(
+        "--dates", nargs="+", help="Base dates (YYYY-MM-DD), default the latest"
+    )
+    parser.add_argument(
+        "--horizons", nargs="+", type=int, default=[1], help="Forecast years to write"
+    )
+    parser.add_argument(
+        "--overrides", help="Override sets: .json dict, list, dict of arrays or .csv"
+    )
+    parser.add_argument(
+        "--grid", action="store_true", help="Cartesian product of a dict of arrays"
+    )
+    parser.add_argument(
+        "--requests",
+        help='JSON lines of requests ({"ticker", "base_year", "num_years" or '
+        '"horizons", "overrides", "grid"}), "-" for stdin',
+    )
+    parser.add_argument(
+        "--output", default="-", help='.jsonl, .csv or .parquet file, "-" for stdout'
+    )
+    parser.add_argument("--store-root", help="Statement store directory")
+    parser.add_argument(
+        "--offline", action="store_true", help="Only use statements in the store"
+    )
+    parser.add_argument("--config-dir", help="Directory holding the <TICKER> maps")
+    parser.add_argument(
+        "--frequency", choices=("annual", "quarterly"), default="annual"
+    )
+    parser.add_argument("--validation", choices=("off", "fast", "full"), default="full")
+    parser.add_argument(
+        "--estimator", choices=ESTIMATOR_METHODS, help="Estimate drivers from history"
+    )
+    parser.add_argument("--window", type=int, help="Estimator window in periods")
+    parser.add_argument("--cache-dir", help="Forecast cache directory, shareable")
+    parser.add_argument(
+        "--batch", type=int, default=64, help="Tickers loaded concurrently at once"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=16, help="Statement requests in flight"
+    )
+    args = parser.parse_args(argv)
+
+    tickers = list(args.tickers)
+    if args.tickers_file:
+        tickers.extend(read_tickers(args.tickers_file))
+    if not tickers and not args.requests:
+        parser.error("no tickers or --requests given")
+    if args.batch <= 0:
+        parser.error("--batch must be greater than 0")
+    overrides = read_overrides(args.overrides) if args.overrides else None
+
+    from async_loader import load_companies
+    from driver_estimation import DriverEstimator
+    from forecast_cache import ForecastCache
+    from forecast_output import open_sink
+    from statement_maps import DEFAULT_CONFIG_DIR
+    from statement_store import DEFAULT_STORE_ROOT, StatementStore
+
+    store = StatementStore(args.store_root or DEFAULT_STORE_ROOT, offline=args.offline)
+    company_kwargs = {
+        "store": store,
+        "config_dir": args.config_dir or DEFAULT_CONFIG_DIR,
+        "validation": args.validation,
+        "frequency": args.frequency,
+        "estimator": (
+            DriverEstimator(args.estimator, window=args.window)
+            if args.estimator
+            else None
+        ),
+        "cache": ForecastCache(directory=args.cache_dir) if args.cache_dir else None,
+    }
+
+    start = time.perf_counter()
+    with open_sink(args.output) as sink:
+        server = Server(sink, max_companies=max(256, args.batch), **company_kwargs)
+        tickers = list(dict.fromkeys(ticker.upper() for ticker in tickers))
+        for i in range(0, len(tickers), args.batch):
+            # load a batch of tickers concurrently, then forecast them
+            batch = tickers[i : i + args.batch]
+            loaded = load_companies(
+                batch, concurrency=args.concurrency, **company_kwargs
+            )
+            server.add_companies(loaded.companies)
+            for ticker, error in loaded.errors.items():
+                for date in args.dates or [None]:
+                    server.stats["requests"] += 1
+                    server.fail(ticker, date, error)
+            for request in grid_requests(
+                list(loaded.companies), args.dates, args.horizons, overrides, args.grid
+            ):
+                server.serve(request)
+
+        if args.requests:
+            lines = sys.stdin if args.requests == "-" else open(args.requests)
+            try:
+                for request in stream_requests(
+                    lines, args.horizons, overrides, args.grid
+                ):
+                    server.serve(request)
+            finally:
+                if lines is not sys.stdin:
+                    lines.close()
+    elapsed = time.perf_counter() - start
+
+    stats = dict(
+        server.stats,
+        rows=sink.rows_written,
+        elapsed_seconds=round(elapsed, 3),
+        requests_per_second=round(server.stats["requests"] / elapsed, 1),
+    )
+    print(json.dumps(stats), file=sys.stderr)
+    return 1 if server.stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,268 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import count, stage
+from statement_maps import DEFAULT_CONFIG_DIR, load_map
+from statement_store import (
+    ALL_STATEMENTS,
+    FREQUENCY_STATEMENTS,
+    StatementNotCachedError,
+    StatementSource,
+    default_store,
+    normalize_statement,
+)
+from validation import TOTAL_ASSETS, TOTAL_EQUITY, TOTAL_LIABILITIES
+
+INDEX_FILE = "index.json"
+
+# Source rows read outside the maps, by the "full" balance sheet validation,
+# per statement
+EXTRA_LABELS = {"balancesheet": (TOTAL_ASSETS, TOTAL_LIABILITIES, TOTAL_EQUITY)}
+
+
+class ColumnarStore(StatementSource):
+    """
+    Statements of many tickers packed into one dense float64 array per
+    statement, shaped (tickers, dates, line items), in a directory of .npy
+    files memory-mapped read-only. Every process attaching to the directory
+    shares the same pages, and a pickled store only carries its path and
+    settings, so worker processes attach instead of copying.
+
+    The line items of a statement are the source rows its ticker maps read
+    (and the Yahoo totals validation compares against), in one union
+    across tickers; rows a ticker does not report are NaN. Dates are the
+    ticker's own, padded with NaT up to the longest history.
+
+    The store is a StatementSource like StatementStore: every packed
+    statement is a DataFrame view of the shared array, never a copy. The
+    files are never written after build, so an online store serves the
+    statements of tickers it does not hold from the fetcher without
+    storing them.
+    """
+
+    def __init__(self, root: str, offline: bool = True, fetcher=None):
+        """
+        Attaches to a store written by ColumnarStore.build.
+
+        Args:
+            root: Directory holding the store
+            offline: Never fetch, raise StatementNotCachedError for a
+                statement that is not packed
+            fetcher: Callable (ticker, statement) -> DataFrame used for a
+                statement that is not packed when the store is not offline
+        """
+        super().__init__(offline, fetcher)
+        self.root = root
+        with open(os.path.join(root, INDEX_FILE)) as f:
+            index = json.load(f)
+        self.frequency = index["frequency"]
+        self.tickers = list(index["tickers"])
+        self.skipped = dict(index["skipped"])
+        self.statements = list(index["labels"])
+        self.ticker_positions = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.labels = {
+            statement: pd.Index(labels, dtype=object)
+            for statement, labels in index["labels"].items()
+        }
+        self.label_positions = {
+            statement: {label: i for i, label in enumerate(labels)}
+            for statement, labels in index["labels"].items()
+        }
+        self.values = {}
+        self.dates = {}
+        self.num_dates = {}
+        for statement in self.statements:
+            self.values[statement] = np.load(
+                self._path(statement, "values"), mmap_mode="r"
+            )
+            self.dates[statement] = np.load(self._path(statement, "dates"))
+            self.num_dates[statement] = np.load(self._path(statement, "num_dates"))
+
+    def __reduce__(self):
+        # workers reattach to the files instead of receiving the arrays
+        return (ColumnarStore, (self.root, self.offline, self.fetcher))
+
+    def __repr__(self):
+        return (
+            f"ColumnarStore({len(self.tickers)} tickers, {self.frequency}, "
+            f"{self.nbytes / 2**20:.1f} MiB, root={self.root!r})"
+        )
+
+    def __contains__(self, ticker: str) -> bool:
+        return ticker.upper() in self.ticker_positions
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the value arrays."""
+        return sum(values.nbytes for values in self.values.values())
+
+    def _path(self, statement: str, name: str) -> str:
+        return os.path.join(self.root, f"{statement}.{name}.npy")
+
+    def cached(self, ticker: str, statement: str):
+        """
+        Gets a packed statement as a read-only DataFrame (line items x
+        dates) backed by the shared array. See StatementSource.cached.
+        """
+        assert statement in ALL_STATEMENTS, f"Unknown statement {statement}"
+        ticker = ticker.upper()
+        position = self.ticker_positions.get(ticker)
+        if position is None or statement not in self.values:
+            if self.offline:
+                raise StatementNotCachedError(
+                    f"{statement} for {ticker} is not in the columnar store "
+                    f"{self.root}."
+                )
+            count("columnar.miss", ticker)
+            return None
+
+        count("columnar.hit", ticker)
+        num_dates = self.num_dates[statement][position]
+        # (dates, line items) rows of one ticker are contiguous; the
+        # transposed view becomes the DataFrame's block without a copy
+        block = self.values[statement][position, :num_dates]
+        return pd.DataFrame(
+            block.T,
+            index=self.labels[statement],
+            columns=pd.DatetimeIndex(self.dates[statement][position, :num_dates]),
+            copy=False,
+        )
+
+    def write(self, ticker: str, statement: str, frame: pd.DataFrame) -> pd.DataFrame:
+        """
+        The packed files are read-only: returns a fetched statement as a
+        store serves it, without storing it.
+        """
+        return normalize_statement(frame)
+
+    def item(self, statement: str, label: str) -> np.ndarray:
+        """
+        A source row of every ticker at once, a (tickers, dates) view.
+        """
+        assert label in self.label_positions[statement], (
+            f"{label} is not in the {statement} of the store"
+        )
+        return self.values[statement][:, :, self.label_positions[statement][label]]
+
+    @classmethod
+    def build(
+        cls,
+        root: str,
+        tickers: list,
+        store: StatementSource = None,
+        config_dir: str = DEFAULT_CONFIG_DIR,
+        frequency: str = "annual",
+        offline: bool = True,
+        fetcher=None,
+    ) -> "ColumnarStore":
+        """
+        Packs the statements of many tickers into a columnar store.
+
+        Statements are read through the statement store and written to
+        memory-mapped files one ticker at a time, so building never holds
+        more than one ticker in memory. They are read twice, to size the
+        arrays and to fill them, and the build fails when a statement's
+        dates change in between; build from an offline store or one
+        without a TTL to avoid refetching. Tickers whose statements or maps
+        cannot be loaded are skipped and listed in the skipped attribute.
+
+        Args:
+            root: Directory to write the store to, e.g. under /dev/shm for
+                a RAM-backed store
+            tickers: Ticker symbols
+            store: Statement store to read from, defaults to the shared
+                on-disk store
+            config_dir: Directory holding the <TICKER>/*_map.json files
+            frequency: "annual" or "quarterly" statements
+            offline: offline of the returned store, see __init__
+            fetcher: fetcher of the returned store, see __init__
+
+        Returns:
+            The ColumnarStore attached to root
+        """
+        assert isinstance(tickers, (list, tuple)), "Tickers must be a list"
+        assert frequency in FREQUENCY_STATEMENTS, f"Unknown frequency {frequency}"
+        store = store if store is not None else default_store()
+        sources = FREQUENCY_STATEMENTS[frequency]
+        tickers = list(dict.fromkeys(ticker.upper() for ticker in tickers))
+
+        # first pass: the line item union and the dates of every ticker
+        labels = {
+            source: dict.fromkeys(EXTRA_LABELS.get(statement, ()))
+            for statement, source in sources.items()
+        }
+        dates = {source: {} for source in sources.values()}
+        skipped = {}
+        with stage("columnar.index"):
+            for ticker in tickers:
+                try:
+                    maps = {
+                        statement: load_map(ticker, statement, config_dir)
+                        for statement in sources
+                    }
+                    frames = {
+                        source: store.get(ticker, source) for source in sources.values()
+                    }
+                except Exception as e:
+                    skipped[ticker] = f"{type(e).__name__}: {e}"
+                    continue
+                for statement, source in sources.items():
+                    labels[source].update(dict.fromkeys(maps[statement].labels))
+                    dates[source][ticker] = pd.DatetimeIndex(frames[source].columns)
+        packed = [ticker for ticker in tickers if ticker not in skipped]
+        assert packed, "No ticker could be loaded"
+
+        os.makedirs(root, exist_ok=True)
+        with stage("columnar.write"):
+            for source in sources.values():
+                source_labels = pd.Index(list(labels[source]), dtype=object)
+                max_dates = max(len(dates[source][ticker]) for ticker in packed)
+                values = np.lib.format.open_memmap(
+                    os.path.join(root, f"{source}.values.npy"),
+                    mode="w+",
+                    dtype="float64",
+                    shape=(len(packed), max_dates, len(source_labels)),
+                )
+                values[:] = np.nan
+                date_array = np.full(
+                    (len(packed), max_dates), np.datetime64("NaT"), "datetime64[ns]"
+                )
+                num_dates = np.zeros(len(packed), dtype="int64")
+                for position, ticker in enumerate(packed):
+                    frame = store.get(ticker, source)
+                    # refetched since the first pass (a store with a TTL):
+                    # its dates would not match the sizes of the arrays
+                    assert pd.DatetimeIndex(frame.columns).equals(
+                        dates[source][ticker]
+                    ), (
+                        f"{source} of {ticker} changed while building the "
+                        f"columnar store, build it again"
+                    )
+                    rows = frame.index.get_indexer(source_labels)
+                    found = rows >= 0
+                    block = frame.to_numpy(dtype="float64").T  # (dates, rows)
+                    num = block.shape[0]
+                    values[position, :num][:, found] = block[:, rows[found]]
+                    date_array[position, :num] = dates[source][ticker].to_numpy(
+                        dtype="datetime64[ns]"
+                    )
+                    num_dates[position] = num
+                values.flush()
+                del values
+                np.save(os.path.join(root, f"{source}.dates.npy"), date_array)
+                np.save(os.path.join(root, f"{source}.num_dates.npy"), num_dates)
+
+            index = {
+                "frequency": frequency,
+                "tickers": packed,
+                "skipped": skipped,
+                "labels": {source: list(labels[source]) for source in sources.values()},
+            }
+            tmp_path = os.path.join(root, f"{INDEX_FILE}.{os.getpid()}.tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(index, f)
+            os.replace(tmp_path, os.path.join(root, INDEX_FILE))
+        return cls(root, offline, fetcher)
@@ -1,98 +1,259 @@
-import json
-import os
-import pprint
+import hashlib
 import re
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 import pandas as pd
-import yfinance as yf
 
-from utils import build_recursively, sum_dict_values
-
-yf.set_tz_cache_location(".yf_cache")
+from balance_sheet import BalanceSheetLayout, CompactBalanceSheet
+from driver_estimation import (
+    DriverEstimator,
+    DriverHistory,
+    driver_history,
+    estimate_drivers,
+)
+from forecast_cache import ForecastCache
+from forecast_engine import (
+    DEFAULT_SALES_GROWTH_RATE,
+    DRIVER_ATTRIBUTES,
+    RELATIVE_BALANCE_TOLERANCE,
+    ScenarioForecast,
+    build_driver_table,
+    check_balance,
+    forecast_scenarios,
+    forecast_year,
+    iter_forecast_scenarios,
+)
+from forecast_fast import forecast_long
+from forecast_rules import ForecastProgram, NonStandardRulesError, load_rules
+from forecast_session import ForecastSession
+from instrumentation import count, stage
+from statement_maps import DEFAULT_CONFIG_DIR, load_map
+from statement_store import (
+    FREQUENCY_STATEMENTS,
+    PERIODS_PER_YEAR,
+    STATEMENTS,
+    StatementSource,
+    default_store,
+    load_yfinance,
+)
+from utils import sum_dict_values
+from validation import (
+    VALIDATION_LEVELS,
+    ValidationReport,
+    validate_balance_sheet,
+    validate_income_statement,
+)
 
 
 class CompanyFS:
-    def __init__(self, ticker: str):
+    def __init__(
+        self,
+        ticker: str,
+        store: StatementSource = None,
+        config_dir: str = DEFAULT_CONFIG_DIR,
+        validation: str = "full",
+        frequency: str = "annual",
+        estimator: DriverEstimator = None,
+        cache: ForecastCache = None,
+    ):
+        """
+        Args:
+            ticker: Ticker symbol
+            store: Statement store to read from, defaults to the shared
+                on-disk store which only calls yfinance on a cache miss
+            config_dir: Directory holding the <TICKER>/*_map.json files and
+                the optional <TICKER>/forecast_rules.json
+            validation: Validation level of get_bs/get_pnl, "off", "fast"
+                (identities within a statement) or "full" (also the Yahoo
+                totals and missing line items)
+            frequency: "annual" or "quarterly" statements. Quarterly
+                companies forecast one quarter per period wherever a method
+                says year, with the default sales growth scaled to a quarter
+            estimator: DriverEstimator used by every forecast for the drivers
+                it estimates from the history up to the base year, None to
+                derive every driver from the base year alone
+            cache: ForecastCache serving repeated forecast_scenarios and
+                forecast_balancesheet calls, None to always recompute
+        """
         assert isinstance(ticker, str), "Ticker must be a string"
+        assert validation in VALIDATION_LEVELS, f"Unknown validation level {validation}"
+        assert frequency in FREQUENCY_STATEMENTS, f"Unknown frequency {frequency}"
         self.ticker_name = ticker.upper()
-        self.ticker = yf.Ticker(ticker.upper())
+        self.store = store if store is not None else default_store()
+        self.config_dir = config_dir
+        self.validation = validation
+        self.frequency = frequency
+        self.periods_per_year = PERIODS_PER_YEAR[frequency]
+        # statement name -> name in the store, e.g. quarterly_balancesheet
+        self._sources = FREQUENCY_STATEMENTS[frequency]
+        self.estimator = estimator
+        self.cache = cache
+
+        # statements are loaded from the store on first access
+        self._statements = {}
+        # DriverEstimator.key -> estimated drivers (dates x drivers), cleared
+        # whenever a statement is replaced
+        self._driver_estimates = {}
+        # hash of the loaded statements, see fingerprint
+        self._fingerprint = None
+        # (base year, validation, estimator key, forecast program) -> base
+        # balance sheet, sales and drivers, cleared whenever a statement is
+        # replaced
+        self._forecast_bases = {}
+
+    @property
+    def balancesheet(self) -> pd.DataFrame:
+        return self._load_statement("balancesheet")
+
+    @balancesheet.setter
+    def balancesheet(self, frame: pd.DataFrame):
+        self._statements["balancesheet"] = frame
+        self._driver_estimates.clear()
+        self._forecast_bases.clear()
+        self._fingerprint = None
+
+    @property
+    def incomestatement(self) -> pd.DataFrame:
+        return self._load_statement("incomestatement")
+
+    @incomestatement.setter
+    def incomestatement(self, frame: pd.DataFrame):
+        self._statements["incomestatement"] = frame
+        self._driver_estimates.clear()
+        self._forecast_bases.clear()
+        self._fingerprint = None
+
+    @property
+    def cashflow(self) -> pd.DataFrame:
+        return self._load_statement("cashflow")
+
+    @cashflow.setter
+    def cashflow(self, frame: pd.DataFrame):
+        self._statements["cashflow"] = frame
+        self._driver_estimates.clear()
+        self._forecast_bases.clear()
+        self._fingerprint = None
+
+    def _load_statement(self, statement: str) -> pd.DataFrame:
+        if statement not in self._statements:
+            with stage(f"load.{statement}", self.ticker_name):
+                self._statements[statement] = self.store.get(
+                    self.ticker_name, self._sources[statement]
+                )
+        return self._statements[statement]
+
+    def prefetch(self, *statements: str) -> "CompanyFS":
+        """
+        Loads statements concurrently, all three when none are given.
 
-        self.balancesheet = self.ticker.balancesheet
-        self.incomestatement = self.ticker.financials
-        self.cashflow = self.ticker.cashflow
+        Args:
+            statements: Any of "balancesheet", "incomestatement", "cashflow"
+        """
+        statements = statements or tuple(STATEMENTS)
+        for statement in statements:
+            assert statement in STATEMENTS, f"Unknown statement {statement}"
+
+        missing = [
+            statement
+            for statement in dict.fromkeys(statements)
+            if statement not in self._statements
+        ]
+        if len(missing) == 1:
+            self._load_statement(missing[0])
+        elif missing:
+            with ThreadPoolExecutor(max_workers=len(missing)) as executor:
+                frames = executor.map(
+                    lambda statement: self.store.get(
+                        self.ticker_name, self._sources[statement]
+                    ),
+                    missing,
+                )
+                self._statements.update(zip(missing, frames))
+        return self
+
+    def fingerprint(self) -> str:
+        """
+        Hash of the values, line items and dates of every statement, part
+        of the forecast cache key. Loads the statements that are not loaded.
+        """
+        if self._fingerprint is None:
+            self.prefetch()
+            digest = hashlib.sha256()
+            for statement in STATEMENTS:
+                frame = self._statements[statement]
+                digest.update(statement.encode())
+                digest.update("\0".join(map(str, frame.index)).encode())
+                digest.update(pd.DatetimeIndex(frame.columns).asi8.tobytes())
+                digest.update(frame.to_numpy(dtype="float64").tobytes())
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    @property
+    def ticker(self):
+        """yfinance.Ticker of the company, importing yfinance on first use."""
+        return load_yfinance().Ticker(self.ticker_name)
+
+    @property
+    def forecast_program(self) -> ForecastProgram:
+        """
+        The ticker's forecast rules (config/<TICKER>/forecast_rules.json, or
+        the standard rules without one) compiled against its balance sheet
+        layout. Compiled once and recompiled when either file changes.
+        """
+        layout = BalanceSheetLayout.from_map(
+            load_map(self.ticker_name, "balancesheet", self.config_dir)
+        )
+        return load_rules(self.ticker_name, self.config_dir).compile(layout)
 
     def get_bs_df(self, date: str) -> pd.Series:
         assert isinstance(date, str), "Date must be a string"
         assert date in self.balancesheet.columns, "Date not found in balancesheet"
         return self.balancesheet[date]
 
-    def get_bs(self, date: str) -> dict:
+    def get_bs(self, date: str, as_dict: bool = True):
         """
         Gets the balance sheet for a given date with predefined structure.
+
+        Args:
+            date: Report date in YYYY-MM-DD format
+            as_dict: Return the nested dictionary, otherwise a flat Series
+                keyed by dotted line item keys
         """
         assert isinstance(date, str), "Date must be a string"
         assert date in self.balancesheet.columns, "Date not found in balancesheet"
 
-        # find configurations
-        folder_path = f"config/{self.ticker_name}"
-        if not os.path.exists(folder_path):
-            assert False, f"Folder {folder_path} does not exist. Please create it."
-
-        # load balance sheet map
-        balance_sheet_map_path = f"{folder_path}/balance_sheet_map.json"
-        assert os.path.exists(balance_sheet_map_path), (
-            f"Balance sheet map file {balance_sheet_map_path} does not exist. "
-            "Please create it."
-        )
-
-        balance_sheet_map = {}
-        # load the balance sheet map
-        with open(balance_sheet_map_path, "r") as f:
-            balance_sheet_map = json.load(f)
+        balance_sheet_map = load_map(self.ticker_name, "balancesheet", self.config_dir)
 
         bs_df_series = self.get_bs_df(date)
         assert isinstance(bs_df_series, pd.Series), "Balance sheet data is not a Series"
 
-        # build the balance sheet dictionary recursively
-        bs_dict = build_recursively(balance_sheet_map, bs_df_series)
-        assert isinstance(bs_dict, dict), "Balance sheet data is not a dictionary"
-
-        # validation
-        assert (
-            sum_dict_values(bs_dict["total_assets"]) == bs_df_series["Total Assets"]
-        ), "Total assets do not match the sum of current and non-current assets."
-
-        assert (
-            sum_dict_values(bs_dict["total_liabilities"])
-            == bs_df_series["Total Liabilities Net Minority Interest"]
-        ), "Total liabilities do not match the sum of current and non-current liabilities."
-
-        assert (
-            sum_dict_values(bs_dict["total_equity"])
-            == bs_df_series["Total Equity Gross Minority Interest"]
-        ), "Total equity does not match the sum of capital stock, retained earnings, and gains/losses not affecting retained earnings."
-
-        assert (
-            sum_dict_values(bs_dict["total_assets"])
-            - sum_dict_values(bs_dict["total_liabilities"])
-            - sum_dict_values(bs_dict["total_equity"])
-            == 0
-        ), "The balance sheet equation does not hold: Total Assets = Total Liabilities + Total Equity."
-
-        assert (
-            bs_df_series["Total Assets"]
-            - bs_df_series["Total Liabilities Net Minority Interest"]
-            - bs_df_series["Total Equity Gross Minority Interest"]
-            == 0
-        ), "The real balance sheet equation does not hold: Total Assets = Total Liabilities + Total Equity."
-
-        assert sum_dict_values(bs_dict) == (
-            bs_df_series["Total Assets"]
-            + bs_df_series["Total Liabilities Net Minority Interest"]
-            + bs_df_series["Total Equity Gross Minority Interest"]
-        ), "Total balance sheet does not match the actual sum of total assets, total liabilities, and total equity."
-
-        return bs_dict
+        with stage("extract.balancesheet", self.ticker_name):
+            bs = balance_sheet_map.extract_series(bs_df_series)
+
+        if self.validation != "off":
+            with stage("validate.balancesheet", self.ticker_name):
+                self._validate_bs(
+                    CompactBalanceSheet(
+                        bs.to_numpy(), BalanceSheetLayout.from_map(balance_sheet_map)
+                    ),
+                    bs_df_series,
+                    level=self.validation,
+                )
+
+        if not as_dict:
+            return bs
+        return balance_sheet_map.to_dict(bs.to_numpy())
+
+    def get_compact_bs(self, date: str) -> CompactBalanceSheet:
+        """
+        Gets the validated balance sheet for a given date as a CompactBalanceSheet.
+        """
+        balance_sheet_map = load_map(self.ticker_name, "balancesheet", self.config_dir)
+        return CompactBalanceSheet(
+            self.get_bs(date, as_dict=False).to_numpy(),
+            BalanceSheetLayout.from_map(balance_sheet_map),
+        )
 
     def get_pnl_df(self, date: str) -> pd.Series:
         assert isinstance(date, str), "Date must be a string"
@@ -100,60 +261,34 @@ class CompanyFS:
 
         return self.incomestatement[date]
 
-    def get_pnl(self, date: str) -> dict:
+    def get_pnl(self, date: str, as_dict: bool = True):
         """
         Gets the income statement for a given date with predefined structure.
+
+        Args:
+            date: Report date in YYYY-MM-DD format
+            as_dict: Return the dictionary, otherwise a Series keyed by line item
         """
         assert isinstance(date, str), "Date must be a string"
         assert date in self.incomestatement.columns, "Date not found in incomestatement"
 
-        # find configurations
-        folder_path = f"config/{self.ticker_name}"
-        if not os.path.exists(folder_path):
-            assert False, f"Folder {folder_path} does not exist. Please create it."
-
-        # load income statement map
-        income_statement_map_path = f"{folder_path}/income_statement_map.json"
-        assert os.path.exists(income_statement_map_path), (
-            f"Income statement map file {income_statement_map_path} does not exist. "
-            "Please create it."
-        )
-
-        income_statement_map = {}
-        # load the income statement map
-        with open(income_statement_map_path, "r") as f:
-            income_statement_map = json.load(f)
+        income_statement_map = load_map(self.ticker_name, "incomestatement", self.config_dir)
 
         pnl_df_series = self.get_pnl_df(date)
         assert isinstance(
             pnl_df_series, pd.Series
         ), "Income statement data is not a Series"
 
-        # build the income statement dictionary recursively
-        pnl_dict = build_recursively(income_statement_map, pnl_df_series)
-        assert isinstance(pnl_dict, dict), "Income statement data is not a dictionary"
-
-        # validation
-        assert (
-            pnl_dict["total_revenue"] - pnl_dict["cost_of_revenue"]
-            == pnl_dict["gross_profit"]
-        ), "Gross profit does not match total revenue minus cost of revenue."
-        assert (
-            pnl_dict["gross_profit"] - pnl_dict["operating_expenses"]
-            == pnl_dict["operating_income"]
-        ), "Operating income does not match gross profit minus operating expenses."
-        assert (
-            pnl_dict["operating_income"]
-            + pnl_dict["net_non_operating_interest_income_expense"]
-            + pnl_dict["other_income_expense"]
-            == pnl_dict["pretax_income"]
-        ), "Pretax income does not match operating income minus net non-operating interest income/expense and other income/expense."
-        assert (
-            pnl_dict["pretax_income"] - pnl_dict["tax_provision"]
-            == pnl_dict["net_income_common_stockholders"]
-        ), "Net income does not match pretax income minus tax provision."
-
-        return pnl_dict
+        with stage("extract.incomestatement", self.ticker_name):
+            pnl = income_statement_map.extract_series(pnl_df_series)
+
+        if self.validation != "off":
+            with stage("validate.incomestatement", self.ticker_name):
+                self._validate_pnl(pnl, level=self.validation)
+
+        if not as_dict:
+            return pnl
+        return income_statement_map.to_dict(pnl.to_numpy())
 
     def get_cf_df(self, date: str) -> pd.Series:
         assert isinstance(date, str), "Date must be a string"
@@ -161,38 +296,188 @@ class CompanyFS:
 
         return self.cashflow[date]
 
-    def get_cf(self, date: str) -> dict:
+    def get_cf(self, date: str, as_dict: bool = True):
         """
         Gets the cash flow statement for a given date with predefined structure.
+
+        Args:
+            date: Report date in YYYY-MM-DD format
+            as_dict: Return the dictionary, otherwise a Series keyed by line item
         """
         assert isinstance(date, str), "Date must be a string"
         assert date in self.cashflow.columns, "Date not found in cashflow"
 
-        # find configurations
-        folder_path = f"config/{self.ticker_name}"
-        if not os.path.exists(folder_path):
-            assert False, f"Folder {folder_path} does not exist. Please create it."
+        cash_flow_map = load_map(self.ticker_name, "cashflow", self.config_dir)
+
+        cf_df_series = self.get_cf_df(date)
+        assert isinstance(cf_df_series, pd.Series), "Cash flow data is not a Series"
+
+        with stage("extract.cashflow", self.ticker_name):
+            cf = cash_flow_map.extract_series(cf_df_series)
+
+        if not as_dict:
+            return cf
+        return cash_flow_map.to_dict(cf.to_numpy())
+
+    def get_bs_history(self, dates: list = None) -> pd.DataFrame:
+        """
+        Gets the balance sheet for every available date in one pass.
 
-        # load cash flow map
-        cash_flow_map_path = f"{folder_path}/cash_flow_map.json"
-        assert os.path.exists(cash_flow_map_path), (
-            f"Cash flow map file {cash_flow_map_path} does not exist. "
-            "Please create it."
+        Args:
+            dates: Report dates to include, all dates when None
+
+        Returns:
+            DataFrame indexed by dotted line item keys with one column per date
+        """
+        balance_sheet_map = load_map(self.ticker_name, "balancesheet", self.config_dir)
+        bs_df = self._select_dates(self.balancesheet, dates)
+
+        with stage("extract.balancesheet_history", self.ticker_name):
+            history = balance_sheet_map.extract_frame(bs_df)
+        if self.validation != "off":
+            with stage("validate.balancesheet_history", self.ticker_name):
+                self._validate_bs(
+                    CompactBalanceSheet(
+                        history.to_numpy().T,
+                        BalanceSheetLayout.from_map(balance_sheet_map),
+                    ),
+                    bs_df,
+                    bs_df.columns,
+                    level=self.validation,
+                )
+        return history
+
+    def get_pnl_history(self, dates: list = None) -> pd.DataFrame:
+        """
+        Gets the income statement for every available date in one pass.
+
+        Args:
+            dates: Report dates to include, all dates when None
+
+        Returns:
+            DataFrame indexed by line item with one column per date
+        """
+        income_statement_map = load_map(self.ticker_name, "incomestatement", self.config_dir)
+        pnl_df = self._select_dates(self.incomestatement, dates)
+
+        with stage("extract.incomestatement_history", self.ticker_name):
+            history = income_statement_map.extract_frame(pnl_df)
+        if self.validation != "off":
+            with stage("validate.incomestatement_history", self.ticker_name):
+                self._validate_pnl(history, pnl_df.columns, level=self.validation)
+        return history
+
+    def get_cf_history(self, dates: list = None) -> pd.DataFrame:
+        """
+        Gets the cash flow statement for every available date in one pass.
+
+        Args:
+            dates: Report dates to include, all dates when None
+
+        Returns:
+            DataFrame indexed by line item with one column per date
+        """
+        cash_flow_map = load_map(self.ticker_name, "cashflow", self.config_dir)
+        cf_df = self._select_dates(self.cashflow, dates)
+
+        with stage("extract.cashflow_history", self.ticker_name):
+            return cash_flow_map.extract_frame(cf_df)
+
+    @staticmethod
+    def _select_dates(statement: pd.DataFrame, dates: list = None) -> pd.DataFrame:
+        if dates is None:
+            return statement
+        for date in dates:
+            assert isinstance(date, str), "Date must be a string"
+            assert date in statement.columns, f"Date {date} not found in statement"
+        return statement.iloc[:, [statement.columns.get_loc(date) for date in dates]]
+
+    def validate(self, dates: list = None, level: str = None) -> ValidationReport:
+        """
+        Validates the balance sheet and income statement of every date at
+        once and reports every violation instead of raising.
+
+        Args:
+            dates: Report dates to include, all dates when None
+            level: "fast" or "full", defaults to the company's level
+
+        Returns:
+            ValidationReport
+        """
+        level = level or self.validation
+        bs_df = self._select_dates(self.balancesheet, dates)
+        pnl_df = self._select_dates(self.incomestatement, dates)
+        balance_sheet_map = load_map(self.ticker_name, "balancesheet", self.config_dir)
+        income_statement_map = load_map(
+            self.ticker_name, "incomestatement", self.config_dir
         )
 
-        cash_flow_map = {}
-        # load the cash flow map
-        with open(cash_flow_map_path, "r") as f:
-            cash_flow_map = json.load(f)
+        bs_report = validate_balance_sheet(
+            CompactBalanceSheet(
+                balance_sheet_map.extract_frame(bs_df).to_numpy().T,
+                BalanceSheetLayout.from_map(balance_sheet_map),
+            ),
+            bs_df,
+            dates=bs_df.columns,
+            ticker=self.ticker_name,
+            level=level,
+        )
+        pnl_report = validate_income_statement(
+            income_statement_map.extract_frame(pnl_df),
+            dates=pnl_df.columns,
+            ticker=self.ticker_name,
+            level=level,
+        )
+        return bs_report + pnl_report
 
-        cf_df_series = self.get_cf_df(date)
-        assert isinstance(cf_df_series, pd.Series), "Cash flow data is not a Series"
+    @staticmethod
+    def _validate_bs(bs: CompactBalanceSheet, bs_df, dates=None, level: str = "full"):
+        """
+        Validates a mapped balance sheet against the Yahoo totals, raising a
+        ValidationError (an AssertionError) for the first failing check.
+
+        Args:
+            bs: Mapped balance sheet, a single one or one per date
+            bs_df: Source statement column (Series) or columns (DataFrame)
+            dates: Dates of the rows of bs, used in error messages
+            level: "fast" or "full"
+        """
+        validate_balance_sheet(bs, bs_df, dates, level=level).raise_if_failed()
+
+    @staticmethod
+    def _validate_pnl(pnl, dates=None, level: str = "full"):
+        """
+        Validates the income statement chain on a Series (one date) or a
+        DataFrame (line items x dates), raising for the first failing check.
+        """
+        validate_income_statement(pnl, dates, level=level).raise_if_failed()
+
+    def driver_history(self) -> DriverHistory:
+        """
+        Driver ratios of every historical date, see
+        driver_estimation.driver_history.
+        """
+        return driver_history([self])
+
+    def estimate_drivers(
+        self, estimator: DriverEstimator = None, history: DriverHistory = None
+    ) -> pd.DataFrame:
+        """
+        Estimates the drivers at every historical date, cached per estimator
+        so repeated forecasts reuse them.
 
-        # build the cash flow dictionary recursively
-        cf_dict = build_recursively(cash_flow_map, cf_df_series)
-        assert isinstance(cf_dict, dict), "Cash flow data is not a dictionary"
+        Args:
+            estimator: DriverEstimator, defaults to the company's estimator
+                or the median of every date so far
+            history: The company's driver_history() when already computed
 
-        return cf_dict
+        Returns:
+            DataFrame indexed by date with one column per estimated driver
+        """
+        estimator = estimator if estimator is not None else self.estimator
+        return estimate_drivers([self], estimator, history).xs(
+            self.ticker_name, level="ticker"
+        )
 
     def forecast_balancesheet(
         self, base_year: str, num_years: int = 1, override: dict = None
@@ -204,6 +489,172 @@ class CompanyFS:
             List of tuples: [(forecast_bs_year1, forecast_drivers_year1), ...]
             Where List[0] is the next year, List[1] is next next year, etc.
         """
+        if override:
+            assert isinstance(override, dict), "Override must be a dictionary"
+
+        return self.forecast_scenarios(
+            base_year, num_years=num_years, overrides=override or None
+        ).scenario(0)
+
+    def iter_forecast_balancesheet(
+        self, base_year: str, num_years: int = 1, override: dict = None
+    ):
+        """
+        Forecast balance sheet for multiple years, yielding one year at a time.
+
+        Yields:
+            Tuples of (forecast_bs, forecast_drivers), next year first
+        """
+        if override:
+            assert isinstance(override, dict), "Override must be a dictionary"
+
+        for _, forecast_bs, forecast_drivers, _ in self.iter_forecast_scenarios(
+            base_year, num_years=num_years, overrides=override or None
+        ):
+            yield forecast_bs.row(0).to_dict(), {
+                key: value[0].item() for key, value in forecast_drivers.items()
+            }
+
+    def iter_forecast_scenarios(
+        self,
+        base_year: str,
+        num_years: int = 1,
+        overrides=None,
+        grid: bool = False,
+    ):
+        """
+        Generator variant of forecast_scenarios, yielding one year at a time.
+
+        Yields:
+            Tuple of (year_number, forecast_bs, forecast_drivers, imbalance),
+            see forecast_engine.iter_forecast_scenarios
+        """
+        program = self.forecast_program
+        base_balance_sheet, base_sales, driver_table = self._scenario_inputs(
+            base_year, num_years, overrides, grid, program
+        )
+        return iter_forecast_scenarios(
+            base_balance_sheet,
+            base_sales,
+            driver_table,
+            num_years=num_years,
+            program=program,
+        )
+
+    def forecast_scenarios(
+        self,
+        base_year: str,
+        num_years: int = 1,
+        overrides=None,
+        grid: bool = False,
+    ) -> ScenarioForecast:
+        """
+        Forecast balance sheet for many driver scenarios in one vectorized pass.
+
+        Args:
+            base_year: Base year date in YYYY-MM-DD format
+            num_years: Number of years to forecast
+            overrides: None, an override dict, a list of override dicts, a
+                DataFrame of override sets or a dict of arrays per driver
+            grid: Take the cartesian product of a dict of arrays
+
+        Returns:
+            ScenarioForecast with values shaped (scenarios, years, line items),
+            read-only when it comes from the company's cache
+        """
+        if self.cache is not None:
+            return self.cache.forecast_scenarios(
+                self, base_year, num_years, overrides, grid
+            )
+        return self._forecast_scenarios(base_year, num_years, overrides, grid)
+
+    def _forecast_scenarios(
+        self,
+        base_year: str,
+        num_years: int,
+        overrides,
+        grid: bool,
+        program: ForecastProgram = None,
+    ) -> ScenarioForecast:
+        # callers that already hold the program pass it, see forecast_program
+        program = program if program is not None else self.forecast_program
+        base_balance_sheet, base_sales, driver_table = self._scenario_inputs(
+            base_year, num_years, overrides, grid, program
+        )
+        with stage("forecast.scenarios", self.ticker_name):
+            return forecast_scenarios(
+                base_balance_sheet,
+                base_sales,
+                driver_table,
+                num_years=num_years,
+                program=program,
+            )
+
+    def forecast_long(
+        self,
+        base_year: str,
+        num_periods: int,
+        overrides=None,
+        grid: bool = False,
+        tolerance: float = RELATIVE_BALANCE_TOLERANCE,
+    ) -> ScenarioForecast:
+        """
+        Long-horizon forecast (e.g. 40 to 400 periods) that solves the linear
+        recurrences as array operations, see forecast_fast.forecast_long.
+        A period is a year, or a quarter for a quarterly CompanyFS. Only
+        available for the standard forecast rules.
+
+        Args:
+            base_year: Base period date in YYYY-MM-DD format
+            num_periods: Number of periods to forecast
+            overrides: Driver overrides, as for forecast_scenarios
+            grid: Take the cartesian product of a dict of arrays
+            tolerance: Balance check tolerance relative to total assets, on
+                top of the absolute one of forecast_scenarios: the scans over
+                every period accumulate rounding error with the size of the
+                totals and the horizon. None to skip the check
+
+        Returns:
+            ScenarioForecast with values shaped (scenarios, periods, line items)
+
+        Raises:
+            NonStandardRulesError: The ticker has its own forecast rules, use
+                forecast_scenarios
+        """
+        program = self.forecast_program
+        if not program.standard:
+            raise NonStandardRulesError(
+                f"forecast_long solves the standard forecast rules only, "
+                f"{self.ticker_name} has its own forecast rules; use "
+                f"forecast_scenarios instead"
+            )
+        base_balance_sheet, base_sales, driver_table = self._scenario_inputs(
+            base_year, num_periods, overrides, grid, program
+        )
+        with stage("forecast.long", self.ticker_name):
+            return forecast_long(
+                base_balance_sheet,
+                base_sales,
+                driver_table,
+                num_periods=num_periods,
+                tolerance=tolerance,
+            )
+
+    def _scenario_inputs(
+        self,
+        base_year: str,
+        num_years: int,
+        overrides,
+        grid: bool,
+        program: ForecastProgram,
+    ):
+        """
+        Validates forecast arguments and gets the base year and driver table
+        for the forecast program resolved by the caller.
+
+        Returns:
+            Tuple of (base_balance_sheet, base_sales, driver_table)
+        """
         # forecast year must larger than base year
         assert isinstance(base_year, str), "Base year must be a string"
         assert isinstance(num_years, int), "Number of years must be an integer"
@@ -212,14 +663,69 @@ class CompanyFS:
             r"^\d{4}-\d{2}-\d{2}$", base_year
         ), "Base year must be in YYYY-MM-DD format"
 
+        base_balance_sheet, base_sales, driver_attributes = self._forecast_base(
+            base_year, program
+        )
+        with stage("forecast.driver_table", self.ticker_name):
+            driver_table = build_driver_table(driver_attributes, overrides, grid=grid)
+        return base_balance_sheet, base_sales, driver_table
+
+    def forecast_session(
+        self, base_year: str, num_years: int = 1, override: dict = None
+    ) -> ForecastSession:
+        """
+        Creates a forecast session for interactive what-if work, where
+        changing one override only recomputes what depends on it.
+        """
+        return ForecastSession(self, base_year, num_years=num_years, override=override)
+
+    def _forecast_base(self, base_year: str, program: ForecastProgram = None):
+        """
+        Gets the base year balance sheet, sales and driver attributes,
+        memoized per base year until a statement is replaced. The balance
+        sheet is shared and read-only.
+
+        Args:
+            base_year: Base year date in YYYY-MM-DD format
+            program: The company's forecast_program when the caller already
+                resolved it, resolved here otherwise
+
+        Returns:
+            Tuple of (base_balance_sheet, base_sales, driver_attributes)
+        """
+        program = program if program is not None else self.forecast_program
+        key = (
+            base_year,
+            self.validation,
+            self.estimator.key if self.estimator is not None else None,
+            program,
+        )
+        if key in self._forecast_bases:
+            count("forecast.base_hit", self.ticker_name)
+        else:
+            count("forecast.base_miss", self.ticker_name)
+            base_balance_sheet, base_sales, driver_attributes = (
+                self._compute_forecast_base(base_year, program)
+            )
+            base_balance_sheet.values.flags.writeable = False
+            self._forecast_bases[key] = (
+                base_balance_sheet,
+                base_sales,
+                driver_attributes,
+            )
+        base_balance_sheet, base_sales, driver_attributes = self._forecast_bases[key]
+        return base_balance_sheet, base_sales, dict(driver_attributes)
+
+    def _compute_forecast_base(self, base_year: str, program: ForecastProgram):
         # Get initial base year data
-        base_balance_sheet: dict = self.get_bs(base_year)
-        base_income_statement: dict = self.get_pnl(base_year)
-        base_cash_flow: dict = self.get_cf(base_year)
+        base_balance_sheet = self.get_compact_bs(base_year)
+        base_income_statement = self.get_pnl(base_year, as_dict=False)
+        base_cash_flow = self.get_cf(base_year, as_dict=False)
 
         # Calculate driver attributes from base year
         driver_attributes = {
-            "sales_growth_rate": 1.05,
+            "sales_growth_rate": DEFAULT_SALES_GROWTH_RATE
+            ** (1 / self.periods_per_year),
             "operating_margin": base_income_statement["operating_income"]
             / base_income_statement["total_revenue"],
             "capex_as_percentage_of_sales": base_cash_flow["capital_expenditure"]
@@ -227,55 +733,30 @@ class CompanyFS:
             "depreciation_amortization_depletion_as_percentage_of_net_ppe": base_cash_flow[
                 "depreciation_amortization_depletion"
             ]
-            / base_balance_sheet["total_assets"]["non_current_assets"]["net_ppe"],
+            / program.base(base_balance_sheet.values, "depreciation"),
             "interest_rate_on_debt": base_income_statement[
                 "net_non_operating_interest_income_expense"
             ]
-            / (
-                base_balance_sheet["total_liabilities"]["current_liabilities"][
-                    "current_debt"
-                ]
-                + base_balance_sheet["total_liabilities"]["non_current_liabilities"][
-                    "long_term_debt"
-                ]
-            ),
+            / program.base(base_balance_sheet.values, "interest"),
             "tax_rate": base_income_statement["tax_provision"]
             / base_income_statement["pretax_income"],
             "dividend_payout_ratio": base_cash_flow["cash_dividends_paid"]
             / base_income_statement["net_income_common_stockholders"],
-            "minimum_cash_required": base_balance_sheet["total_assets"][
-                "current_assets"
-            ]["cash_and_equivalents"],
+            "minimum_cash_required": base_balance_sheet[program.plug],
         }
-
-        # handle overrides if provided
-        if override:
-            assert isinstance(override, dict), "Override must be a dictionary"
-            for key, value in override.items():
-                if key in driver_attributes:
-                    driver_attributes[key] = value
-                else:
-                    print(f"Warning: {key} is not a valid driver attribute.")
-
-        # List to store all forecasted years
-        forecasted_years = []
-
-        # Keep track of the previous year's data for iterative forecasting
-        current_bs = base_balance_sheet
-        previous_sales = base_income_statement["total_revenue"]
-
-        # Forecast each year iteratively
-        for year in range(num_years):
-            forecast_result = self._forecast_single_year(
-                current_bs, previous_sales, driver_attributes, year + 1
+        if self.estimator is not None:
+            estimates = self.estimate_drivers()
+            # drivers are estimated on the reported income statement dates
+            assert pd.Timestamp(base_year) in estimates.index, (
+                f"No driver estimates for {self.ticker_name} at {base_year}, the "
+                f"income statement reports nothing for that date"
+            )
+            estimates = estimates.loc[pd.Timestamp(base_year)]
+            driver_attributes.update(
+                {driver: float(estimates[driver]) for driver in self.estimator.drivers}
             )
-            forecasted_years.append(forecast_result)
-
-            # Update current_bs and previous_sales for next iteration
-            current_bs = forecast_result[0]  # forecast_bs
-            previous_sales = forecast_result[1]["sales"]  # forecast_drivers["sales"]
 
-        return forecasted_years
+        return base_balance_sheet, base_income_statement["total_revenue"], driver_attributes
 
     def _forecast_single_year(
         self,
@@ -288,7 +769,7 @@ class CompanyFS:
         Helper method to forecast a single year based on previous year's balance sheet.
 
         Args:
-            previous_bs: Previous year's balance sheet
+            previous_bs: Previous year's balance sheet, dict or CompactBalanceSheet
             previous_sales: Previous year's sales
             driver_attributes: Financial drivers
             year_number: Which year we're forecasting (1, 2, 3, etc.)
@@ -296,215 +777,26 @@ class CompanyFS:
         Returns:
             Tuple of (forecast_bs, forecast_drivers)
         """
-        forecast_drivers = {}
-
-        # Extract values from previous year's balance sheet
-        net_ppe_prev = previous_bs["total_assets"]["non_current_assets"]["net_ppe"]
-        total_debt_prev = (
-            previous_bs["total_liabilities"]["current_liabilities"]["current_debt"]
-            + previous_bs["total_liabilities"]["non_current_liabilities"][
-                "long_term_debt"
-            ]
-        )
-        cash_prev = previous_bs["total_assets"]["current_assets"][
-            "cash_and_equivalents"
-        ]
-        retained_earnings_prev = previous_bs["total_equity"]["retained_earnings"]
-
-        # --- Top-to-bottom calculation ---
-        forecast_drivers["sales"] = (
-            previous_sales * driver_attributes["sales_growth_rate"]
-        )
-
-        forecast_drivers["operating_income"] = (
-            forecast_drivers["sales"] * driver_attributes["operating_margin"]
-        )
-
-        # Calculate Depreciation first, as it's needed for EBIT and for the Capex assumption
-        forecast_drivers["depreciation"] = (
-            net_ppe_prev
-            * driver_attributes[
-                "depreciation_amortization_depletion_as_percentage_of_net_ppe"
-            ]
-        )
-
-        forecast_drivers["ebit"] = forecast_drivers["operating_income"]
-
-        forecast_drivers["interest_expense"] = (
-            total_debt_prev * driver_attributes["interest_rate_on_debt"]
-        )
-
-        forecast_drivers["pretax_income"] = (
-            forecast_drivers["ebit"] - forecast_drivers["interest_expense"]
-        )
-
-        forecast_drivers["tax_provision"] = (
-            forecast_drivers["pretax_income"] * driver_attributes["tax_rate"]
-        )
-
-        forecast_drivers["net_income"] = (
-            forecast_drivers["pretax_income"] - forecast_drivers["tax_provision"]
-        )
-
-        # Cash Flow
-        # Cash Flow from Operations (CFO)
-        cfo = forecast_drivers["net_income"] + forecast_drivers["depreciation"]
-
-        # Cash Flow from Investing (CFI)
-        forecast_drivers["capex"] = (
-            forecast_drivers["sales"]
-            * driver_attributes["capex_as_percentage_of_sales"]
-        )
-        # forecast_drivers["capex"] = forecast_drivers["depreciation"]
-
-        cfi = -forecast_drivers["capex"]
-
-        # Scheduled Cash Flow from Financing (CFF)
-        forecast_drivers["dividends_paid"] = (
-            forecast_drivers["net_income"] * driver_attributes["dividend_payout_ratio"]
-        )
-        scheduled_cff = -forecast_drivers["dividends_paid"]
-
-        # --- Calculate the company's cash position BEFORE any new borrowing or investing ---
-        net_cash_flow_before_new_financing = cfo + cfi + scheduled_cff
-        provisional_cash_balance = cash_prev + net_cash_flow_before_new_financing
-
-        # --- The "No-Plug" Decision Logic ---
-        cash_surplus_or_deficit = (
-            provisional_cash_balance - driver_attributes["minimum_cash_required"]
-        )
-
-        if cash_surplus_or_deficit < 0:
-            forecast_drivers["new_debt_needed"] = -cash_surplus_or_deficit
-            forecast_drivers["new_st_investment"] = 0
-        else:
-            forecast_drivers["new_debt_needed"] = 0
-            forecast_drivers["new_st_investment"] = cash_surplus_or_deficit
-
-        # Construct new Balance Sheet
-        forecast_bs = {
-            "total_assets": {"current_assets": {}, "non_current_assets": {}},
-            "total_liabilities": {
-                "current_liabilities": {},
-                "non_current_liabilities": {},
-            },
-            "total_equity": {},
+        if isinstance(previous_bs, dict):
+            previous_bs = CompactBalanceSheet.from_dict(previous_bs)
+        drivers = {
+            key: np.array([driver_attributes[key]], dtype="float64")
+            for key in DRIVER_ATTRIBUTES
         }
 
-        # Current Assets
-        forecast_bs["total_assets"]["current_assets"]["cash_and_equivalents"] = (
-            cash_prev
-            + net_cash_flow_before_new_financing
-            + forecast_drivers["new_debt_needed"]
-            - forecast_drivers["new_st_investment"]
-        )
-        forecast_bs["total_assets"]["current_assets"]["receivables"] = previous_bs[
-            "total_assets"
-        ]["current_assets"]["receivables"]
-        forecast_bs["total_assets"]["current_assets"]["Inventory"] = previous_bs[
-            "total_assets"
-        ]["current_assets"]["Inventory"]
-        forecast_bs["total_assets"]["current_assets"]["hedging_assets_current"] = (
-            previous_bs["total_assets"]["current_assets"]["hedging_assets_current"]
-        )
-        forecast_bs["total_assets"]["current_assets"]["other_current_assets"] = (
-            previous_bs["total_assets"]["current_assets"]["other_current_assets"]
-        )
-
-        # Non-current Assets
-        forecast_bs["total_assets"]["non_current_assets"]["net_ppe"] = (
-            net_ppe_prev - forecast_drivers["depreciation"] + forecast_drivers["capex"]
-        )
-        investments_prev = previous_bs["total_assets"]["non_current_assets"][
-            "investments"
-        ]
-        forecast_bs["total_assets"]["non_current_assets"]["investments"] = (
-            investments_prev + forecast_drivers["new_st_investment"]
-        )
-
-        forecast_bs["total_assets"]["non_current_assets"]["goodwill"] = previous_bs[
-            "total_assets"
-        ]["non_current_assets"]["goodwill"]
-        forecast_bs["total_assets"]["non_current_assets"][
-            "other_non_current_assets"
-        ] = previous_bs["total_assets"]["non_current_assets"][
-            "other_non_current_assets"
-        ]
-
-        # Current Liabilities
-        forecast_bs["total_liabilities"]["current_liabilities"][
-            "payables_and_accrued_expenses"
-        ] = previous_bs["total_liabilities"]["current_liabilities"][
-            "payables_and_accrued_expenses"
-        ]
-        forecast_bs["total_liabilities"]["current_liabilities"][
-            "pension_and_other_postretirement_benefits"
-        ] = previous_bs["total_liabilities"]["current_liabilities"][
-            "pension_and_other_postretirement_benefits"
-        ]
-        forecast_bs["total_liabilities"]["current_liabilities"]["current_debt"] = (
-            previous_bs["total_liabilities"]["current_liabilities"]["current_debt"]
-        )
-        forecast_bs["total_liabilities"]["current_liabilities"][
-            "current_deferred_liabilities"
-        ] = previous_bs["total_liabilities"]["current_liabilities"][
-            "current_deferred_liabilities"
-        ]
-        forecast_bs["total_liabilities"]["current_liabilities"][
-            "other_current_liabilities"
-        ] = previous_bs["total_liabilities"]["current_liabilities"][
-            "other_current_liabilities"
-        ]
-
-        # Non-current Liabilities
-        long_term_debt_prev = previous_bs["total_liabilities"][
-            "non_current_liabilities"
-        ]["long_term_debt"]
-        forecast_bs["total_liabilities"]["non_current_liabilities"][
-            "long_term_debt"
-        ] = (long_term_debt_prev + forecast_drivers["new_debt_needed"])
-        forecast_bs["total_liabilities"]["non_current_liabilities"][
-            "non_current_deferred_liabilities"
-        ] = previous_bs["total_liabilities"]["non_current_liabilities"][
-            "non_current_deferred_liabilities"
-        ]
-        forecast_bs["total_liabilities"]["non_current_liabilities"][
-            "tradeand_other_payables_non_current"
-        ] = previous_bs["total_liabilities"]["non_current_liabilities"][
-            "tradeand_other_payables_non_current"
-        ]
-        forecast_bs["total_liabilities"]["non_current_liabilities"][
-            "other_non_current_liabilities"
-        ] = previous_bs["total_liabilities"]["non_current_liabilities"][
-            "other_non_current_liabilities"
-        ]
-
-        # Equity
-        forecast_bs["total_equity"]["capital_stock"] = previous_bs["total_equity"][
-            "capital_stock"
-        ]
-        forecast_bs["total_equity"]["retained_earnings"] = (
-            retained_earnings_prev
-            + forecast_drivers["net_income"]
-            - forecast_drivers["dividends_paid"]
-        )
-        forecast_bs["total_equity"]["gains_losses_not_affecting_retained_earning"] = (
-            previous_bs["total_equity"]["gains_losses_not_affecting_retained_earning"]
+        forecast_bs, forecast_drivers = forecast_year(
+            CompactBalanceSheet(previous_bs.values[np.newaxis], previous_bs.layout),
+            np.array([previous_sales], dtype="float64"),
+            drivers,
+            self.forecast_program,
         )
 
         # Validation
-        total_assets = sum_dict_values(forecast_bs["total_assets"])
-        total_liabilities = sum_dict_values(forecast_bs["total_liabilities"])
-        total_equity = sum_dict_values(forecast_bs["total_equity"])
-        balance_check = total_assets - total_liabilities - total_equity
-
-        tolerance = 1e-4
-        assert abs(balance_check) < tolerance, (
-            f"Balance sheet does not balance for year {year_number}. "
-            f"Difference is: {balance_check}"
-        )
+        check_balance(forecast_bs, first_year=year_number)
 
-        return forecast_bs, forecast_drivers
+        return forecast_bs.row(0).to_dict(), {
+            key: value[0].item() for key, value in forecast_drivers.items()
+        }
 
 
 def print_balance_sheet(d, indent=0):
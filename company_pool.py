@@ -0,0 +1,124 @@
+import threading
+import time
+from collections import OrderedDict
+
+from company_fs import CompanyFS
+from instrumentation import count, stage
+
+DEFAULT_MAX_COMPANIES = 1024
+DEFAULT_MAX_BYTES = 512 * 2**20
+
+
+def company_bytes(company: CompanyFS) -> int:
+    """Memory held by the loaded statements of a company."""
+    return int(
+        sum(
+            frame.memory_usage(index=True).sum()
+            for frame in company._statements.values()
+        )
+    )
+
+
+class CompanyPool:
+    """
+    Resident CompanyFS objects shared between requests, so their statements,
+    compiled maps, driver estimates and cached forecasts are reused. Every
+    company is built with the same CompanyFS keyword arguments. Companies
+    are evicted least recently used first beyond max_companies or max_bytes
+    of statements, and by evict(idle_seconds) once idle. Thread-safe.
+    """
+
+    def __init__(
+        self,
+        max_companies: int = DEFAULT_MAX_COMPANIES,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        **company_kwargs,
+    ):
+        """
+        Args:
+            max_companies: Maximum number of companies kept in memory
+            max_bytes: Maximum bytes of statements kept in memory
+            company_kwargs: Keyword arguments of every CompanyFS (store,
+                config_dir, validation, frequency, estimator, cache)
+        """
+        assert max_companies > 0, "Maximum companies must be greater than 0"
+        assert max_bytes > 0, "Maximum bytes must be greater than 0"
+        self.max_companies = max_companies
+        self.max_bytes = max_bytes
+        self.company_kwargs = company_kwargs
+        self.evictions = 0
+        # ticker -> [company, last used, bytes], least recently used first
+        self._companies = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._companies)
+
+    def __contains__(self, ticker: str) -> bool:
+        return ticker.upper() in self._companies
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes of statements held in memory."""
+        with self._lock:
+            return sum(entry[2] for entry in self._companies.values())
+
+    def get(self, ticker: str) -> CompanyFS:
+        """Gets the resident CompanyFS of a ticker, loading it on first use."""
+        ticker = ticker.upper()
+        with self._lock:
+            entry = self._companies.get(ticker)
+            if entry is not None:
+                entry[1] = time.monotonic()
+                self._companies.move_to_end(ticker)
+                return entry[0]
+
+        count("pool.company_load", ticker)
+        with stage("pool.company_load", ticker):
+            company = CompanyFS(ticker, **self.company_kwargs).prefetch()
+        return self.add(company)
+
+    def add(self, company: CompanyFS) -> CompanyFS:
+        """
+        Adds an already loaded CompanyFS, e.g. from load_companies, built
+        with the pool's keyword arguments. When the ticker is resident
+        already the resident company is kept and returned.
+        """
+        ticker = company.ticker_name
+        with self._lock:
+            entry = self._companies.setdefault(
+                ticker, [company, time.monotonic(), company_bytes(company)]
+            )
+            self._companies.move_to_end(ticker)
+            self._evict(self.max_companies, self.max_bytes)
+        return entry[0]
+
+    def evict(self, idle_seconds: float = None) -> int:
+        """
+        Evicts companies beyond the limits and those idle for longer than
+        idle_seconds.
+
+        Returns:
+            Number of companies evicted
+        """
+        with self._lock:
+            return self._evict(self.max_companies, self.max_bytes, idle_seconds)
+
+    def _evict(self, max_companies: int, max_bytes: int, idle_seconds: float = None):
+        """Evicts least recently used companies, the caller holds the lock."""
+        evicted = 0
+        now = time.monotonic()
+        total = sum(entry[2] for entry in self._companies.values())
+        while self._companies:
+            ticker, (_, last_used, size) = next(iter(self._companies.items()))
+            idle = idle_seconds is not None and now - last_used > idle_seconds
+            if not (
+                idle or len(self._companies) > max_companies or total > max_bytes
+            ):
+                break
+            del self._companies[ticker]
+            total -= size
+            evicted += 1
+            count("pool.evict", ticker)
+        self.evictions += evicted
+        return evicted
@@ -0,0 +1,464 @@
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from forecast_engine import (
+    CURRENT_DEBT,
+    DEFAULT_SALES_GROWTH_RATE,
+    LONG_TERM_DEBT,
+    NET_PPE,
+)
+from forecast_rules import BASE_DRIVERS
+from instrumentation import count, stage
+
+ESTIMATORS = ("latest", "mean", "median", "trimmed")
+
+# Ratio drivers as driver -> (numerator, denominator), each a statement and
+# the line items summed for it, same formulas as CompanyFS._forecast_base.
+# The balance sheet denominators are those of the standard forecast rules,
+# a company's own rules replace them with its bases (see _company_ratios).
+DRIVER_RATIOS = {
+    "operating_margin": (
+        ("incomestatement", ("operating_income",)),
+        ("incomestatement", ("total_revenue",)),
+    ),
+    "capex_as_percentage_of_sales": (
+        ("cashflow", ("capital_expenditure",)),
+        ("incomestatement", ("total_revenue",)),
+    ),
+    "depreciation_amortization_depletion_as_percentage_of_net_ppe": (
+        ("cashflow", ("depreciation_amortization_depletion",)),
+        ("balancesheet", (NET_PPE,)),
+    ),
+    "interest_rate_on_debt": (
+        ("incomestatement", ("net_non_operating_interest_income_expense",)),
+        ("balancesheet", (CURRENT_DEBT, LONG_TERM_DEBT)),
+    ),
+    "tax_rate": (
+        ("incomestatement", ("tax_provision",)),
+        ("incomestatement", ("pretax_income",)),
+    ),
+    "dividend_payout_ratio": (
+        ("cashflow", ("cash_dividends_paid",)),
+        ("incomestatement", ("net_income_common_stockholders",)),
+    ),
+}
+
+# Every estimated driver, sales growth being revenue over the previous
+# period's revenue. minimum_cash_required stays the base period cash.
+ESTIMATED_DRIVERS = ("sales_growth_rate",) + tuple(DRIVER_RATIOS)
+
+# Used where no estimate exists, e.g. a tax rate when every pretax income in
+# the window is 0 or the interest rate of a company without debt. Sales
+# growth is per year and compounded down for quarterly companies.
+DRIVER_FALLBACKS = {
+    "sales_growth_rate": DEFAULT_SALES_GROWTH_RATE,
+    "operating_margin": 0.0,
+    "capex_as_percentage_of_sales": 0.0,
+    "depreciation_amortization_depletion_as_percentage_of_net_ppe": 0.0,
+    "interest_rate_on_debt": 0.0,
+    "tax_rate": 0.0,
+    "dividend_payout_ratio": 0.0,
+}
+
+
+class DriverHistory:
+    """
+    Driver ratios for every historical date of every ticker.
+
+    Attributes:
+        ratios: DataFrame indexed by (ticker, date), oldest date first per
+            ticker, one column per estimated driver. NaN where the ratio is
+            undefined.
+        zero_denominator: True where the denominator is 0
+        missing: True where a line item is missing (NaN) for the date,
+            including the sales growth of a date without the previous
+            period's statement
+        periods_per_year: ticker -> periods per year
+    """
+
+    def __init__(
+        self,
+        ratios: pd.DataFrame,
+        zero_denominator: pd.DataFrame,
+        missing: pd.DataFrame,
+        periods_per_year: dict,
+    ):
+        self.ratios = ratios
+        self.zero_denominator = zero_denominator
+        self.missing = missing
+        self.periods_per_year = periods_per_year
+
+    @property
+    def tickers(self) -> list:
+        return list(self.periods_per_year)
+
+    def __repr__(self):
+        return (
+            f"DriverHistory({len(self.periods_per_year)} tickers, "
+            f"{len(self.ratios)} dates, "
+            f"{int(self.zero_denominator.to_numpy().sum())} zero denominators)"
+        )
+
+
+def reported_dates(statement: pd.DataFrame):
+    """Dates with at least one reported value, None when every date has one."""
+    reported = statement.notna().to_numpy().any(axis=0)
+    if reported.all():
+        return None
+    return [date.strftime("%Y-%m-%d") for date in statement.columns[reported]]
+
+
+def period_positions(dates: pd.DatetimeIndex, periods_per_year: int, periods: int):
+    """
+    Finds the statement date a number of periods after each date (before
+    it for a negative number). Dates are matched on their month, so fiscal
+    periods that end on a weekday near the month end still line up, and a
+    missing statement is not bridged by the next one.
+
+    Args:
+        dates: Statement dates of one ticker
+        periods_per_year: 1 for annual statements, 4 for quarterly ones
+        periods: Number of periods to move
+
+    Returns:
+        Array of positions in dates, -1 where there is no such statement
+    """
+    months = dates.to_period("M")
+    return months.get_indexer(months + periods * (12 // periods_per_year))
+
+
+def _company_ratios(company) -> dict:
+    """DRIVER_RATIOS with the balance sheet bases of the company's rules."""
+    program = company.forecast_program
+    ratios = dict(DRIVER_RATIOS)
+    for base, driver in BASE_DRIVERS.items():
+        numerator, _ = ratios[driver]
+        ratios[driver] = (numerator, ("balancesheet", program.bases[base]))
+    return ratios
+
+
+def _company_inputs(company):
+    """
+    Extracts the numerators and denominators of one company.
+
+    Returns:
+        Tuple of (dates, revenue, numerators, denominators) with one row
+        per date, oldest first, and one column per ratio driver
+    """
+    histories = {
+        "balancesheet": company.get_bs_history(reported_dates(company.balancesheet)),
+        "incomestatement": company.get_pnl_history(
+            reported_dates(company.incomestatement)
+        ),
+        "cashflow": company.get_cf_history(reported_dates(company.cashflow)),
+    }
+    dates = histories["incomestatement"].columns.sort_values()
+
+    ratios = _company_ratios(company)
+
+    # (statement, line item) -> (dates,) array on the income statement
+    # dates, NaN where the statement has no such date
+    rows = {}
+    for statement, frame in histories.items():
+        items = [
+            item
+            for ratio in ratios.values()
+            for source, source_items in ratio
+            if source == statement
+            for item in source_items
+        ]
+        if statement == "incomestatement":
+            items.append("total_revenue")
+        items = list(dict.fromkeys(items))
+        columns = frame.columns.get_indexer(dates)
+        values = frame.to_numpy(dtype="float64")
+        for item, position in zip(items, frame.index.get_indexer(items)):
+            assert position >= 0, f"{item} is not in the {statement} map"
+            rows[(statement, item)] = np.where(
+                columns >= 0, values[position, columns], np.nan
+            )
+
+    def terms(statement: str, items: tuple) -> np.ndarray:
+        total = rows[(statement, items[0])]
+        for item in items[1:]:
+            total = total + rows[(statement, item)]
+        return total
+
+    numerators = np.column_stack(
+        [terms(*numerator) for numerator, _ in ratios.values()]
+    )
+    denominators = np.column_stack(
+        [terms(*denominator) for _, denominator in ratios.values()]
+    )
+    return dates, rows[("incomestatement", "total_revenue")], numerators, denominators
+
+
+def driver_history(companies) -> DriverHistory:
+    """
+    Computes the driver ratios of every historical date and ticker.
+
+    Statements are extracted per ticker, then every ratio of every ticker
+    and date is computed in a single array division. Zero denominators
+    give NaN and are flagged instead of producing inf.
+
+    Args:
+        companies: CompanyFS objects (a list or a ticker -> CompanyFS dict)
+
+    Returns:
+        DriverHistory
+    """
+    if isinstance(companies, dict):
+        companies = list(companies.values())
+
+    tickers, dates, revenue, numerators, denominators = [], [], [], [], []
+    previous_revenue = []
+    for company in companies:
+        with stage("drivers.extract", company.ticker_name):
+            company_dates, company_revenue, company_numerators, company_denominators = (
+                _company_inputs(company)
+            )
+        tickers.extend([company.ticker_name] * len(company_dates))
+        dates.append(company_dates)
+        revenue.append(company_revenue)
+        numerators.append(company_numerators)
+        denominators.append(company_denominators)
+        # previous period's revenue, NaN at the first date and after a gap
+        previous = period_positions(company_dates, company.periods_per_year, -1)
+        previous_revenue.append(
+            np.where(previous >= 0, company_revenue[previous], np.nan)
+        )
+
+    with stage("drivers.history"):
+        revenue = np.concatenate(revenue)
+        previous_revenue = np.concatenate(previous_revenue)
+        numerators = np.column_stack([revenue, np.concatenate(numerators)])
+        denominators = np.column_stack(
+            [previous_revenue, np.concatenate(denominators)]
+        )
+
+        missing = np.isnan(numerators) | np.isnan(denominators)
+        zero_denominator = denominators == 0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratios = np.where(
+                zero_denominator | missing, np.nan, numerators / denominators
+            )
+
+    index = pd.MultiIndex.from_arrays(
+        [tickers, np.concatenate([date.to_numpy() for date in dates])],
+        names=["ticker", "date"],
+    )
+    columns = list(ESTIMATED_DRIVERS)
+    return DriverHistory(
+        pd.DataFrame(ratios, index=index, columns=columns),
+        pd.DataFrame(zero_denominator, index=index, columns=columns),
+        pd.DataFrame(missing, index=index, columns=columns),
+        {company.ticker_name: company.periods_per_year for company in companies},
+    )
+
+
+class DriverEstimator:
+    """
+    Estimates drivers from the ratios of several historical dates.
+
+    The estimate at each date only uses that date and the ones before it:
+    the last window dates (a rolling estimate) or the whole history when
+    window is None. Undefined ratios (zero denominators, missing line
+    items) are skipped, and a driver without enough defined ratios in its
+    window falls back to DRIVER_FALLBACKS.
+
+    Args:
+        method: "latest" (most recent defined ratio), "mean", "median" or
+            "trimmed" (mean without the trim fraction of smallest and
+            largest ratios)
+        window: Number of dates per estimate, None for all dates so far
+        trim: Fraction trimmed from each end by the trimmed mean
+        min_periods: Defined ratios needed in a window for an estimate
+        drivers: Drivers to estimate, the others are left to the base year
+        fallback: Driver -> value overriding DRIVER_FALLBACKS
+    """
+
+    def __init__(
+        self,
+        method: str = "median",
+        window: int = None,
+        trim: float = 0.1,
+        min_periods: int = 1,
+        drivers=ESTIMATED_DRIVERS,
+        fallback: dict = None,
+    ):
+        assert method in ESTIMATORS, f"Unknown estimator {method}"
+        assert window is None or window > 0, "Window must be greater than 0"
+        assert 0 <= trim < 0.5, "Trim must be between 0 and 0.5"
+        assert min_periods > 0, "Minimum periods must be greater than 0"
+        for driver in drivers:
+            assert driver in ESTIMATED_DRIVERS, f"{driver} cannot be estimated"
+        fallback = dict(DRIVER_FALLBACKS, **(fallback or {}))
+        self.method = method
+        self.window = window
+        self.trim = trim
+        self.min_periods = min_periods
+        self.drivers = tuple(drivers)
+        self.fallback = {driver: fallback[driver] for driver in self.drivers}
+
+    @property
+    def key(self) -> tuple:
+        """Hashable description, the key of the per-ticker estimate cache."""
+        return (
+            self.method,
+            self.window,
+            self.trim,
+            self.min_periods,
+            self.drivers,
+            tuple(self.fallback.items()),
+        )
+
+    def __repr__(self):
+        return (
+            f"DriverEstimator(method={self.method!r}, window={self.window}, "
+            f"trim={self.trim}, min_periods={self.min_periods})"
+        )
+
+    def estimate(self, history: DriverHistory) -> pd.DataFrame:
+        """
+        Estimates the drivers at every date of a driver history.
+
+        Returns:
+            DataFrame indexed like history.ratios with one column per driver
+        """
+        ratios = history.ratios[list(self.drivers)]
+        tickers = ratios.index.get_level_values("ticker")
+        with stage("drivers.estimate"):
+            windows = _windows(ratios.to_numpy(), tickers, self.window)
+            values = _REDUCERS[self.method](windows, self.trim)
+            defined = (~np.isnan(windows)).sum(axis=-1)
+            values[defined < self.min_periods] = np.nan
+
+            fallback = np.array([self.fallback[driver] for driver in self.drivers])
+            fallback = np.broadcast_to(fallback, values.shape).copy()
+            if "sales_growth_rate" in self.drivers:
+                periods = tickers.map(history.periods_per_year).to_numpy(dtype="float64")
+                position = self.drivers.index("sales_growth_rate")
+                fallback[:, position] = fallback[:, position] ** (1 / periods)
+            values = np.where(np.isnan(values), fallback, values)
+
+        return pd.DataFrame(values, index=ratios.index, columns=ratios.columns)
+
+
+def _windows(values: np.ndarray, tickers: pd.Index, window: int) -> np.ndarray:
+    """
+    Gathers the window ending at every row without crossing tickers.
+
+    Args:
+        values: (rows, drivers) with the rows of a ticker contiguous, oldest
+            first
+        tickers: Ticker of every row
+        window: Window length, None for the longest ticker history
+
+    Returns:
+        Array of shape (rows, drivers, window), NaN before a ticker's first date
+    """
+    starts = np.flatnonzero(np.r_[True, tickers[1:] != tickers[:-1]])
+    lengths = np.diff(np.r_[starts, len(values)])
+    window = window or int(lengths.max())
+
+    # every ticker's rows preceded by window - 1 NaN rows
+    block = np.repeat(np.arange(len(starts)), lengths)
+    positions = np.arange(len(values)) + (block + 1) * (window - 1)
+    padded = np.full((len(values) + len(starts) * (window - 1), values.shape[1]), np.nan)
+    padded[positions] = values
+    return sliding_window_view(padded, window, axis=0)[positions - (window - 1)]
+
+
+def _latest(windows: np.ndarray, trim: float) -> np.ndarray:
+    valid = ~np.isnan(windows)
+    last = windows.shape[-1] - 1 - np.argmax(valid[..., ::-1], axis=-1)
+    values = np.take_along_axis(windows, last[..., np.newaxis], axis=-1)[..., 0]
+    return np.where(valid.any(axis=-1), values, np.nan)
+
+
+def _mean(windows: np.ndarray, trim: float) -> np.ndarray:
+    defined = (~np.isnan(windows)).sum(axis=-1)
+    total = np.where(np.isnan(windows), 0.0, windows).sum(axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(defined > 0, total / defined, np.nan)
+
+
+def _median(windows: np.ndarray, trim: float) -> np.ndarray:
+    ordered = np.sort(windows, axis=-1)  # NaN sorts last
+    defined = (~np.isnan(windows)).sum(axis=-1)
+    low = np.maximum((defined - 1) // 2, 0)[..., np.newaxis]
+    high = (defined // 2)[..., np.newaxis].clip(max=windows.shape[-1] - 1)
+    values = (
+        np.take_along_axis(ordered, low, axis=-1)
+        + np.take_along_axis(ordered, high, axis=-1)
+    )[..., 0] / 2
+    return np.where(defined > 0, values, np.nan)
+
+
+def _trimmed(windows: np.ndarray, trim: float) -> np.ndarray:
+    ordered = np.sort(windows, axis=-1)
+    defined = (~np.isnan(windows)).sum(axis=-1)
+    cut = np.floor(defined * trim).astype(int)
+    # running sums with a leading 0, so a slice sum is a difference
+    sums = np.cumsum(np.where(np.isnan(ordered), 0.0, ordered), axis=-1)
+    sums = np.concatenate([np.zeros(sums.shape[:-1] + (1,)), sums], axis=-1)
+    total = (
+        np.take_along_axis(sums, (defined - cut)[..., np.newaxis], axis=-1)
+        - np.take_along_axis(sums, cut[..., np.newaxis], axis=-1)
+    )[..., 0]
+    kept = defined - 2 * cut
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(kept > 0, total / kept, np.nan)
+
+
+_REDUCERS = {
+    "latest": _latest,
+    "mean": _mean,
+    "median": _median,
+    "trimmed": _trimmed,
+}
+
+
+def estimate_drivers(
+    companies, estimator: DriverEstimator = None, history: DriverHistory = None
+) -> pd.DataFrame:
+    """
+    Estimates the drivers of many tickers, reusing each company's cached
+    estimates and computing the others in one pass.
+
+    Args:
+        companies: CompanyFS objects (a list or a ticker -> CompanyFS dict)
+        estimator: DriverEstimator, the median of every date so far when None
+        history: DriverHistory of (at least) the companies, computed from
+            their statements when None
+
+    Returns:
+        DataFrame indexed by (ticker, date) with one column per driver
+    """
+    if isinstance(companies, dict):
+        companies = list(companies.values())
+    estimator = estimator if estimator is not None else DriverEstimator()
+
+    missing = []
+    for company in companies:
+        if estimator.key in company._driver_estimates:
+            count("drivers.cache_hit", company.ticker_name)
+        else:
+            count("drivers.cache_miss", company.ticker_name)
+            missing.append(company)
+
+    if missing:
+        estimates = estimator.estimate(
+            history if history is not None else driver_history(missing)
+        )
+        for company in missing:
+            company._driver_estimates[estimator.key] = estimates.xs(
+                company.ticker_name, level="ticker"
+            )
+
+    frames = {
+        company.ticker_name: company._driver_estimates[estimator.key]
+        for company in companies
+    }
+    return pd.concat(frames, names=["ticker", "date"])
@@ -0,0 +1,367 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from balance_sheet import BalanceSheetLayout
+from forecast_engine import (
+    DRIVER_ATTRIBUTES,
+    ScenarioForecast,
+    extend_forecast,
+    override_rows,
+)
+from forecast_rules import ForecastProgram
+from instrumentation import count, stage
+from statement_maps import MAP_FILES, load_map
+
+# Bumped whenever the forecast model changes, so older entries on disk are
+# never served
+CACHE_VERSION = 1
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_MAX_BYTES = 256 * 2**20
+
+
+def canonical_overrides(overrides=None, grid: bool = False) -> tuple:
+    """
+    Canonical form of driver overrides: one sorted tuple of (driver, float)
+    per scenario, so equal override sets give equal keys however they are
+    spelled (dict, list of dicts, DataFrame, dict of arrays). Keys that are
+    not driver attributes are ignored by the forecast and dropped.
+    """
+    return tuple(
+        tuple(
+            sorted(
+                (key, float(value))
+                for key, value in override.items()
+                if key in DRIVER_ATTRIBUTES
+            )
+        )
+        for override in override_rows(overrides, grid)
+    )
+
+
+def forecast_key(
+    company,
+    base_year: str,
+    overrides=None,
+    grid: bool = False,
+    program: ForecastProgram = None,
+) -> str:
+    """
+    Cache key of a forecast: a hash of the ticker, frequency, base date,
+    validation level, estimator, canonical overrides and fingerprints of
+    the statements, map files and forecast rules. The horizon is not part
+    of the key, a cached forecast serves every horizon up to its own and is
+    extended beyond it.
+
+    Args:
+        company: CompanyFS
+        base_year: Base year date in YYYY-MM-DD format
+        overrides: Driver overrides, as for CompanyFS.forecast_scenarios
+        grid: Take the cartesian product of a dict of arrays
+        program: The company's forecast_program when the caller already
+            resolved it
+
+    Returns:
+        Hex digest
+    """
+    program = program if program is not None else company.forecast_program
+    description = (
+        CACHE_VERSION,
+        company.ticker_name,
+        company.frequency,
+        base_year,
+        company.validation,
+        company.estimator.key if company.estimator is not None else None,
+        canonical_overrides(overrides, grid),
+        company.fingerprint(),
+        tuple(
+            load_map(company.ticker_name, statement, company.config_dir).digest
+            for statement in MAP_FILES
+        ),
+        program.digest,
+    )
+    return hashlib.sha256(repr(description).encode()).hexdigest()
+
+
+def _nbytes(forecast: ScenarioForecast) -> int:
+    return forecast.values.nbytes + forecast.imbalance.nbytes
+
+
+def _prefix(forecast: ScenarioForecast, num_years: int) -> ScenarioForecast:
+    """The first num_years of a forecast, as views."""
+    if num_years == forecast.num_years:
+        return forecast
+    return ScenarioForecast.from_values(
+        forecast.drivers,
+        forecast.values[:, :num_years],
+        forecast.bs_layout,
+        forecast.imbalance[:, :num_years],
+        forecast.program,
+    )
+
+
+class ForecastCache:
+    """
+    Memoized forecast results: an in-memory LRU bounded by entry count and
+    bytes, and optionally an on-disk tier (one .npz per key) shared by every
+    process pointing at the same directory.
+
+    Each key holds the longest horizon computed so far. Shorter horizons
+    are served as views of it and longer ones extend it from its last year.
+    Cached arrays are read-only; results must not be modified in place.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        directory: str = None,
+        max_disk_bytes: int = None,
+    ):
+        """
+        Args:
+            max_entries: Maximum number of forecasts held in memory
+            max_bytes: Maximum bytes of forecast arrays held in memory
+            directory: Directory of the on-disk tier, None for memory only
+            max_disk_bytes: Maximum size of the on-disk tier, least recently
+                used files are removed beyond it, None for no limit
+        """
+        assert max_entries > 0, "Maximum entries must be greater than 0"
+        assert max_bytes > 0, "Maximum bytes must be greater than 0"
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.stats = {
+            "hits": 0,
+            "disk_hits": 0,
+            "extensions": 0,
+            "misses": 0,
+            "evictions": 0,
+        }
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes of forecast arrays held in memory."""
+        return self._nbytes
+
+    def __repr__(self):
+        return (
+            f"ForecastCache({len(self)} entries, {self._nbytes / 2**20:.1f} MiB, "
+            f"directory={self.directory!r})"
+        )
+
+    def forecast_scenarios(
+        self,
+        company,
+        base_year: str,
+        num_years: int = 1,
+        overrides=None,
+        grid: bool = False,
+    ) -> ScenarioForecast:
+        """
+        Serves CompanyFS.forecast_scenarios from the cache, computing and
+        storing it on a miss.
+        """
+        assert isinstance(base_year, str), "Base year must be a string"
+        assert isinstance(num_years, int), "Number of years must be an integer"
+        assert num_years > 0, "Number of years must be greater than 0"
+        ticker = company.ticker_name
+
+        program = company.forecast_program
+        key = forecast_key(company, base_year, overrides, grid, program)
+        cached = self.get(key, program.layout, program)
+        if cached is not None:
+            return self.serve(ticker, key, cached, num_years)
+
+        self._count("misses")
+        count("forecast_cache.miss", ticker)
+        forecast = company._forecast_scenarios(
+            base_year, num_years, overrides, grid, program
+        )
+        self.put(key, forecast)
+        return forecast
+
+    def serve(
+        self, ticker: str, key: str, cached: ScenarioForecast, num_years: int
+    ) -> ScenarioForecast:
+        """
+        Serves num_years of a forecast returned by get: its first years, or
+        the forecast extended (and cached again) when they are not cached.
+
+        Args:
+            ticker: Ticker symbol, for instrumentation
+            key: Cache key of the forecast, see forecast_key
+            cached: The forecast get returned for key
+            num_years: Number of years to serve
+        """
+        if cached.num_years >= num_years:
+            self._count("hits")
+            count("forecast_cache.hit", ticker)
+            return _prefix(cached, num_years)
+
+        self._count("extensions")
+        count("forecast_cache.extend", ticker)
+        with stage("forecast_cache.extend", ticker):
+            forecast = extend_forecast(cached, num_years)
+        self.put(key, forecast)
+        return forecast
+
+    def get(
+        self, key: str, layout: BalanceSheetLayout, program: ForecastProgram = None
+    ):
+        """
+        Gets a cached forecast from memory, then from disk.
+
+        Args:
+            key: Cache key, see forecast_key
+            layout: Balance sheet layout of the forecast
+            program: Compiled forecast rules of the forecast, attached to a
+                forecast read from disk so it is extended with them
+
+        Returns:
+            ScenarioForecast or None
+        """
+        with self._lock:
+            forecast = self._entries.get(key)
+            if forecast is not None:
+                self._entries.move_to_end(key)
+                return forecast
+        if self.directory is None:
+            return None
+
+        forecast = self._read(key, layout, program)
+        if forecast is not None:
+            self._count("disk_hits")
+            self._remember(key, forecast)
+        return forecast
+
+    def put(self, key: str, forecast: ScenarioForecast):
+        """
+        Caches a forecast, unless a longer horizon is cached already.
+        """
+        forecast.values.flags.writeable = False
+        forecast.imbalance.flags.writeable = False
+        with self._lock:
+            cached = self._entries.get(key)
+        if cached is not None and cached.num_years >= forecast.num_years:
+            return
+        self._remember(key, forecast)
+        if self.directory is not None:
+            self._write(key, forecast)
+
+    def clear(self, disk: bool = False):
+        """Drops every forecast held in memory, and on disk when disk is True."""
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+        if disk and self.directory is not None:
+            for path, _, _ in self._disk_entries():
+                os.remove(path)
+
+    def _count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.npz")
+
+    def _remember(self, key: str, forecast: ScenarioForecast):
+        """Adds a forecast to the LRU and evicts beyond the limits."""
+        size = _nbytes(forecast)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._nbytes -= _nbytes(previous)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = forecast
+            self._nbytes += size
+            while (
+                len(self._entries) > self.max_entries or self._nbytes > self.max_bytes
+            ):
+                _, evicted = self._entries.popitem(last=False)
+                self._nbytes -= _nbytes(evicted)
+                self.stats["evictions"] += 1
+                count("forecast_cache.evict")
+
+    def _write(self, key: str, forecast: ScenarioForecast):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+        with stage("forecast_cache.write"):
+            np.savez(
+                tmp_path,
+                values=forecast.values,
+                imbalance=forecast.imbalance,
+                drivers=forecast.drivers.to_numpy(dtype="float64"),
+                driver_columns=np.asarray(forecast.drivers.columns, dtype=str),
+                bs_keys=np.asarray(forecast.bs_keys, dtype=str),
+            )
+            # atomic so concurrent readers never see a partial file
+            os.replace(tmp_path, path)
+        if self.max_disk_bytes is not None:
+            self._prune_disk()
+
+    def _read(
+        self, key: str, layout: BalanceSheetLayout, program: ForecastProgram = None
+    ):
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+
+        with stage("forecast_cache.read"):
+            with np.load(path, allow_pickle=False) as data:
+                if data["bs_keys"].tolist() != layout.keys:
+                    return None
+                values = data["values"]
+                imbalance = data["imbalance"]
+                drivers = pd.DataFrame(
+                    data["drivers"], columns=data["driver_columns"].tolist()
+                )
+        # recently used files survive pruning
+        os.utime(path)
+        values.flags.writeable = False
+        imbalance.flags.writeable = False
+        return ScenarioForecast.from_values(
+            drivers, values, layout, imbalance, program
+        )
+
+    def _disk_entries(self) -> list:
+        """(path, size, mtime) of every forecast on disk."""
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for folder in os.scandir(self.directory):
+            if not folder.is_dir():
+                continue
+            for entry in os.scandir(folder.path):
+                if entry.name.endswith(".npz") and not entry.name.endswith(".tmp.npz"):
+                    stat = entry.stat()
+                    entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _prune_disk(self):
+        """Removes the least recently used files beyond max_disk_bytes."""
+        entries = sorted(self._disk_entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # removed by another process
+                pass
+            total -= size
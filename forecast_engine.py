@@ -0,0 +1,483 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from balance_sheet import BalanceSheetLayout, CompactBalanceSheet
+# the line item constants are re-exported for the standard-rules fast paths
+from forecast_rules import (  # noqa: F401
+    CASH,
+    CURRENT_DEBT,
+    DRIVER_ATTRIBUTES,
+    FORECAST_DRIVERS,
+    INVESTMENTS,
+    LONG_TERM_DEBT,
+    NET_PPE,
+    RETAINED_EARNINGS,
+    ForecastProgram,
+    standard_program,
+)
+from instrumentation import count, stage
+
+BALANCE_TOLERANCE = 1e-4
+# Balance check tolerance of forecast_fast.forecast_long relative to total
+# assets, on top of BALANCE_TOLERANCE: the rounding error of its scans over
+# every period grows with the size of the totals and the horizon
+RELATIVE_BALANCE_TOLERANCE = 1e-9
+
+# Sales growth per year when no override or estimate is given
+DEFAULT_SALES_GROWTH_RATE = 1.05
+
+
+def override_rows(overrides=None, grid: bool = False) -> list:
+    """
+    Normalizes driver overrides into one override dict per scenario.
+
+    Args:
+        overrides: None, a single override dict, a list of override dicts,
+            a DataFrame of override sets (one row per scenario) or a dict of
+            arrays per driver
+        grid: When overrides is a dict of arrays, take the cartesian product
+            of the arrays instead of zipping them
+
+    Returns:
+        List of override dicts, [{}] when there are no overrides
+    """
+    if overrides is None:
+        return [{}]
+    if isinstance(overrides, pd.DataFrame):
+        return overrides.to_dict("records")
+    if isinstance(overrides, dict):
+        is_array = {
+            key: isinstance(value, (list, tuple, np.ndarray, pd.Series))
+            for key, value in overrides.items()
+        }
+        if not any(is_array.values()):
+            return [overrides]
+        if grid:
+            keys = list(overrides)
+            columns = [
+                overrides[key] if is_array[key] else [overrides[key]] for key in keys
+            ]
+            return [
+                dict(zip(keys, combination))
+                for combination in itertools.product(*columns)
+            ]
+        return pd.DataFrame(overrides).to_dict("records")
+    assert isinstance(
+        overrides, (list, tuple)
+    ), "Overrides must be a dict, a list of dicts or a DataFrame"
+    return list(overrides)
+
+
+def known_driver_keys(keys, driver_attributes: dict) -> list:
+    """
+    Warns about override keys that are not driver attributes.
+
+    Returns:
+        The keys that are driver attributes, without duplicates
+    """
+    known = []
+    for key in dict.fromkeys(keys):
+        if key in driver_attributes:
+            known.append(key)
+        else:
+            print(f"Warning: {key} is not a valid driver attribute.")
+    return known
+
+
+def build_driver_table(
+    driver_attributes: dict, overrides=None, grid: bool = False
+) -> pd.DataFrame:
+    """
+    Builds the scenario table of driver attributes, one row per scenario.
+
+    Args:
+        driver_attributes: Base driver attributes (scalars)
+        overrides: Driver overrides, see override_rows
+        grid: When overrides is a dict of arrays, take the cartesian product
+            of the arrays instead of zipping them
+
+    Returns:
+        DataFrame with one column per driver attribute
+    """
+    overrides = override_rows(overrides, grid)
+    known_driver_keys(
+        (key for override in overrides for key in override), driver_attributes
+    )
+
+    rows = []
+    for override in overrides:
+        row = dict(driver_attributes)
+        for key, value in override.items():
+            if key in driver_attributes:
+                row[key] = value
+        rows.append(row)
+
+    return pd.DataFrame(rows, columns=list(driver_attributes), dtype="float64")
+
+
+def forecast_year(
+    previous_bs: CompactBalanceSheet,
+    previous_sales: np.ndarray,
+    drivers: dict,
+    program: ForecastProgram = None,
+):
+    """
+    Forecasts a single year for every scenario at once.
+
+    Args:
+        previous_bs: Previous year's balance sheet, shape (scenarios,)
+        previous_sales: Previous year's sales, shape (scenarios,)
+        drivers: Driver attribute name -> array of shape (scenarios,)
+        program: Compiled forecast rules, the standard rules when None
+
+    Returns:
+        Tuple of (forecast_bs, forecast_drivers) with forecast_bs shaped like
+        previous_bs and forecast_drivers mapping names to (scenarios,) arrays
+    """
+    bs_layout = previous_bs.layout
+    program = program if program is not None else standard_program(bs_layout)
+    values = program.run(previous_bs.values, previous_sales, drivers, 1)[:, 0]
+    forecast_drivers = {
+        key: values[:, len(bs_layout) + position]
+        for position, key in enumerate(FORECAST_DRIVERS)
+    }
+    return CompactBalanceSheet(values[:, : len(bs_layout)], bs_layout), forecast_drivers
+
+
+def balance_limit(total_assets, tolerance: float = RELATIVE_BALANCE_TOLERANCE):
+    """
+    Largest accepted imbalance of balance sheets with the given total
+    assets: BALANCE_TOLERANCE plus tolerance relative to total assets. Used
+    by forecast_fast.forecast_long only, the per-year engine is exact up to
+    BALANCE_TOLERANCE.
+    """
+    return BALANCE_TOLERANCE + tolerance * np.abs(total_assets)
+
+
+def assert_balanced(imbalance: np.ndarray, year_number: int, limit=BALANCE_TOLERANCE):
+    """
+    Asserts that every scenario balances for a given year.
+
+    Args:
+        imbalance: Imbalance of every scenario, shape (scenarios,)
+        year_number: Year number used in the error message
+        limit: Largest accepted absolute imbalance, a scalar or one per
+            scenario, see balance_limit
+    """
+    failed = np.flatnonzero(~(np.abs(imbalance) < limit))
+    if len(failed) == 0:
+        return
+    if len(imbalance) == 1:
+        difference = imbalance[0]
+        assert False, (
+            f"Balance sheet does not balance for year {year_number}. "
+            f"Difference is: {difference}"
+        )
+    assert False, (
+        f"Balance sheet does not balance for year {year_number} in "
+        f"{len(failed)} scenario(s) {failed[:10].tolist()}. "
+        f"Differences are: {imbalance[failed[:10]].tolist()}"
+    )
+
+
+def check_balance(
+    balance_sheet: CompactBalanceSheet,
+    tolerance: float = BALANCE_TOLERANCE,
+    first_year: int = 1,
+) -> np.ndarray:
+    """
+    Balance check of forecast balance sheets shaped (scenarios,) or
+    (scenarios, years), asserting the first year that does not balance.
+
+    Args:
+        balance_sheet: Forecast balance sheets
+        tolerance: Balance check tolerance, None to only compute the
+            imbalance
+        first_year: Year number of the first year, used in error messages
+
+    Returns:
+        Total assets - total liabilities - total equity
+    """
+    imbalance = balance_sheet.balance_check()
+    if tolerance is not None:
+        failed = ~(np.abs(imbalance) < tolerance)
+        if failed.any():
+            if imbalance.ndim == 1:
+                assert_balanced(imbalance, first_year, tolerance)
+            year = int(np.flatnonzero(failed.any(axis=0))[0])
+            assert_balanced(imbalance[:, year], first_year + year, tolerance)
+    return imbalance
+
+
+class ScenarioForecast:
+    """
+    Columnar result of a multi-scenario forecast.
+
+    values has shape (scenarios, years, line items) where line items are the
+    flattened balance sheet keys followed by the forecast drivers. program
+    holds the compiled forecast rules it was computed with. Only
+    forecast_fast.forecast_long leaves it None: it solves the standard
+    rules, which extend_forecast then continues with.
+    """
+
+    def __init__(
+        self,
+        drivers: pd.DataFrame,
+        balance_sheet: np.ndarray,
+        forecast_drivers: np.ndarray,
+        bs_layout: BalanceSheetLayout,
+        imbalance: np.ndarray,
+        program: ForecastProgram = None,
+    ):
+        self.drivers = drivers
+        self.bs_layout = bs_layout
+        self.bs_keys = list(bs_layout.keys)
+        self.driver_keys = list(FORECAST_DRIVERS)
+        self.line_items = self.bs_keys + self.driver_keys
+        self.values = np.concatenate([balance_sheet, forecast_drivers], axis=2)
+        self.imbalance = imbalance
+        self.program = program
+
+    @classmethod
+    def from_values(
+        cls,
+        drivers: pd.DataFrame,
+        values: np.ndarray,
+        bs_layout: BalanceSheetLayout,
+        imbalance: np.ndarray,
+        program: ForecastProgram = None,
+    ) -> "ScenarioForecast":
+        """
+        Wraps an already concatenated (scenarios, years, line items) array
+        without copying it.
+        """
+        assert values.shape[2] == len(bs_layout) + len(FORECAST_DRIVERS), (
+            "Values do not match the layout and forecast drivers"
+        )
+        forecast = cls.__new__(cls)
+        forecast.drivers = drivers
+        forecast.bs_layout = bs_layout
+        forecast.bs_keys = list(bs_layout.keys)
+        forecast.driver_keys = list(FORECAST_DRIVERS)
+        forecast.line_items = forecast.bs_keys + forecast.driver_keys
+        forecast.values = values
+        forecast.imbalance = imbalance
+        forecast.program = program
+        return forecast
+
+    @property
+    def num_scenarios(self) -> int:
+        return self.values.shape[0]
+
+    @property
+    def num_years(self) -> int:
+        return self.values.shape[1]
+
+    @property
+    def balance_sheet(self) -> CompactBalanceSheet:
+        """Balance sheets of every scenario and year, shape (scenarios, years)."""
+        return CompactBalanceSheet(
+            self.values[:, :, : len(self.bs_keys)], self.bs_layout
+        )
+
+    @property
+    def forecast_drivers(self) -> np.ndarray:
+        return self.values[:, :, len(self.bs_keys) :]
+
+    def item(self, name: str) -> np.ndarray:
+        """
+        Returns a (scenarios, years) array for a line item or forecast driver.
+        """
+        assert name in self.line_items, f"{name} is not a forecast line item"
+        return self.values[:, :, self.line_items.index(name)]
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Returns the result as a DataFrame indexed by (scenario, year).
+        """
+        num_scenarios, num_years, num_items = self.values.shape
+        index = pd.MultiIndex.from_product(
+            [range(num_scenarios), range(1, num_years + 1)], names=["scenario", "year"]
+        )
+        return pd.DataFrame(
+            self.values.reshape(num_scenarios * num_years, num_items),
+            index=index,
+            columns=self.line_items,
+        )
+
+    def scenario(self, scenario: int = 0) -> list:
+        """
+        Returns one scenario in the legacy forecast_balancesheet format.
+
+        Returns:
+            List of tuples: [(forecast_bs_year1, forecast_drivers_year1), ...]
+        """
+        balance_sheet = self.balance_sheet
+        forecasted_years = []
+        for year in range(self.num_years):
+            driver_values = self.forecast_drivers[scenario, year].tolist()
+            forecasted_years.append(
+                (
+                    balance_sheet.row((scenario, year)).to_dict(),
+                    dict(zip(self.driver_keys, driver_values)),
+                )
+            )
+        return forecasted_years
+
+
+def _scenario_program(base_balance_sheet, program: ForecastProgram):
+    """Checks the base balance sheet and gets the program to run on it."""
+    if isinstance(base_balance_sheet, dict):
+        base_balance_sheet = CompactBalanceSheet.from_dict(base_balance_sheet)
+    bs_layout = base_balance_sheet.layout
+    program = program if program is not None else standard_program(bs_layout)
+    assert program.layout is bs_layout, (
+        "Forecast rules were compiled for another balance sheet layout"
+    )
+    return base_balance_sheet, program
+
+
+def iter_forecast_scenarios(
+    base_balance_sheet,
+    base_sales,
+    driver_table: pd.DataFrame,
+    num_years: int = 1,
+    tolerance: float = BALANCE_TOLERANCE,
+    program: ForecastProgram = None,
+):
+    """
+    Forecasts every scenario of a driver table, yielding one year at a time
+    so only the current year is held in memory.
+
+    Args:
+        base_balance_sheet: Base year CompactBalanceSheet, or a nested dict
+        base_sales: Base year sales, a scalar or one value per scenario
+        driver_table: Driver attributes, one row per scenario
+        num_years: Number of years to forecast
+        tolerance: Balance check tolerance, None to skip the check
+        program: Compiled forecast rules, the standard rules when None
+
+    Yields:
+        Tuple of (year_number, forecast_bs, forecast_drivers, imbalance) with
+        forecast_bs a CompactBalanceSheet of shape (scenarios,) and
+        forecast_drivers mapping names to (scenarios,) arrays
+    """
+    assert isinstance(num_years, int), "Number of years must be an integer"
+    assert num_years > 0, "Number of years must be greater than 0"
+
+    base_balance_sheet, program = _scenario_program(base_balance_sheet, program)
+    num_scenarios = len(driver_table)
+
+    drivers = {
+        key: driver_table[key].to_numpy(dtype="float64") for key in DRIVER_ATTRIBUTES
+    }
+    current_bs = base_balance_sheet
+    previous_sales = np.broadcast_to(
+        np.asarray(base_sales, dtype="float64"), (num_scenarios,)
+    )
+
+    for year in range(num_years):
+        with stage("forecast.year"):
+            current_bs, year_drivers = forecast_year(
+                current_bs, previous_sales, drivers, program
+            )
+        with stage("forecast.balance_check"):
+            imbalance = check_balance(current_bs, tolerance, year + 1)
+        count("forecast.scenario_years", amount=num_scenarios)
+
+        yield year + 1, current_bs, year_drivers, imbalance
+        previous_sales = year_drivers["sales"]
+
+
+def forecast_scenarios(
+    base_balance_sheet,
+    base_sales,
+    driver_table: pd.DataFrame,
+    num_years: int = 1,
+    tolerance: float = BALANCE_TOLERANCE,
+    program: ForecastProgram = None,
+) -> ScenarioForecast:
+    """
+    Forecasts every scenario of a driver table for multiple years.
+
+    The compiled rules write every year straight into the result array,
+    and the balance check runs once over all scenarios and years.
+
+    Args:
+        base_balance_sheet: Base year CompactBalanceSheet, or a nested dict
+        base_sales: Base year sales, a scalar or one value per scenario
+        driver_table: Driver attributes, one row per scenario
+        num_years: Number of years to forecast
+        tolerance: Balance check tolerance, None to skip the check
+        program: Compiled forecast rules, the standard rules when None
+
+    Returns:
+        ScenarioForecast with every scenario and year
+    """
+    assert isinstance(num_years, int), "Number of years must be an integer"
+    assert num_years > 0, "Number of years must be greater than 0"
+
+    base_balance_sheet, program = _scenario_program(base_balance_sheet, program)
+    bs_layout = program.layout
+    num_scenarios = len(driver_table)
+
+    drivers = {
+        key: driver_table[key].to_numpy(dtype="float64") for key in DRIVER_ATTRIBUTES
+    }
+    with stage("forecast.years"):
+        values = program.run(base_balance_sheet.values, base_sales, drivers, num_years)
+    with stage("forecast.balance_check"):
+        imbalance = check_balance(
+            CompactBalanceSheet(values[:, :, : len(bs_layout)], bs_layout), tolerance
+        )
+    count("forecast.scenario_years", amount=num_scenarios * num_years)
+
+    return ScenarioForecast.from_values(
+        driver_table.reset_index(drop=True), values, bs_layout, imbalance, program
+    )
+
+
+def extend_forecast(
+    forecast: ScenarioForecast,
+    num_years: int,
+    tolerance: float = BALANCE_TOLERANCE,
+) -> ScenarioForecast:
+    """
+    Continues a forecast to a longer horizon from its last year instead of
+    recomputing it. Every year only depends on the previous year's balance
+    sheet and sales, so the result is identical to forecasting num_years
+    from the base year.
+
+    Args:
+        forecast: Forecast to continue
+        num_years: Total number of years, more than forecast.num_years
+        tolerance: Balance check tolerance for the added years, None to skip
+            the check
+
+    Returns:
+        ScenarioForecast with the years of forecast followed by the new ones
+    """
+    assert isinstance(num_years, int), "Number of years must be an integer"
+    assert num_years > forecast.num_years, "Extended horizon must be longer"
+
+    bs_layout = forecast.bs_layout
+    last_year = forecast.values[:, -1]
+    extension = forecast_scenarios(
+        CompactBalanceSheet(last_year[:, : len(bs_layout)], bs_layout),
+        last_year[:, len(bs_layout) + FORECAST_DRIVERS.index("sales")],
+        forecast.drivers,
+        num_years=num_years - forecast.num_years,
+        tolerance=None,
+        program=forecast.program,
+    )
+    check_balance(extension.balance_sheet, tolerance, forecast.num_years + 1)
+
+    return ScenarioForecast.from_values(
+        forecast.drivers,
+        np.concatenate([forecast.values, extension.values], axis=1),
+        bs_layout,
+        np.concatenate([forecast.imbalance, extension.imbalance], axis=1),
+        forecast.program,
+    )
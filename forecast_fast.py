@@ -0,0 +1,216 @@
+import numpy as np
+import pandas as pd
+
+from balance_sheet import CompactBalanceSheet
+from forecast_engine import (
+    CASH,
+    CURRENT_DEBT,
+    DRIVER_ATTRIBUTES,
+    INVESTMENTS,
+    LONG_TERM_DEBT,
+    NET_PPE,
+    RELATIVE_BALANCE_TOLERANCE,
+    RETAINED_EARNINGS,
+    ScenarioForecast,
+    assert_balanced,
+    balance_limit,
+)
+from instrumentation import count, stage
+
+
+def linear_recurrence(a: np.ndarray, b: np.ndarray, x0: np.ndarray) -> np.ndarray:
+    """
+    Solves x_t = a * x_{t-1} + b_t for every period with a log-depth scan
+    (log2(periods) array operations instead of one step per period).
+
+    Args:
+        a: Per-scenario coefficient, shape (scenarios,)
+        b: Per-period term, shape (periods, scenarios)
+        x0: Initial value, shape (scenarios,)
+
+    Returns:
+        x_1 .. x_T, shape (periods, scenarios)
+    """
+    x = np.array(b, dtype="float64")
+    x[0] += a * x0
+    power = np.array(a, dtype="float64")
+    shift = 1
+    while shift < len(x):
+        # after this step x_t holds the recurrence started 2 * shift periods back
+        x[shift:] += power * x[:-shift]
+        power = power * power
+        shift *= 2
+    return x
+
+
+def forecast_long(
+    base_balance_sheet,
+    base_sales,
+    driver_table: pd.DataFrame,
+    num_periods: int,
+    tolerance: float = RELATIVE_BALANCE_TOLERANCE,
+) -> ScenarioForecast:
+    """
+    Forecasts every scenario of a driver table for a long horizon, same
+    model as forecast_engine.forecast_scenarios under the standard forecast
+    rules (forecast_rules.STANDARD_RULES). The recurrences below are those
+    of the standard rules only; a ticker with its own rules file is
+    forecast with forecast_scenarios.
+
+    The linear recurrences are solved as array operations over all periods:
+    sales compound with a cumulative product, net PPE rolls forward with a
+    linear scan and retained earnings and short-term investments are
+    cumulative sums. Only interest, which depends on the debt raised by the
+    cash threshold in earlier periods, steps one period at a time on
+    (scenarios,) arrays.
+
+    Results match forecast_scenarios up to rounding. Over 400 periods of
+    MSFT the differences stay below about 1e-12 of total assets. A line
+    item that is a small residual of much larger flows can differ by up to
+    about 1e-8 of its own value: cash held at the minimum while the balance
+    sheet compounds, for example.
+
+    Args:
+        base_balance_sheet: Base period CompactBalanceSheet, or a nested dict
+        base_sales: Base period sales, a scalar or one value per scenario
+        driver_table: Driver attributes, one row per scenario
+        num_periods: Number of periods (years or quarters) to forecast
+        tolerance: Balance check tolerance relative to total assets, see
+            forecast_engine.balance_limit, None to skip the check
+
+    Returns:
+        ScenarioForecast with values shaped (scenarios, periods, line items)
+    """
+    assert isinstance(num_periods, int), "Number of periods must be an integer"
+    assert num_periods > 0, "Number of periods must be greater than 0"
+
+    if isinstance(base_balance_sheet, dict):
+        base_balance_sheet = CompactBalanceSheet.from_dict(base_balance_sheet)
+    bs_layout = base_balance_sheet.layout
+    num_scenarios = len(driver_table)
+    shape = (num_periods, num_scenarios)
+
+    drivers = {
+        key: driver_table[key].to_numpy(dtype="float64") for key in DRIVER_ATTRIBUTES
+    }
+    base = base_balance_sheet.values
+    sales_0 = np.broadcast_to(np.asarray(base_sales, dtype="float64"), (num_scenarios,))
+
+    with stage("forecast.long.recurrences"):
+        # periods on the leading axis so every period is a contiguous row
+        growth = np.empty(shape)
+        growth[0] = sales_0 * drivers["sales_growth_rate"]
+        growth[1:] = drivers["sales_growth_rate"]
+        sales = np.multiply.accumulate(growth, axis=0)
+        operating_income = sales * drivers["operating_margin"]
+        capex = sales * drivers["capex_as_percentage_of_sales"]
+
+        depreciation_rate = drivers[
+            "depreciation_amortization_depletion_as_percentage_of_net_ppe"
+        ]
+        ppe_0 = np.full(num_scenarios, base[bs_layout.positions[NET_PPE]])
+        net_ppe = linear_recurrence(1.0 - depreciation_rate, capex, ppe_0)
+        depreciation = np.empty(shape)
+        depreciation[0] = ppe_0 * depreciation_rate
+        depreciation[1:] = net_ppe[:-1] * depreciation_rate
+
+    with stage("forecast.long.financing"):
+        interest_rate = drivers["interest_rate_on_debt"]
+        tax_rate = drivers["tax_rate"]
+        payout = drivers["dividend_payout_ratio"]
+        minimum_cash = drivers["minimum_cash_required"]
+        interest_expense, tax_provision = np.empty(shape), np.empty(shape)
+        net_income, dividends = np.empty(shape), np.empty(shape)
+        new_debt, new_investment, cash = np.empty(shape), np.empty(shape), np.empty(shape)
+        long_term_debt = np.empty(shape)
+
+        current_debt = base[bs_layout.positions[CURRENT_DEBT]]
+        previous_cash = np.full(num_scenarios, base[bs_layout.positions[CASH]])
+        previous_ltd = np.full(num_scenarios, base[bs_layout.positions[LONG_TERM_DEBT]])
+        for period in range(num_periods):
+            interest = (current_debt + previous_ltd) * interest_rate
+            pretax = operating_income[period] - interest
+            tax = pretax * tax_rate
+            income = pretax - tax
+            paid = income * payout
+            net_cash_flow = income + depreciation[period] - capex[period] - paid
+            surplus = previous_cash + net_cash_flow - minimum_cash
+            deficit = surplus < 0
+            borrowed = np.where(deficit, -surplus, 0.0)
+            invested = np.where(deficit, 0.0, surplus)
+            previous_cash = previous_cash + net_cash_flow + borrowed - invested
+            previous_ltd = previous_ltd + borrowed
+
+            interest_expense[period] = interest
+            tax_provision[period] = tax
+            net_income[period] = income
+            dividends[period] = paid
+            new_debt[period] = borrowed
+            new_investment[period] = invested
+            cash[period] = previous_cash
+            long_term_debt[period] = previous_ltd
+        count("forecast.scenario_years", amount=num_scenarios * num_periods)
+
+    with stage("forecast.long.assemble"):
+        positions = bs_layout.positions
+        investments = base[positions[INVESTMENTS]] + np.cumsum(new_investment, axis=0)
+        retained_earnings = base[positions[RETAINED_EARNINGS]] + np.cumsum(
+            net_income - dividends, axis=0
+        )
+        columns = {
+            CASH: cash,
+            NET_PPE: net_ppe,
+            INVESTMENTS: investments,
+            LONG_TERM_DEBT: long_term_debt,
+            RETAINED_EARNINGS: retained_earnings,
+        }
+        forecast_drivers = (
+            sales,
+            operating_income,
+            depreciation,
+            operating_income,
+            interest_expense,
+            operating_income - interest_expense,
+            tax_provision,
+            net_income,
+            capex,
+            dividends,
+            new_debt,
+            new_investment,
+        )
+        # filled one contiguous (periods, scenarios) plane per line item and
+        # transposed once, much faster than interleaving the columns directly
+        planes = np.empty((len(bs_layout) + len(forecast_drivers), *shape))
+        planes[: len(bs_layout)] = base[:, np.newaxis, np.newaxis]
+        for key, column in columns.items():
+            planes[positions[key]] = column
+        for position, column in enumerate(forecast_drivers, len(bs_layout)):
+            planes[position] = column
+        values = np.ascontiguousarray(planes.transpose(2, 1, 0))
+        del planes
+
+    with stage("forecast.balance_check"):
+        # Only the columns above differ from the base balance sheet, so the
+        # totals move by their changes; the check costs five columns instead
+        # of a sum over every line item of every scenario and period.
+        base_bs = CompactBalanceSheet(base, bs_layout)
+        change_in_assets = (
+            (cash - base[positions[CASH]])
+            + (net_ppe - base[positions[NET_PPE]])
+            + (investments - base[positions[INVESTMENTS]])
+        )
+        change_in_claims = (long_term_debt - base[positions[LONG_TERM_DEBT]]) + (
+            retained_earnings - base[positions[RETAINED_EARNINGS]]
+        )
+        imbalance = (base_bs.balance_check() + change_in_assets - change_in_claims).T
+        if tolerance is not None:
+            total_assets = base_bs.total_assets + change_in_assets.T
+            limit = balance_limit(total_assets, tolerance)
+            failed = ~(np.abs(imbalance) < limit)
+            if failed.any():
+                period = int(np.flatnonzero(failed.any(axis=0))[0])
+                assert_balanced(imbalance[:, period], period + 1, limit[:, period])
+
+    return ScenarioForecast.from_values(
+        driver_table.reset_index(drop=True), values, bs_layout, imbalance
+    )
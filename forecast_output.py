@@ -0,0 +1,212 @@
+import abc
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from forecast_engine import FORECAST_DRIVERS
+
+KEY_COLUMNS = ["ticker", "base_date", "scenario", "year"]
+
+
+def forecast_year_frame(
+    ticker: str, base_date: str, year_number: int, forecast_bs, forecast_drivers
+) -> pd.DataFrame:
+    """
+    Flattens one forecast year of every scenario into rows keyed by ticker,
+    base date, scenario and year, one column per line item and driver.
+    """
+    num_scenarios = forecast_bs.shape[0]
+    frame = pd.DataFrame(forecast_bs.values, columns=forecast_bs.layout.keys)
+    for key in FORECAST_DRIVERS:
+        frame[key] = forecast_drivers[key]
+    keys = pd.DataFrame(
+        {
+            "ticker": ticker,
+            "base_date": base_date,
+            "scenario": np.arange(num_scenarios),
+            "year": year_number,
+        }
+    )
+    return pd.concat([keys, frame], axis=1)
+
+
+def forecast_frame(
+    ticker: str, base_date: str, forecast, years=None
+) -> pd.DataFrame:
+    """
+    Flattens a ScenarioForecast into rows keyed by ticker, base date,
+    scenario and year, one column per line item and driver.
+
+    Args:
+        years: Forecast years to keep (1 is the first), all when None
+    """
+    num_scenarios, num_years, _ = forecast.values.shape
+    years = np.arange(1, num_years + 1) if years is None else np.asarray(years)
+    values = forecast.values[:, years - 1]
+    frame = pd.DataFrame(
+        values.reshape(num_scenarios * len(years), -1), columns=forecast.line_items
+    )
+    keys = pd.DataFrame(
+        {
+            "ticker": ticker,
+            "base_date": base_date,
+            "scenario": np.repeat(np.arange(num_scenarios), len(years)),
+            "year": np.tile(years, num_scenarios),
+        }
+    )
+    return pd.concat([keys, frame], axis=1)
+
+
+def iter_forecast_frames(
+    company, base_year: str, num_years: int = 1, overrides=None, grid: bool = False
+):
+    """
+    Forecasts a company and yields one flattened DataFrame per year.
+    """
+    for year_number, forecast_bs, forecast_drivers, _ in company.iter_forecast_scenarios(
+        base_year, num_years=num_years, overrides=overrides, grid=grid
+    ):
+        yield forecast_year_frame(
+            company.ticker_name, base_year, year_number, forecast_bs, forecast_drivers
+        )
+
+
+class ForecastSink(abc.ABC):
+    """
+    Base class of forecast output sinks. Batches of flattened rows are
+    written with write() and the sink is finalized with close(). Subclasses
+    implement _write for one batch.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.rows_written = 0
+
+    def write(self, frame: pd.DataFrame):
+        self._write(frame)
+        self.rows_written += len(frame)
+
+    @abc.abstractmethod
+    def _write(self, frame: pd.DataFrame):
+        """Writes one batch of rows."""
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class CSVSink(ForecastSink):
+    """Writes rows to a CSV file, the header once with the first batch."""
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self._file = open(path, "w", newline="")
+
+    def _write(self, frame: pd.DataFrame):
+        frame.to_csv(self._file, header=self.rows_written == 0, index=False)
+
+    def close(self):
+        self._file.close()
+
+
+class JSONLSink(ForecastSink):
+    """Writes one JSON object per row, to standard output when path is "-"."""
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self._file = sys.stdout if path == "-" else open(path, "w")
+
+    def _write(self, frame: pd.DataFrame):
+        columns = list(frame.columns)
+        for row in frame.itertuples(index=False, name=None):
+            self._file.write(json.dumps(dict(zip(columns, _to_json(row)))) + "\n")
+        # every batch reaches a reader of the stream as soon as it is written
+        self._file.flush()
+
+    def close(self):
+        if self._file is not sys.stdout:
+            self._file.close()
+
+
+class ParquetSink(ForecastSink):
+    """Writes every batch as a row group of a Parquet file, requires pyarrow."""
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError as e:
+            raise ImportError("ParquetSink requires pyarrow to be installed.") from e
+        self._writer = None
+
+    def _write(self, frame: pd.DataFrame):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.path, table.schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+SINKS = {".csv": CSVSink, ".jsonl": JSONLSink, ".parquet": ParquetSink}
+
+
+def open_sink(path: str) -> ForecastSink:
+    """
+    Opens the sink matching a file extension (.csv, .jsonl, .parquet), or
+    JSON lines on standard output for "-".
+    """
+    if path == "-":
+        return JSONLSink(path)
+    extension = os.path.splitext(path)[1].lower()
+    assert extension in SINKS, f"Unsupported output format {extension}"
+    return SINKS[extension](path)
+
+
+def write_forecast(frames, sink: ForecastSink, batch_rows: int = 10000) -> int:
+    """
+    Writes flattened forecast frames to a sink in batches of about
+    batch_rows rows, so memory stays bounded whatever the horizon.
+
+    Returns:
+        Number of rows written
+    """
+    assert batch_rows > 0, "Batch rows must be greater than 0"
+    pending, pending_rows = [], 0
+    rows_written = 0
+    for frame in frames:
+        pending.append(frame)
+        pending_rows += len(frame)
+        if pending_rows >= batch_rows:
+            sink.write(pd.concat(pending, ignore_index=True))
+            rows_written += pending_rows
+            pending, pending_rows = [], 0
+    if pending:
+        sink.write(pd.concat(pending, ignore_index=True))
+        rows_written += pending_rows
+    return rows_written
+
+
+def _to_json(row: tuple) -> list:
+    """Converts numpy scalars to JSON-serializable values, NaN to null."""
+    values = []
+    for value in row:
+        if isinstance(value, np.generic):
+            value = value.item()
+        if isinstance(value, float) and value != value:
+            value = None
+        values.append(value)
+    return values
@@ -0,0 +1,578 @@
+import functools
+import hashlib
+import json
+import operator
+import os
+import threading
+
+import numpy as np
+
+from balance_sheet import BalanceSheetLayout
+from instrumentation import count, stage
+from statement_maps import DEFAULT_CONFIG_DIR
+
+# Driver attributes accepted by the forecast, in the order they are derived
+DRIVER_ATTRIBUTES = (
+    "sales_growth_rate",
+    "operating_margin",
+    "capex_as_percentage_of_sales",
+    "depreciation_amortization_depletion_as_percentage_of_net_ppe",
+    "interest_rate_on_debt",
+    "tax_rate",
+    "dividend_payout_ratio",
+    "minimum_cash_required",
+)
+
+# Quantities computed for every forecast year, in the legacy dict order
+FORECAST_DRIVERS = (
+    "sales",
+    "operating_income",
+    "depreciation",
+    "ebit",
+    "interest_expense",
+    "pretax_income",
+    "tax_provision",
+    "net_income",
+    "capex",
+    "dividends_paid",
+    "new_debt_needed",
+    "new_st_investment",
+)
+
+# Balance sheet line items of the standard rules
+CASH = "total_assets.current_assets.cash_and_equivalents"
+NET_PPE = "total_assets.non_current_assets.net_ppe"
+INVESTMENTS = "total_assets.non_current_assets.investments"
+CURRENT_DEBT = "total_liabilities.current_liabilities.current_debt"
+LONG_TERM_DEBT = "total_liabilities.non_current_liabilities.long_term_debt"
+RETAINED_EARNINGS = "total_equity.retained_earnings"
+
+RULES_FILE = "forecast_rules.json"
+
+# How a line item is forecast from the previous year:
+#   carry         unchanged
+#   sales         grows with sales (times the sales growth rate); the change
+#                 is paid from (assets) or into (liabilities, equity) cash
+#   roll_forward  plus forecast drivers times coefficients, in file order,
+#                 e.g. {"roll_forward": {"depreciation": -1, "capex": 1}}
+#   plug          the cash account: takes the year's net cash flow and is
+#                 brought to minimum_cash_required by new debt (a deficit)
+#                 or new short-term investment (a surplus)
+RULE_KINDS = ("carry", "sales", "roll_forward", "plug")
+
+
+def _total(*values):
+    """Sums in order, like ForecastProgram.base."""
+    total = values[0]
+    for value in values[1:]:
+        total = total + value
+    return total
+
+
+def _new_debt(surplus):
+    """Debt raised to bring a cash deficit back to the minimum cash."""
+    if isinstance(surplus, np.ndarray):
+        return np.where(surplus < 0, -surplus, 0.0)
+    return -surplus if surplus < 0 else 0.0
+
+
+def _new_investment(surplus):
+    """Cash above the minimum moved into short-term investments."""
+    if isinstance(surplus, np.ndarray):
+        return np.where(surplus < 0, 0.0, surplus)
+    return 0.0 if surplus < 0 else surplus
+
+
+def _ebit(operating_income):
+    """EBIT, the operating income: the model has no other operating items."""
+    return operating_income
+
+
+def _net_cash_flow(net_income, depreciation, capex, dividends_paid, working_capital):
+    """Net cash flow of the year before any new financing."""
+    return net_income + depreciation + -capex + -dividends_paid - working_capital
+
+
+def _cash_surplus(previous_plug, net_cash_flow, minimum_cash):
+    """Cash above (or, negative, below) the minimum before new financing."""
+    return previous_plug + net_cash_flow - minimum_cash
+
+
+def _plug(previous_plug, net_cash_flow, new_debt, new_investment):
+    """The cash account after the year's net cash flow and new financing."""
+    return previous_plug + net_cash_flow + new_debt - new_investment
+
+
+# The income statement and cash flow chain of one year: (name, inputs,
+# formula) in evaluation order. Inputs are driver attributes, earlier
+# quantities of the year and the year's starting point: previous_sales,
+# depreciation_base and interest_base (the previous year's bases),
+# previous_plug and working_capital. Formulas work on scalars and on
+# arrays of scenarios alike.
+YEAR_FLOWS = (
+    ("sales", ("previous_sales", "sales_growth_rate"), operator.mul),
+    ("operating_income", ("sales", "operating_margin"), operator.mul),
+    (
+        "depreciation",
+        (
+            "depreciation_base",
+            "depreciation_amortization_depletion_as_percentage_of_net_ppe",
+        ),
+        operator.mul,
+    ),
+    ("ebit", ("operating_income",), _ebit),
+    ("interest_expense", ("interest_base", "interest_rate_on_debt"), operator.mul),
+    ("pretax_income", ("ebit", "interest_expense"), operator.sub),
+    ("tax_provision", ("pretax_income", "tax_rate"), operator.mul),
+    ("net_income", ("pretax_income", "tax_provision"), operator.sub),
+    ("capex", ("sales", "capex_as_percentage_of_sales"), operator.mul),
+    ("dividends_paid", ("net_income", "dividend_payout_ratio"), operator.mul),
+    (
+        "net_cash_flow_before_new_financing",
+        ("net_income", "depreciation", "capex", "dividends_paid", "working_capital"),
+        _net_cash_flow,
+    ),
+    (
+        "cash_surplus_or_deficit",
+        (
+            "previous_plug",
+            "net_cash_flow_before_new_financing",
+            "minimum_cash_required",
+        ),
+        _cash_surplus,
+    ),
+    ("new_debt_needed", ("cash_surplus_or_deficit",), _new_debt),
+    ("new_st_investment", ("cash_surplus_or_deficit",), _new_investment),
+    (
+        "plug",
+        (
+            "previous_plug",
+            "net_cash_flow_before_new_financing",
+            "new_debt_needed",
+            "new_st_investment",
+        ),
+        _plug,
+    ),
+)
+
+# Line items whose previous-year sum a driver attribute multiplies:
+# base -> driver attribute
+BASE_DRIVERS = {
+    "depreciation": "depreciation_amortization_depletion_as_percentage_of_net_ppe",
+    "interest": "interest_rate_on_debt",
+}
+
+# The model the forecast was written for, used when a ticker has no rules
+# file. Unlisted line items follow the default rule.
+STANDARD_RULES = {
+    "default": "carry",
+    "bases": {
+        "depreciation": [NET_PPE],
+        "interest": [CURRENT_DEBT, LONG_TERM_DEBT],
+    },
+    "line_items": {
+        CASH: "plug",
+        NET_PPE: {"roll_forward": {"depreciation": -1, "capex": 1}},
+        INVESTMENTS: {"roll_forward": {"new_st_investment": 1}},
+        LONG_TERM_DEBT: {"roll_forward": {"new_debt_needed": 1}},
+        RETAINED_EARNINGS: {"roll_forward": {"net_income": 1, "dividends_paid": -1}},
+    },
+}
+
+
+def _parse_rule(key: str, rule) -> tuple:
+    """Normalizes a line item rule into (kind,) or ("roll_forward", flows)."""
+    if isinstance(rule, str):
+        assert rule in RULE_KINDS and rule != "roll_forward", (
+            f"Unknown forecast rule {rule!r} for {key}, expected one of "
+            f"carry, sales, plug or a roll_forward object"
+        )
+        return (rule,)
+    assert isinstance(rule, dict) and list(rule) == ["roll_forward"], (
+        f"Forecast rule for {key} must be a string or a roll_forward object"
+    )
+    flows = rule["roll_forward"]
+    assert isinstance(flows, dict) and flows, (
+        f"roll_forward of {key} must map forecast drivers to coefficients"
+    )
+    for flow, coefficient in flows.items():
+        assert flow in FORECAST_DRIVERS, (
+            f"{flow} in the roll_forward of {key} is not a forecast driver"
+        )
+        assert isinstance(coefficient, (int, float)), (
+            f"Coefficient of {flow} in the roll_forward of {key} must be a number"
+        )
+    return ("roll_forward", tuple((flow, float(c)) for flow, c in flows.items()))
+
+
+class NonStandardRulesError(ValueError):
+    """
+    Raised for a ticker with its own forecast rules by a forecast that
+    only solves the standard rules (CompanyFS.forecast_long).
+    """
+
+
+class ForecastProgram:
+    """
+    Forecast rules compiled against a balance sheet layout into an ordered
+    array program over (scenarios, years, line items).
+
+    Carried and sales driven line items do not depend on the rest of the
+    forecast, so they are filled for every year and scenario at once. The
+    income statement and cash flow chain, the plug and the roll-forward
+    steps then run once per year, each a single array operation over every
+    scenario (a roll-forward step updates every rolled item at once).
+
+    The same year is also available as graph, a tuple of (name, inputs,
+    formula) in evaluation order over scalar quantities: the YEAR_FLOWS,
+    the bases, working capital and every line item that is not carried,
+    named by its key. Inputs named "prev:<name>" are previous-year values.
+    ForecastSession uses it to recompute only what an override affects.
+    """
+
+    def __init__(self, rules: dict, layout: BalanceSheetLayout):
+        """
+        Args:
+            rules: Parsed forecast rules, see STANDARD_RULES
+            layout: Balance sheet layout the rules refer to
+        """
+        assert isinstance(rules, dict), "Forecast rules must be a JSON object"
+        unknown = set(rules) - {"default", "bases", "line_items"}
+        assert not unknown, f"Unknown forecast rules keys {sorted(unknown)}"
+        default = rules.get("default", "carry")
+        assert default in ("carry", "sales"), "Default rule must be carry or sales"
+        self.layout = layout
+
+        self.bases = {}
+        bases = rules.get("bases", STANDARD_RULES["bases"])
+        for name in BASE_DRIVERS:
+            keys = bases.get(name, STANDARD_RULES["bases"][name])
+            assert isinstance(keys, list) and keys, (
+                f"Base {name} must be a non-empty list of line items"
+            )
+            for key in keys:
+                assert key in layout.positions, (
+                    f"{key} in base {name} is not a line item of the balance sheet map"
+                )
+            self.bases[name] = tuple(keys)
+        unknown = set(bases) - set(BASE_DRIVERS)
+        assert not unknown, f"Unknown forecast bases {sorted(unknown)}"
+
+        self.rules = {key: (default,) for key in layout.keys}
+        for key, rule in rules.get("line_items", {}).items():
+            assert key in layout.positions, (
+                f"{key} has a forecast rule but is not a line item of the "
+                "balance sheet map"
+            )
+            self.rules[key] = _parse_rule(key, rule)
+
+        plugs = [key for key, rule in self.rules.items() if rule[0] == "plug"]
+        assert len(plugs) == 1, (
+            f"Forecast rules need exactly one plug line item, got {plugs}"
+        )
+        self.plug = plugs[0]
+        assets = layout.section_slice("total_assets")
+        assert assets.start <= layout.positions[self.plug] < assets.stop, (
+            f"Plug {self.plug} must be an asset"
+        )
+
+        def positions(kind: str) -> np.ndarray:
+            return np.array(
+                [layout.positions[key] for key, rule in self.rules.items()
+                 if rule[0] == kind],
+                dtype=np.intp,
+            )
+
+        self.carry_positions = positions("carry")
+        self.sales_positions = positions("sales")
+        # change of an asset uses cash, of a liability or equity provides it
+        self.sales_signs = np.where(
+            (self.sales_positions >= assets.start)
+            & (self.sales_positions < assets.stop),
+            1.0,
+            -1.0,
+        )
+        self.plug_position = layout.positions[self.plug]
+        self.base_positions = {
+            name: [layout.positions[key] for key in keys]
+            for name, keys in self.bases.items()
+        }
+
+        # step k adds the k-th flow of every item with more than k flows
+        rolled = [
+            (layout.positions[key], rule[1])
+            for key, rule in self.rules.items()
+            if rule[0] == "roll_forward"
+        ]
+        self.roll_forward = []
+        for step in range(max((len(flows) for _, flows in rolled), default=0)):
+            entries = [
+                (position, flows[step]) for position, flows in rolled
+                if len(flows) > step
+            ]
+            self.roll_forward.append(
+                (
+                    np.array([position for position, _ in entries], dtype=np.intp),
+                    np.array(
+                        [FORECAST_DRIVERS.index(flow) for _, (flow, _) in entries],
+                        dtype=np.intp,
+                    ),
+                    np.array([c for _, (_, c) in entries], dtype="float64"),
+                )
+            )
+
+        self.graph = self._graph()
+        # same as ForecastRules.digest, keys caches without reloading the rules
+        self.digest = hashlib.sha256(json.dumps(rules).encode()).hexdigest()
+
+        if rules is STANDARD_RULES:
+            self.standard = True
+        else:
+            try:
+                reference = STANDARD.compile(layout)
+            except AssertionError:
+                reference = None
+            self.standard = (
+                reference is not None
+                and self.rules == reference.rules
+                and self.bases == reference.bases
+            )
+
+    def __repr__(self):
+        kinds = [rule[0] for rule in self.rules.values()]
+        return (
+            f"ForecastProgram({kinds.count('carry')} carried, "
+            f"{kinds.count('sales')} sales driven, "
+            f"{kinds.count('roll_forward')} rolled forward in "
+            f"{len(self.roll_forward)} steps, plug {self.plug})"
+        )
+
+    def base(self, values: np.ndarray, name: str) -> np.ndarray:
+        """
+        Sums the line items of a base ("depreciation" or "interest"), in
+        rules order, over the last axis of balance sheet values.
+        """
+        positions = self.base_positions[name]
+        total = values[..., positions[0]]
+        for position in positions[1:]:
+            total = total + values[..., position]
+        return total
+
+    def run(
+        self, base_values: np.ndarray, base_sales, drivers: dict, num_years: int
+    ) -> np.ndarray:
+        """
+        Forecasts every scenario for num_years.
+
+        Args:
+            base_values: Base balance sheet values, shape (line items,) or
+                (scenarios, line items)
+            base_sales: Base sales, a scalar or one value per scenario
+            drivers: Driver attribute name -> array of shape (scenarios,)
+            num_years: Number of years to forecast
+
+        Returns:
+            Array of shape (scenarios, years, line items) where line items
+            are the balance sheet keys followed by the forecast drivers
+        """
+        num_scenarios = len(drivers["sales_growth_rate"])
+        num_items = len(self.layout)
+        # computed one contiguous (years, scenarios) plane per line item and
+        # transposed once at the end
+        planes = np.empty((num_items + len(FORECAST_DRIVERS), num_years, num_scenarios))
+        base = np.broadcast_to(base_values, (num_scenarios, num_items)).T
+        growth_rate = drivers["sales_growth_rate"]
+
+        planes[self.carry_positions] = base[self.carry_positions, np.newaxis]
+        working_capital = None
+        if len(self.sales_positions):
+            growth = np.empty((len(self.sales_positions), num_years, num_scenarios))
+            growth[:, 0] = base[self.sales_positions] * growth_rate
+            growth[:, 1:] = growth_rate
+            grown = np.multiply.accumulate(growth, axis=1)
+            planes[self.sales_positions] = grown
+            previous = np.concatenate(
+                [base[self.sales_positions, np.newaxis], grown[:, :-1]], axis=1
+            )
+            working_capital = (
+                (grown - previous) * self.sales_signs[:, np.newaxis, np.newaxis]
+            ).sum(axis=0)
+
+        previous_bs = base
+        previous_sales = np.broadcast_to(
+            np.asarray(base_sales, dtype="float64"), (num_scenarios,)
+        )
+        for year in range(num_years):
+            self._year(
+                previous_bs,
+                previous_sales,
+                drivers,
+                planes[:num_items, year],
+                planes[num_items:, year],
+                None if working_capital is None else working_capital[year],
+            )
+            previous_bs = planes[:num_items, year]
+            previous_sales = planes[num_items, year]
+        return np.ascontiguousarray(planes.transpose(2, 1, 0))
+
+    def _year(
+        self,
+        previous_bs: np.ndarray,
+        previous_sales: np.ndarray,
+        drivers: dict,
+        balance_sheet: np.ndarray,
+        flows: np.ndarray,
+        working_capital: np.ndarray = None,
+    ):
+        """
+        Computes the forecast drivers, the plug and the rolled forward line
+        items of one year into balance_sheet and flows, (items, scenarios)
+        views of the output planes.
+        """
+        values = dict(drivers)
+        values["previous_sales"] = previous_sales
+        values["depreciation_base"] = self.base(previous_bs.T, "depreciation")
+        values["interest_base"] = self.base(previous_bs.T, "interest")
+        values["previous_plug"] = previous_bs[self.plug_position]
+        values["working_capital"] = 0.0 if working_capital is None else working_capital
+        get = values.__getitem__
+        for name, inputs, formula in YEAR_FLOWS:
+            values[name] = formula(*map(get, inputs))
+
+        flows[:] = [values[name] for name in FORECAST_DRIVERS]
+        balance_sheet[self.plug_position] = values["plug"]
+        for step, (positions, sources, coefficients) in enumerate(self.roll_forward):
+            start = previous_bs if step == 0 else balance_sheet
+            balance_sheet[positions] = (
+                start[positions] + flows[sources] * coefficients[:, np.newaxis]
+            )
+
+    def _graph(self) -> tuple:
+        """
+        The year as a graph of scalar quantities, see the graph attribute.
+        """
+        graph = [
+            (
+                f"{name}_base",
+                tuple(f"prev:{key}" for key in keys),
+                _total,
+            )
+            for name, keys in self.bases.items()
+        ]
+        sales_items = [key for key, rule in self.rules.items() if rule[0] == "sales"]
+        for key in sales_items:
+            graph.append((key, (f"prev:{key}", "sales_growth_rate"), operator.mul))
+        graph.append(
+            (
+                "working_capital",
+                tuple(
+                    name for key in sales_items for name in (key, f"prev:{key}")
+                ),
+                functools.partial(_working_capital, self.sales_signs.tolist()),
+            )
+        )
+
+        renamed = {"previous_sales": "prev:sales", "previous_plug": f"prev:{self.plug}"}
+        for name, inputs, formula in YEAR_FLOWS:
+            graph.append(
+                (
+                    self.plug if name == "plug" else name,
+                    tuple(renamed.get(key, key) for key in inputs),
+                    formula,
+                )
+            )
+
+        for key, rule in self.rules.items():
+            if rule[0] == "roll_forward":
+                flows = rule[1]
+                graph.append(
+                    (
+                        key,
+                        (f"prev:{key}", *(flow for flow, _ in flows)),
+                        functools.partial(
+                            _roll_forward, tuple(c for _, c in flows)
+                        ),
+                    )
+                )
+        return tuple(graph)
+
+
+def _working_capital(signs: list, *values):
+    """Cash used by the sales driven items: values alternate current, previous."""
+    total = 0.0
+    for position, sign in enumerate(signs):
+        total = total + (values[2 * position] - values[2 * position + 1]) * sign
+    return total
+
+
+def _roll_forward(coefficients: tuple, start, *flows):
+    """Rolls a line item forward by its flows times their coefficients."""
+    value = start
+    for flow, coefficient in zip(flows, coefficients):
+        value = value + flow * coefficient
+    return value
+
+
+class ForecastRules:
+    """
+    A ticker's forecast rules: how every balance sheet line item moves from
+    one year to the next. Compiled once per balance sheet layout.
+    """
+
+    def __init__(self, path: str, mtime: int, tree: dict):
+        self.path = path
+        self.mtime = mtime
+        self.tree = tree
+        self.digest = hashlib.sha256(json.dumps(tree).encode()).hexdigest()
+        self._programs = {}
+
+    def compile(self, layout: BalanceSheetLayout) -> ForecastProgram:
+        """Returns the rules compiled against a layout, compiled once."""
+        program = self._programs.get(layout)
+        if program is None:
+            with stage("rules.compile"):
+                program = ForecastProgram(self.tree, layout)
+            self._programs[layout] = program
+        return program
+
+
+STANDARD = ForecastRules(None, None, STANDARD_RULES)
+
+_loaded_rules = {}
+_loaded_rules_lock = threading.Lock()
+
+
+def standard_program(layout: BalanceSheetLayout) -> ForecastProgram:
+    """The standard rules compiled against a layout."""
+    return STANDARD.compile(layout)
+
+
+def load_rules(ticker: str, config_dir: str = DEFAULT_CONFIG_DIR) -> ForecastRules:
+    """
+    Loads config/<TICKER>/forecast_rules.json, once per process, or the
+    standard rules when the ticker has no rules file. The cached rules are
+    reloaded when the file's modification time changes.
+    """
+    path = f"{config_dir}/{ticker.upper()}/{RULES_FILE}"
+    if not os.path.exists(path):
+        return STANDARD
+    mtime = os.stat(path).st_mtime_ns
+
+    rules = _loaded_rules.get(path)
+    if rules is not None and rules.mtime == mtime:
+        count("rules_cache.hit", ticker.upper())
+        return rules
+
+    count("rules_cache.miss", ticker.upper())
+    with open(path, "r") as f:
+        tree = json.load(f)
+    rules = ForecastRules(path, mtime, tree)
+    with _loaded_rules_lock:
+        _loaded_rules[path] = rules
+    return rules
+
+
+def clear_rules_cache():
+    """Drops every loaded rules file, forcing them to be reloaded."""
+    with _loaded_rules_lock:
+        _loaded_rules.clear()
@@ -0,0 +1,250 @@
+import functools
+
+import numpy as np
+
+from balance_sheet import CompactBalanceSheet
+from forecast_engine import (
+    DRIVER_ATTRIBUTES,
+    FORECAST_DRIVERS,
+    check_balance,
+    known_driver_keys,
+)
+from forecast_rules import ForecastProgram
+
+# Where an input of a graph node is read from: the previous year, the
+# year's driver attributes or the quantities of the year itself
+PREVIOUS, DRIVERS, CURRENT = range(3)
+
+
+def _dirty_nodes(program: ForecastProgram, changed: set) -> set:
+    """Returns the graph nodes of one year affected by changed inputs."""
+    dirty = set()
+    for name, inputs, _ in program.graph:
+        if any(input_name in changed or input_name in dirty for input_name in inputs):
+            dirty.add(name)
+    return dirty
+
+
+@functools.lru_cache(maxsize=4096)
+def _plan(program: ForecastProgram, changed: frozenset):
+    """
+    Selects the graph nodes to recompute for a set of changed inputs (all
+    of them when changed is None), in evaluation order.
+
+    Returns:
+        Tuple of (steps, the recomputed quantities as previous-year inputs
+        of the next year) where steps are (name, node) with node a function
+        of the year's (previous, drivers, current) dicts, see _bind
+    """
+    dirty = (
+        {name for name, _, _ in program.graph}
+        if changed is None
+        else _dirty_nodes(program, changed)
+    )
+    steps = []
+    for name, inputs, formula in program.graph:
+        if name not in dirty:
+            continue
+        sources = []
+        for input_name in inputs:
+            if input_name.startswith("prev:"):
+                sources.append((PREVIOUS, input_name[5:]))
+            elif input_name in DRIVER_ATTRIBUTES:
+                sources.append((DRIVERS, input_name))
+            else:
+                sources.append((CURRENT, input_name))
+        steps.append((name, _bind(formula, sources)))
+    return tuple(steps), frozenset(f"prev:{name}" for name in dirty)
+
+
+def _bind(formula, inputs: list):
+    """
+    Binds a formula to its inputs: a function of the (previous, drivers,
+    current) dicts of a year. Nodes of one or two inputs, most of them, get
+    their own closure instead of a loop over the inputs.
+    """
+    if len(inputs) == 1:
+        ((source, key),) = inputs
+        return lambda sources: formula(sources[source][key])
+    if len(inputs) == 2:
+        (source_0, key_0), (source_1, key_1) = inputs
+        return lambda sources: formula(
+            sources[source_0][key_0], sources[source_1][key_1]
+        )
+    inputs = tuple(inputs)
+    return lambda sources: formula(
+        *[sources[source][key] for source, key in inputs]
+    )
+
+
+def dependency_graph(program: ForecastProgram) -> dict:
+    """
+    Returns driver attribute -> quantities it affects under a ticker's
+    compiled forecast rules, following the previous-year edges until the
+    set no longer grows.
+    """
+    graph = {}
+    for driver in DRIVER_ATTRIBUTES:
+        changed = {driver}
+        affected = set()
+        while True:
+            dirty = _dirty_nodes(program, changed)
+            if dirty <= affected:
+                break
+            affected |= dirty
+            changed = {driver} | {f"prev:{name}" for name in affected}
+        graph[driver] = affected
+    return graph
+
+
+class ForecastSession:
+    """
+    Keeps the base statements and every intermediate quantity of a forecast
+    so that changing an override only recomputes the quantities and years
+    that depend on it.
+
+    The quantities and their dependencies are the graph of the company's
+    compiled forecast rules (ForecastProgram.graph): the forecast drivers,
+    their intermediate steps and every line item that is not carried,
+    named by its key.
+    """
+
+    def __init__(self, company, base_year: str, num_years: int = 1, override=None):
+        """
+        Args:
+            company: CompanyFS to forecast
+            base_year: Base year date in YYYY-MM-DD format
+            num_years: Number of years to forecast
+            override: Driver attribute overrides applied to every year
+        """
+        assert isinstance(num_years, int), "Number of years must be an integer"
+        assert num_years > 0, "Number of years must be greater than 0"
+
+        self.program = company.forecast_program
+        base_balance_sheet, base_sales, driver_attributes = company._forecast_base(
+            base_year, self.program
+        )
+        self.base_year = base_year
+        self.base_balance_sheet = base_balance_sheet
+        # plain floats, numpy scalar arithmetic is several times slower
+        self.base_drivers = {
+            key: float(value) for key, value in driver_attributes.items()
+        }
+        self.last_recomputed = 0
+
+        layout = base_balance_sheet.layout
+        base = dict(zip(layout.keys, base_balance_sheet.values.tolist()))
+        base["sales"] = float(base_sales)
+        computed = {name for name, _, _ in self.program.graph}
+        # carried line items, the same in every year
+        self._carried = {key: base[key] for key in layout.keys if key not in computed}
+
+        # values[0] is the base year, values[n] the n-th forecast year
+        self.values = [base]
+        self.drivers = []
+        self.extend(num_years)
+        if override:
+            self.set_overrides(override)
+
+    @property
+    def num_years(self) -> int:
+        return len(self.values) - 1
+
+    def dependency_graph(self) -> dict:
+        """Driver attribute -> quantities it affects, see dependency_graph."""
+        return dependency_graph(self.program)
+
+    def extend(self, num_years: int):
+        """Extends the horizon, only the new years are computed."""
+        for year in range(self.num_years + 1, num_years + 1):
+            self.drivers.append(
+                dict(self.drivers[-1]) if self.drivers else dict(self.base_drivers)
+            )
+            self.values.append(dict(self._carried))
+            self._compute_year(year, None)
+
+    def set_override(self, key: str, value, years=None):
+        """
+        Overrides a driver attribute and recomputes what depends on it.
+
+        Args:
+            key: Driver attribute name
+            value: New value
+            years: Forecast years (1-based) the value applies to, all when None
+        """
+        self.set_overrides({key: value}, years)
+
+    def set_overrides(self, overrides: dict, years=None):
+        """Overrides several driver attributes at once, see set_override."""
+        years = range(1, self.num_years + 1) if years is None else years
+        first_changed = None
+        changed = {}
+        for key in known_driver_keys(overrides, self.base_drivers):
+            value = float(overrides[key])
+            for year in years:
+                if self.drivers[year - 1][key] != value:
+                    self.drivers[year - 1][key] = value
+                    changed[year] = changed.get(year, frozenset()) | {key}
+                    first_changed = min(first_changed or year, year)
+
+        if first_changed is None:
+            return
+        self.last_recomputed = 0
+        dirty = frozenset()
+        last_changed = max(changed)
+        for year in range(first_changed, self.num_years + 1):
+            year_changes = changed.get(year)
+            dirty = self._compute_year(
+                year, dirty | year_changes if year_changes else dirty
+            )
+            if not dirty and year >= last_changed:
+                break
+
+    def _compute_year(self, year: int, changed: frozenset) -> frozenset:
+        """
+        Computes the quantities of a year, only those affected by changed
+        inputs unless changed is None.
+
+        Returns:
+            The recomputed quantities as previous-year inputs of the next year
+        """
+        steps, dirty = _plan(self.program, changed)
+        sources = (self.values[year - 1], self.drivers[year - 1], self.values[year])
+        current = sources[CURRENT]
+        for name, node in steps:
+            current[name] = node(sources)
+        self.last_recomputed += len(steps)
+        return dirty
+
+    def get(self, name: str, year: int):
+        """
+        Returns a computed quantity (a forecast driver or line item key)
+        for a forecast year (1-based).
+        """
+        return self.values[year][name]
+
+    def balance_sheet(self, year: int) -> CompactBalanceSheet:
+        """Returns the forecast balance sheet of a year (1-based)."""
+        layout = self.base_balance_sheet.layout
+        return CompactBalanceSheet(
+            np.array([self.values[year][key] for key in layout.keys]), layout
+        )
+
+    def results(self) -> list:
+        """
+        Returns the forecast in the forecast_balancesheet format.
+
+        Returns:
+            List of tuples: [(forecast_bs_year1, forecast_drivers_year1), ...]
+        """
+        forecasted_years = []
+        for year in range(1, self.num_years + 1):
+            bs = self.balance_sheet(year)
+            check_balance(bs.row(np.newaxis), first_year=year)
+            forecasted_years.append(
+                (
+                    bs.to_dict(),
+                    {key: float(self.values[year][key]) for key in FORECAST_DRIVERS},
+                )
+            )
+        return forecasted_years
@@ -0,0 +1,363 @@
+import ast
+
+import numpy as np
+import pandas as pd
+
+from balance_sheet import CompactBalanceSheet
+from forecast_engine import DRIVER_ATTRIBUTES, build_driver_table, forecast_scenarios
+
+# Reductions over the forecast years available in target expressions,
+# applied to arrays shaped (years, candidates)
+TARGET_FUNCTIONS = {
+    "max": lambda values: np.max(values, axis=0),
+    "min": lambda values: np.min(values, axis=0),
+    "sum": lambda values: np.sum(values, axis=0),
+    "mean": lambda values: np.mean(values, axis=0),
+    "abs": np.abs,
+}
+
+_ALLOWED_NODES = (
+    ast.Expression,
+    ast.BinOp,
+    ast.UnaryOp,
+    ast.Call,
+    ast.Name,
+    ast.Load,
+    ast.Constant,
+    ast.Subscript,
+    ast.Add,
+    ast.Sub,
+    ast.Mult,
+    ast.Div,
+    ast.Pow,
+    ast.USub,
+    ast.UAdd,
+)
+
+
+class Target:
+    """
+    Compiled target expression over forecast outputs.
+
+    Names are forecast drivers (e.g. new_debt_needed, sales), balance sheet
+    line items by dotted key or by their last component (e.g. cash_and_equivalents)
+    and total_assets / total_liabilities / total_equity. Every name is an
+    array of years x candidates, so new_debt_needed[-1] is the last year,
+    sales[0] the first and max(new_debt_needed) the largest over the horizon.
+    The expression must reduce to one value per candidate.
+    """
+
+    def __init__(self, expression: str):
+        tree = ast.parse(expression, mode="eval")
+        for node in ast.walk(tree):
+            assert isinstance(node, _ALLOWED_NODES), (
+                f"Unsupported syntax in target expression: {type(node).__name__}"
+            )
+            if isinstance(node, ast.Call):
+                assert (
+                    isinstance(node.func, ast.Name)
+                    and node.func.id in TARGET_FUNCTIONS
+                ), f"Unsupported function in target expression, use one of {list(TARGET_FUNCTIONS)}"
+        self.expression = expression
+        self.names = {
+            node.id
+            for node in ast.walk(tree)
+            if isinstance(node, ast.Name) and node.id not in TARGET_FUNCTIONS
+        }
+        self.code = compile(tree, "<target>", "eval")
+
+    def evaluate(self, result) -> np.ndarray:
+        """Evaluates the target on a ScenarioForecast, one value per scenario."""
+        aliases = {key.rsplit(".", 1)[-1]: key for key in result.bs_keys}
+        totals = {
+            "total_assets": lambda: result.balance_sheet.total_assets,
+            "total_liabilities": lambda: result.balance_sheet.total_liabilities,
+            "total_equity": lambda: result.balance_sheet.total_equity,
+        }
+        namespace = dict(TARGET_FUNCTIONS)
+        for name in self.names:
+            if name in totals:
+                values = totals[name]()
+            else:
+                key = aliases.get(name, name)
+                assert key in result.line_items, f"{name} is not a forecast output"
+                values = result.item(key)
+            namespace[name] = np.asarray(values).T
+        values = np.asarray(
+            eval(self.code, {"__builtins__": {}}, namespace), dtype="float64"
+        )
+        if values.ndim == 0:
+            values = np.full(result.num_scenarios, values)
+        assert values.shape == (result.num_scenarios,), (
+            "Target must reduce to one value per scenario, e.g. max(x) or x[-1]"
+        )
+        return values
+
+
+class GoalSeekResult:
+    """
+    Solutions of a goal seek, one row per (ticker, driver) with the driver
+    value found, the target reached, the final bracket and a status:
+    "converged", "no_bracket" (no crossing within the bounds, the value
+    closest to the target is reported), "flat" (on target across the whole
+    bounds, the lower bound is reported) or "max_iterations".
+    """
+
+    def __init__(self, frame: pd.DataFrame, target: str, value: float):
+        self.frame = frame
+        self.target = target
+        self.value = value
+
+    def __repr__(self):
+        statuses = self.frame["status"].value_counts().to_dict()
+        return f"GoalSeekResult({self.target!r} = {self.value}, {statuses})"
+
+    def to_frame(self) -> pd.DataFrame:
+        return self.frame
+
+    def solution(self, ticker: str, driver: str) -> float:
+        return self.frame.loc[(ticker.upper(), driver), "solution"]
+
+
+def _driver_bounds(drivers, bounds) -> dict:
+    """Normalizes drivers and bounds to driver -> (low, high)."""
+    if isinstance(drivers, str):
+        drivers = [drivers]
+    if not isinstance(drivers, dict):
+        assert bounds is not None, "Bounds are required for every driver"
+        drivers = {driver: bounds for driver in drivers}
+    for driver, (low, high) in drivers.items():
+        assert driver in DRIVER_ATTRIBUTES, f"{driver} is not a valid driver attribute."
+        assert low < high, f"Lower bound of {driver} must be below its upper bound"
+    return drivers
+
+
+def goal_seek(
+    companies,
+    base_year,
+    target: str,
+    value: float = 0.0,
+    drivers="sales_growth_rate",
+    bounds: tuple = None,
+    num_years: int = 1,
+    override: dict = None,
+    candidates: int = 16,
+    xtol: float = 1e-10,
+    ftol: float = 1e-6,
+    max_iterations: int = 50,
+) -> GoalSeekResult:
+    """
+    Finds the driver value at which a target expression over the forecast
+    reaches a value, e.g. the sales_growth_rate at which
+    max(new_debt_needed) is 0 over 5 years.
+
+    Every iteration evaluates candidates values across the current bracket
+    of every (ticker, driver) problem in one batched forecast per balance
+    sheet layout, keeps the first interval where the target crosses the
+    value and shrinks the bracket by a factor of candidates - 1. Drivers
+    are solved independently, each with the others at their base values.
+    Where the target sits exactly on the value over a range (a quantity
+    floored at zero), the solution is the edge of that range.
+
+    Args:
+        companies: A CompanyFS or a list of them
+        base_year: Base year date, or a dict of ticker -> date
+        target: Target expression, see Target
+        value: Value the target should reach
+        drivers: Driver name, list of names (with bounds) or dict of
+            driver -> (low, high)
+        bounds: (low, high) used for every driver given by name
+        num_years: Number of years to forecast
+        override: Driver attribute overrides applied to the base case
+        candidates: Driver values evaluated per problem and iteration
+        xtol: Stop when the bracket is narrower than xtol (relative)
+        ftol: Stop when the target is within ftol of the value
+        max_iterations: Maximum number of iterations
+
+    Returns:
+        GoalSeekResult
+    """
+    assert candidates >= 3, "Candidates must be at least 3"
+    if not isinstance(companies, (list, tuple)):
+        companies = [companies]
+    driver_bounds = _driver_bounds(drivers, bounds)
+    target_expression = Target(target)
+
+    # base case per ticker, grouped by forecast program (and so balance sheet
+    # layout) so every group runs as one batch
+    groups = {}
+    for company in companies:
+        date = base_year[company.ticker_name] if isinstance(base_year, dict) else base_year
+        program = company.forecast_program
+        base_bs, base_sales, driver_attributes = company._forecast_base(date, program)
+        base_row = build_driver_table(driver_attributes, override).iloc[0]
+        groups.setdefault(program, []).append(
+            (company.ticker_name, base_bs.values, float(base_sales), base_row)
+        )
+
+    frames = []
+    for program, entries in groups.items():
+        frames.append(
+            _solve_group(
+                program,
+                entries,
+                driver_bounds,
+                target_expression,
+                value,
+                num_years,
+                candidates,
+                xtol,
+                ftol,
+                max_iterations,
+            )
+        )
+    return GoalSeekResult(pd.concat(frames), target, value)
+
+
+def _solve_group(
+    program,
+    entries: list,
+    driver_bounds: dict,
+    target: Target,
+    value: float,
+    num_years: int,
+    candidates: int,
+    xtol: float,
+    ftol: float,
+    max_iterations: int,
+) -> pd.DataFrame:
+    """Solves every (ticker, driver) problem of one forecast program."""
+    tickers = [ticker for ticker, _, _, _ in entries]
+    base_values = np.stack([values for _, values, _, _ in entries])
+    base_sales = np.array([sales for _, _, sales, _ in entries])
+    base_drivers = np.stack(
+        [row[list(DRIVER_ATTRIBUTES)].to_numpy(dtype="float64") for *_, row in entries]
+    )
+
+    # one problem per (ticker, driver)
+    problem_ticker = np.repeat(np.arange(len(tickers)), len(driver_bounds))
+    problem_driver = np.tile(
+        [DRIVER_ATTRIBUTES.index(driver) for driver in driver_bounds], len(tickers)
+    )
+    low = np.tile([bounds[0] for bounds in driver_bounds.values()], len(tickers))
+    high = np.tile([bounds[1] for bounds in driver_bounds.values()], len(tickers))
+    low, high = low.astype("float64"), high.astype("float64")
+    num_problems = len(low)
+
+    def evaluate(problems: np.ndarray, x: np.ndarray) -> np.ndarray:
+        """Target minus value for x shaped (problems, candidates)."""
+        num_candidates = x.shape[1]
+        rows_ticker = np.repeat(problem_ticker[problems], num_candidates)
+        table = base_drivers[rows_ticker].copy()
+        table[
+            np.arange(len(table)), np.repeat(problem_driver[problems], num_candidates)
+        ] = x.ravel()
+        result = forecast_scenarios(
+            CompactBalanceSheet(base_values[rows_ticker], program.layout),
+            base_sales[rows_ticker],
+            pd.DataFrame(table, columns=list(DRIVER_ATTRIBUTES)),
+            num_years=num_years,
+            tolerance=None,
+            program=program,
+        )
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return (target.evaluate(result) - value).reshape(x.shape)
+
+    status = np.full(num_problems, "max_iterations", dtype=object)
+    solution = np.full(num_problems, np.nan)
+    iterations = np.zeros(num_problems, dtype=int)
+    active = np.arange(num_problems)
+    steps = np.linspace(0.0, 1.0, candidates)
+
+    for iteration in range(max_iterations):
+        if len(active) == 0:
+            break
+        x = low[active, np.newaxis] + (high - low)[active, np.newaxis] * steps
+        f = evaluate(active, x)
+        iterations[active] = iteration + 1
+
+        # the first interval where the target crosses the value, above meaning
+        # strictly above so the edge of a region sitting exactly on the value
+        # (e.g. new_debt_needed floored at 0) is bracketed as well; without a
+        # crossing, a candidate within ftol of the value
+        above = f > 0
+        crossing = np.zeros_like(f, dtype=bool)
+        crossing[:, :-1] = above[:, :-1] != above[:, 1:]
+        crossing &= ~np.isnan(f) & ~np.roll(np.isnan(f), -1, axis=1)
+        bracketed = crossing.any(axis=1)
+        on_target = np.abs(f) <= ftol
+        hit = on_target.any(axis=1) & ~bracketed
+        if iteration == 0:
+            # on target across the whole bounds, there is no edge to find
+            flat = on_target.all(axis=1)
+            status[active[flat]] = "flat"
+            hit &= ~flat
+
+        rows = np.arange(len(active))
+        first_hit = np.argmax(on_target, axis=1)
+        solution[active[hit]] = x[rows[hit], first_hit[hit]]
+        status[active[hit]] = "converged"
+        if iteration == 0:
+            solution[active[flat]] = x[rows[flat], 0]
+
+        if iteration == 0:
+            # nothing crosses within the bounds, report the closest candidate
+            missing = ~hit & ~bracketed & ~flat
+            closest = np.nanargmin(
+                np.where(np.isnan(f), np.inf, np.abs(f)), axis=1
+            )
+            solution[active[missing]] = x[rows[missing], closest[missing]]
+            status[active[missing]] = "no_bracket"
+
+        first_crossing = np.argmax(crossing, axis=1)
+        keep = rows[bracketed]
+        index = first_crossing[keep]
+        problems = active[keep]
+        low[problems] = x[keep, index]
+        high[problems] = x[keep, index + 1]
+
+        # secant estimate within the final bracket once it is narrow enough
+        f_low, f_high = f[keep, index], f[keep, index + 1]
+        narrow = (high[problems] - low[problems]) <= xtol * np.maximum(
+            1.0, np.abs(low[problems])
+        )
+        with np.errstate(invalid="ignore", divide="ignore"):
+            secant = low[problems] - f_low * (high[problems] - low[problems]) / (
+                f_high - f_low
+            )
+        secant = np.clip(
+            np.where(np.isfinite(secant), secant, low[problems]),
+            low[problems],
+            high[problems],
+        )
+        solution[problems] = secant
+        status[problems[narrow]] = "converged"
+        active = problems[~narrow]
+
+    # the target actually reached at every solution, in one batch
+    solved = np.flatnonzero(~np.isnan(solution))
+    reached = np.full(num_problems, np.nan)
+    if len(solved):
+        reached[solved] = evaluate(solved, solution[solved, np.newaxis])[:, 0] + value
+
+    index = pd.MultiIndex.from_arrays(
+        [
+            [tickers[position] for position in problem_ticker],
+            [DRIVER_ATTRIBUTES[position] for position in problem_driver],
+        ],
+        names=["ticker", "driver"],
+    )
+    base = base_drivers[problem_ticker, problem_driver]
+    return pd.DataFrame(
+        {
+            "base": base,
+            "solution": solution,
+            "target": reached,
+            "residual": reached - value,
+            "low": low,
+            "high": high,
+            "iterations": iterations,
+            "status": status,
+        },
+        index=index,
+    )
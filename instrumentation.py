@@ -0,0 +1,315 @@
+import contextlib
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+
+# Recorder of the current process, None while instrumentation is disabled.
+# Every hook checks it first, so a disabled hook costs one global lookup.
+_recorder = None
+
+
+class Recorder:
+    """
+    Collects per-stage timings, counters and optionally individual trace
+    events, keyed by (name, ticker). Ticker is None for work that is not
+    tied to a single ticker.
+    """
+
+    def __init__(self, trace: bool = False, max_events: int = 1_000_000):
+        self.trace = trace
+        self.max_events = max_events
+        self.origin = time.perf_counter()
+        self.stages = {}  # (name, ticker) -> [calls, total, min, max]
+        self.counters = {}  # (name, ticker) -> value
+        # (name, ticker, perf_counter start, duration, pid, thread id),
+        # perf_counter is monotonic system-wide so worker events line up
+        self.events = []
+        self.dropped_events = 0
+        self._lock = threading.Lock()
+
+    def record(self, name: str, ticker, start: float, duration: float):
+        key = (name, ticker)
+        with self._lock:
+            entry = self.stages.get(key)
+            if entry is None:
+                self.stages[key] = [1, duration, duration, duration]
+            else:
+                entry[0] += 1
+                entry[1] += duration
+                entry[2] = min(entry[2], duration)
+                entry[3] = max(entry[3], duration)
+            if self.trace:
+                if len(self.events) < self.max_events:
+                    self.events.append(
+                        (
+                            name,
+                            ticker,
+                            start,
+                            duration,
+                            os.getpid(),
+                            threading.get_ident(),
+                        )
+                    )
+                else:
+                    self.dropped_events += 1
+
+    def count(self, name: str, ticker, amount):
+        key = (name, ticker)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def snapshot(self) -> dict:
+        """Returns a picklable copy of everything recorded."""
+        with self._lock:
+            return {
+                "stages": {key: list(entry) for key, entry in self.stages.items()},
+                "counters": dict(self.counters),
+                "events": list(self.events),
+                "dropped_events": self.dropped_events,
+            }
+
+    def merge(self, snapshot: dict):
+        """Adds a snapshot, e.g. one recorded in a worker process."""
+        with self._lock:
+            for key, (calls, total, low, high) in snapshot["stages"].items():
+                entry = self.stages.get(key)
+                if entry is None:
+                    self.stages[key] = [calls, total, low, high]
+                else:
+                    entry[0] += calls
+                    entry[1] += total
+                    entry[2] = min(entry[2], low)
+                    entry[3] = max(entry[3], high)
+            for key, value in snapshot["counters"].items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            if self.trace:
+                room = self.max_events - len(self.events)
+                self.events.extend(snapshot["events"][:room])
+                self.dropped_events += max(len(snapshot["events"]) - room, 0)
+            self.dropped_events += snapshot["dropped_events"]
+
+    def stats(self) -> dict:
+        """
+        Returns the recorded stages and counters.
+
+        Returns:
+            Dict with "stages" (name -> calls, total/mean/min/max seconds) and
+            "counters" (name -> value) over all tickers, and "tickers" with
+            the same two dicts per ticker
+        """
+        snapshot = self.snapshot()
+        stages, counters, tickers = {}, {}, {}
+
+        for (name, ticker), entry in snapshot["stages"].items():
+            total = stages.setdefault(name, [0, 0.0, float("inf"), 0.0])
+            total[0] += entry[0]
+            total[1] += entry[1]
+            total[2] = min(total[2], entry[2])
+            total[3] = max(total[3], entry[3])
+            if ticker is not None:
+                ticker_stats = tickers.setdefault(ticker, {"stages": {}, "counters": {}})
+                ticker_stats["stages"][name] = _summary(entry)
+
+        for (name, ticker), value in snapshot["counters"].items():
+            counters[name] = counters.get(name, 0) + value
+            if ticker is not None:
+                ticker_stats = tickers.setdefault(ticker, {"stages": {}, "counters": {}})
+                ticker_stats["counters"][name] = value
+
+        return {
+            "stages": {name: _summary(entry) for name, entry in sorted(stages.items())},
+            "counters": dict(sorted(counters.items())),
+            "tickers": tickers,
+            "dropped_events": snapshot["dropped_events"],
+        }
+
+    def stats_frame(self) -> pd.DataFrame:
+        """Returns one row per (kind, name, ticker) with timings or counter values."""
+        snapshot = self.snapshot()
+        rows = [
+            {"kind": "stage", "name": name, "ticker": ticker, **_summary(entry)}
+            for (name, ticker), entry in snapshot["stages"].items()
+        ]
+        rows.extend(
+            {"kind": "counter", "name": name, "ticker": ticker, "value": value}
+            for (name, ticker), value in snapshot["counters"].items()
+        )
+        return pd.DataFrame(rows)
+
+    def export_log(self, path: str):
+        """
+        Writes a structured JSON-lines log: one "stage" or "counter" record
+        per (name, ticker), then one "event" record per trace event.
+        """
+        snapshot = self.snapshot()
+        with open(path, "w") as f:
+            for (name, ticker), entry in snapshot["stages"].items():
+                record = {"type": "stage", "name": name, "ticker": ticker}
+                f.write(json.dumps({**record, **_summary(entry)}) + "\n")
+            for (name, ticker), value in snapshot["counters"].items():
+                record = {"type": "counter", "name": name, "ticker": ticker}
+                f.write(json.dumps({**record, "value": value}) + "\n")
+            for name, ticker, start, duration, pid, thread in snapshot["events"]:
+                record = {
+                    "type": "event",
+                    "name": name,
+                    "ticker": ticker,
+                    "start_seconds": start - self.origin,
+                    "duration_seconds": duration,
+                    "pid": pid,
+                    "thread": thread,
+                }
+                f.write(json.dumps(record) + "\n")
+
+    def export_trace(self, path: str):
+        """
+        Writes the trace events in the Chrome trace event format, viewable
+        in chrome://tracing or Perfetto. Requires trace=True.
+        """
+        assert self.trace, "Tracing is not enabled, use enable(trace=True)"
+        snapshot = self.snapshot()
+        events = [
+            {
+                "name": name,
+                "cat": ticker or "",
+                "ph": "X",
+                "ts": (start - self.origin) * 1e6,
+                "dur": duration * 1e6,
+                "pid": pid,
+                "tid": thread,
+                "args": {"ticker": ticker},
+            }
+            for name, ticker, start, duration, pid, thread in snapshot["events"]
+        ]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def _summary(entry: list) -> dict:
+    calls, total, low, high = entry
+    return {
+        "calls": calls,
+        "total_seconds": total,
+        "mean_seconds": total / calls,
+        "min_seconds": low,
+        "max_seconds": high,
+    }
+
+
+class _Stage:
+    """Times the body of a with statement into the recorder."""
+
+    __slots__ = ("recorder", "name", "ticker", "start")
+
+    def __init__(self, recorder: Recorder, name: str, ticker):
+        self.recorder = recorder
+        self.name = name
+        self.ticker = ticker
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.recorder.record(
+            self.name, self.ticker, self.start, time.perf_counter() - self.start
+        )
+
+
+_NULL_STAGE = contextlib.nullcontext()
+
+
+def enable(trace: bool = False, max_events: int = 1_000_000) -> Recorder:
+    """
+    Starts recording, discarding anything recorded before.
+
+    Args:
+        trace: Also keep every stage as an individual event for export_trace
+        max_events: Maximum number of trace events kept, later ones are
+            counted as dropped
+
+    Returns:
+        The new Recorder
+    """
+    global _recorder
+    _recorder = Recorder(trace=trace, max_events=max_events)
+    return _recorder
+
+
+def disable():
+    """Stops recording, hooks become no-ops again."""
+    global _recorder
+    _recorder = None
+
+
+def is_enabled() -> bool:
+    return _recorder is not None
+
+
+def recorder() -> Recorder:
+    """Returns the active recorder, None while disabled."""
+    return _recorder
+
+
+@contextlib.contextmanager
+def profiling(trace: bool = False, max_events: int = 1_000_000):
+    """
+    Enables instrumentation for the body of a with statement and restores
+    the previous recorder afterwards.
+
+    Example:
+        with profiling(trace=True) as recorder:
+            company.forecast_balancesheet("2024-06-30", 5)
+        print(recorder.stats())
+    """
+    global _recorder
+    previous = _recorder
+    active = enable(trace=trace, max_events=max_events)
+    try:
+        yield active
+    finally:
+        _recorder = previous
+
+
+def stage(name: str, ticker: str = None):
+    """
+    Context manager timing a stage, e.g.
+    with stage("extract.balancesheet", ticker): ...
+    """
+    if _recorder is None:
+        return _NULL_STAGE
+    return _Stage(_recorder, name, ticker)
+
+
+def count(name: str, ticker: str = None, amount=1):
+    """Adds amount to a counter, e.g. cache hits or bytes fetched."""
+    if _recorder is not None:
+        _recorder.count(name, ticker, amount)
+
+
+def _active() -> Recorder:
+    assert _recorder is not None, "Instrumentation is not enabled"
+    return _recorder
+
+
+def stats() -> dict:
+    """Returns the active recorder's stats, see Recorder.stats."""
+    return _active().stats()
+
+
+def stats_frame() -> pd.DataFrame:
+    """Returns the active recorder's stats as a DataFrame."""
+    return _active().stats_frame()
+
+
+def export_log(path: str):
+    """Writes the active recorder's JSON-lines log, see Recorder.export_log."""
+    _active().export_log(path)
+
+
+def export_trace(path: str):
+    """Writes the active recorder's Chrome trace, see Recorder.export_trace."""
+    _active().export_trace(path)
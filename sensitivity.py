@@ -0,0 +1,229 @@
+import numpy as np
+import pandas as pd
+
+from forecast_engine import (
+    BALANCE_TOLERANCE,
+    DRIVER_ATTRIBUTES,
+    assert_balanced,
+    build_driver_table,
+    forecast_scenarios,
+)
+
+
+class SensitivityResult:
+    """
+    Finite-difference sensitivities of every forecast line item and year to
+    each driver attribute.
+
+    Attributes:
+        drivers: Perturbed driver attributes
+        line_items: Forecast line items (balance sheet keys and drivers)
+        base: Base forecast, shape (years, line items)
+        up, down: Perturbed forecasts, shape (drivers, years, line items)
+        steps: Absolute step of each driver
+        jacobian: d line item / d driver, shape (drivers, years, line items)
+        elasticity: Relative change of the line item per relative change
+            of the driver, NaN where the base value is 0
+        method: "central", "forward" or "backward" per (driver, year), or
+            "none" where neither perturbation balances (the Jacobian is NaN)
+        regime_switch: True where a perturbation flips between new debt and
+            new short-term investment, in that year or an earlier one
+        unbalanced: True where a perturbation does not balance, in that year
+            or an earlier one; its difference is not used
+    """
+
+    def __init__(
+        self,
+        drivers: list,
+        driver_values: np.ndarray,
+        line_items: list,
+        base: np.ndarray,
+        up: np.ndarray,
+        down: np.ndarray,
+        steps: np.ndarray,
+        jacobian: np.ndarray,
+        method: np.ndarray,
+        regime_switch: np.ndarray,
+        unbalanced: np.ndarray,
+    ):
+        self.drivers = drivers
+        self.driver_values = driver_values
+        self.line_items = line_items
+        self.base = base
+        self.up = up
+        self.down = down
+        self.steps = steps
+        self.jacobian = jacobian
+        self.method = method
+        self.regime_switch = regime_switch
+        self.unbalanced = unbalanced
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.elasticity = np.where(
+                base[np.newaxis] != 0,
+                jacobian * driver_values[:, np.newaxis, np.newaxis] / base[np.newaxis],
+                np.nan,
+            )
+
+    def to_frame(self, values: str = "jacobian") -> pd.DataFrame:
+        """
+        Returns jacobian or elasticity as a DataFrame indexed by (driver, year).
+        """
+        assert values in ("jacobian", "elasticity"), "Unknown sensitivity values"
+        array = getattr(self, values)
+        num_drivers, num_years, num_items = array.shape
+        index = pd.MultiIndex.from_product(
+            [self.drivers, range(1, num_years + 1)], names=["driver", "year"]
+        )
+        return pd.DataFrame(
+            array.reshape(num_drivers * num_years, num_items),
+            index=index,
+            columns=self.line_items,
+        )
+
+    def tornado(self, line_item: str, year: int = 1) -> pd.DataFrame:
+        """
+        Returns the down/up values of a line item per driver, sorted by swing.
+        """
+        assert line_item in self.line_items, f"{line_item} is not a line item"
+        position = self.line_items.index(line_item)
+        frame = pd.DataFrame(
+            {
+                "down": self.down[:, year - 1, position],
+                "base": self.base[year - 1, position],
+                "up": self.up[:, year - 1, position],
+                "regime_switch": self.regime_switch[:, year - 1],
+                "unbalanced": self.unbalanced[:, year - 1],
+            },
+            index=pd.Index(self.drivers, name="driver"),
+        )
+        frame["swing"] = (frame["up"] - frame["down"]).abs()
+        return frame.sort_values("swing", ascending=False)
+
+
+def sensitivity(
+    company,
+    base_year: str,
+    num_years: int = 1,
+    drivers: list = None,
+    relative_step: float = 0.01,
+    override: dict = None,
+) -> SensitivityResult:
+    """
+    Computes the sensitivity of every forecast line item to each driver
+    attribute, evaluating the base and all 2 x N perturbations in one batch.
+
+    Central differences are used where the up and down perturbations stay
+    in the base case's debt/investment regime. Where one side crosses the
+    switch between new_debt_needed and new_st_investment, the one-sided
+    difference on the other side is used instead. The base case has to
+    balance like any forecast; a perturbation that does not is left out of
+    the differences and flagged in SensitivityResult.unbalanced.
+
+    Args:
+        company: CompanyFS to forecast
+        base_year: Base year date in YYYY-MM-DD format
+        num_years: Number of years to forecast
+        drivers: Driver attributes to perturb, all when None
+        relative_step: Step relative to the driver value, used as an
+            absolute step when the driver is 0
+        override: Driver attribute overrides defining the base case
+
+    Returns:
+        SensitivityResult
+    """
+    drivers = list(drivers or DRIVER_ATTRIBUTES)
+    for driver in drivers:
+        assert driver in DRIVER_ATTRIBUTES, f"{driver} is not a valid driver attribute."
+    assert relative_step > 0, "Relative step must be greater than 0"
+
+    program = company.forecast_program
+    base_balance_sheet, base_sales, driver_attributes = company._forecast_base(
+        base_year, program
+    )
+    base_row = build_driver_table(driver_attributes, override).iloc[0]
+    driver_values = base_row[drivers].to_numpy(dtype="float64")
+    steps = np.where(
+        driver_values != 0, np.abs(driver_values) * relative_step, relative_step
+    )
+
+    # row 0 is the base case, then every driver up, then every driver down
+    num_drivers = len(drivers)
+    table = pd.DataFrame([base_row] * (2 * num_drivers + 1)).reset_index(drop=True)
+    for position, driver in enumerate(drivers):
+        column = table.columns.get_loc(driver)
+        table.iloc[1 + position, column] = driver_values[position] + steps[position]
+        table.iloc[1 + num_drivers + position, column] = (
+            driver_values[position] - steps[position]
+        )
+
+    result = forecast_scenarios(
+        base_balance_sheet,
+        base_sales,
+        table,
+        num_years=num_years,
+        tolerance=None,
+        program=program,
+    )
+    # the base case is checked like forecast_balancesheet checks it, a
+    # perturbation that fails stays unbalanced in later years
+    failed = ~(np.abs(result.imbalance) < BALANCE_TOLERANCE)
+    if failed[0].any():
+        year = int(np.flatnonzero(failed[0])[0])
+        assert_balanced(result.imbalance[:1, year], year + 1)
+    balanced = ~np.logical_or.accumulate(failed, axis=1)
+    up_balanced = balanced[1 : 1 + num_drivers]
+    down_balanced = balanced[1 + num_drivers :]
+
+    base = result.values[0]
+    up = result.values[1 : 1 + num_drivers]
+    down = result.values[1 + num_drivers :]
+
+    # debt regime per scenario and year, a switch carries into later years
+    deficit = result.item("new_debt_needed") > 0
+    base_deficit = deficit[0]
+    up_same = np.logical_and.accumulate(
+        deficit[1 : 1 + num_drivers] == base_deficit, axis=1
+    )
+    down_same = np.logical_and.accumulate(
+        deficit[1 + num_drivers :] == base_deficit, axis=1
+    )
+
+    step = steps[:, np.newaxis, np.newaxis]
+    central = (up - down) / (2 * step)
+    forward = (up - base) / step
+    backward = (base - down) / step
+
+    use_forward = up_balanced & (~down_balanced | (up_same & ~down_same))
+    use_backward = (
+        down_balanced & ~use_forward & (~up_balanced | (down_same & ~up_same))
+    )
+    use_central = up_balanced & down_balanced & ~use_forward & ~use_backward
+    jacobian = np.where(
+        use_forward[:, :, np.newaxis],
+        forward,
+        np.where(
+            use_backward[:, :, np.newaxis],
+            backward,
+            np.where(use_central[:, :, np.newaxis], central, np.nan),
+        ),
+    )
+
+    method = np.full(up_same.shape, "none", dtype=object)
+    method[use_central] = "central"
+    method[use_forward] = "forward"
+    method[use_backward] = "backward"
+
+    return SensitivityResult(
+        drivers,
+        driver_values,
+        result.line_items,
+        base,
+        up,
+        down,
+        steps,
+        jacobian,
+        method,
+        ~(up_same & down_same),
+        ~(up_balanced & down_balanced),
+    )
@@ -0,0 +1,705 @@
+import argparse
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import numpy as np
+
+from company_fs import CompanyFS
+from company_pool import DEFAULT_MAX_BYTES, DEFAULT_MAX_COMPANIES, CompanyPool
+from forecast_cache import ForecastCache, forecast_key
+from forecast_engine import ScenarioForecast, override_rows
+from instrumentation import count, stage
+from statement_maps import DEFAULT_CONFIG_DIR
+from statement_store import (
+    DEFAULT_STORE_ROOT,
+    StatementNotCachedError,
+    StatementSource,
+    StatementStore,
+    default_store,
+)
+from universe import latest_date
+
+DEFAULT_PORT = 8765
+DEFAULT_IDLE_SECONDS = 600.0
+
+# Statement endpoint -> CompanyFS getter
+STATEMENT_GETTERS = {"bs": "get_bs", "pnl": "get_pnl", "cf": "get_cf"}
+
+
+def _slice_forecast(
+    forecast: ScenarioForecast,
+    start: int,
+    stop: int,
+    num_years: int,
+    copy: bool = False,
+) -> ScenarioForecast:
+    """
+    Scenarios start..stop and the first num_years of a forecast, as views
+    unless copy is True.
+    """
+    values = forecast.values[start:stop, :num_years]
+    imbalance = forecast.imbalance[start:stop, :num_years]
+    return ScenarioForecast.from_values(
+        forecast.drivers.iloc[start:stop].reset_index(drop=True),
+        values.copy() if copy else values,
+        forecast.bs_layout,
+        imbalance.copy() if copy else imbalance,
+        forecast.program,
+    )
+
+
+def _resolve(future: Future, function, *args, **kwargs):
+    """Resolves a future with the result of a call, or the error it raised."""
+    try:
+        result = function(*args, **kwargs)
+    except Exception as e:
+        future.set_exception(e)
+    else:
+        future.set_result(result)
+
+
+class _Batcher:
+    """
+    Coalesces forecast requests for the same ticker and base year into one
+    vectorized forecast, with the override sets of every request stacked as
+    scenarios. A request that finds no forecast of its key running runs at
+    once; requests arriving meanwhile queue up and run as the next batch, so
+    batching adds no latency when the service is idle.
+
+    The thread of the first request only runs the batch holding its own
+    request. Batches queued meanwhile run on a worker thread, which keeps
+    running them while requests keep arriving, so no request waits for
+    batches it is not part of.
+    """
+
+    def __init__(self, service: "ForecastService"):
+        self.service = service
+        self.pending = {}  # (ticker, base_year) -> [(rows, num_years, future)]
+        self.running = set()
+        self._lock = threading.Lock()
+
+    def submit(self, ticker: str, base_year: str, rows: list, num_years: int) -> Future:
+        future = Future()
+        key = (ticker, base_year)
+        with self._lock:
+            self.pending.setdefault(key, []).append((rows, num_years, future))
+            if key in self.running:
+                # the running thread picks it up with the next batch
+                return future
+            self.running.add(key)
+
+        self._run_next(key)
+        with self._lock:
+            if key not in self.pending:
+                self.running.discard(key)
+                return future
+        threading.Thread(target=self._drain, args=(key,), daemon=True).start()
+        return future
+
+    def _drain(self, key: tuple):
+        """Runs the batches of a key until no request is pending."""
+        while True:
+            with self._lock:
+                if key not in self.pending:
+                    self.running.discard(key)
+                    return
+            self._run_next(key)
+
+    def _run_next(self, key: tuple):
+        """
+        Runs the pending batch of a key. Never raises, so the caller always
+        stops running the key once nothing is pending: a request the batch
+        left unresolved fails with the batch's error instead of blocking.
+        """
+        with self._lock:
+            batch = self.pending.pop(key)
+        error = None
+        try:
+            self.service._run_batch(*key, batch)
+        except Exception as e:
+            error = e
+        finally:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(
+                        error or RuntimeError("The forecast batch did not resolve it")
+                    )
+
+
+class ForecastService:
+    """
+    Long-running forecast state: CompanyFS objects with their statements,
+    compiled maps and base year drivers stay in memory between requests.
+
+    Concurrent forecasts of the same ticker and base year are batched into
+    one vectorized call. The companies are a CompanyPool, evicted least
+    recently used first beyond max_companies or max_bytes of statements,
+    and once idle for idle_seconds.
+    """
+
+    def __init__(
+        self,
+        store: StatementSource = None,
+        config_dir: str = DEFAULT_CONFIG_DIR,
+        validation: str = "full",
+        frequency: str = "annual",
+        estimator=None,
+        cache: ForecastCache = None,
+        max_companies: int = DEFAULT_MAX_COMPANIES,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        idle_seconds: float = DEFAULT_IDLE_SECONDS,
+        batching: bool = True,
+    ):
+        """
+        Args:
+            store: Statement store, defaults to the shared on-disk store
+            config_dir: Directory holding the <TICKER>/*_map.json files
+            validation: Validation level of the CompanyFS objects
+            frequency: "annual" or "quarterly" statements
+            estimator: DriverEstimator of the CompanyFS objects
+            cache: ForecastCache of the CompanyFS objects
+            max_companies: Maximum number of companies kept in memory
+            max_bytes: Maximum bytes of statements kept in memory
+            idle_seconds: Companies unused for longer are evicted, None to
+                keep them
+            batching: Run concurrent forecasts of the same ticker and base
+                year as one batch, otherwise every request on its own
+        """
+        self.store = store if store is not None else default_store()
+        self.cache = cache
+        self.companies = CompanyPool(
+            max_companies,
+            max_bytes,
+            store=self.store,
+            config_dir=config_dir,
+            validation=validation,
+            frequency=frequency,
+            estimator=estimator,
+            cache=cache,
+        )
+        self.idle_seconds = idle_seconds
+        self.batcher = _Batcher(self) if batching else None
+        self.started = time.time()
+
+        self._lock = threading.Lock()
+        self._counters = {
+            "requests": 0,
+            "errors": 0,
+            "batches": 0,
+            "batched_requests": 0,
+        }
+        self._closed = threading.Event()
+        self._janitor = None
+        if idle_seconds is not None:
+            self._janitor = threading.Thread(target=self._evict_idle_loop, daemon=True)
+            self._janitor.start()
+
+    def company(self, ticker: str) -> CompanyFS:
+        """Gets the resident CompanyFS of a ticker, loading it on first use."""
+        return self.companies.get(ticker)
+
+    def statement(self, kind: str, ticker: str, date: str) -> dict:
+        """
+        Gets a mapped statement as a nested dict.
+
+        Args:
+            kind: "bs", "pnl" or "cf"
+            ticker: Ticker symbol
+            date: Report date in YYYY-MM-DD format
+        """
+        assert kind in STATEMENT_GETTERS, f"Unknown statement {kind}"
+        return getattr(self.company(ticker), STATEMENT_GETTERS[kind])(date)
+
+    def dates(self, ticker: str) -> list:
+        """Report dates of a ticker's balance sheet, most recent first."""
+        columns = self.company(ticker).balancesheet.columns
+        return [date.strftime("%Y-%m-%d") for date in sorted(columns, reverse=True)]
+
+    def forecast(
+        self,
+        ticker: str,
+        base_year: str = None,
+        num_years: int = 1,
+        overrides=None,
+        grid: bool = False,
+    ):
+        """
+        Forecasts a ticker, batched with concurrent requests for the same
+        ticker and base year.
+
+        Args:
+            ticker: Ticker symbol
+            base_year: Base year date, None for the latest
+            num_years: Number of years to forecast
+            overrides: Driver overrides, as for CompanyFS.forecast_scenarios
+            grid: Take the cartesian product of a dict of arrays
+
+        Returns:
+            Tuple of (base_year, ScenarioForecast)
+        """
+        assert isinstance(num_years, int), "Number of years must be an integer"
+        assert num_years > 0, "Number of years must be greater than 0"
+        ticker = ticker.upper()
+        company = self.company(ticker)
+        if base_year is None:
+            base_year = latest_date(company)
+        if self.batcher is None:
+            return base_year, company.forecast_scenarios(
+                base_year, num_years=num_years, overrides=overrides, grid=grid
+            )
+        future = self.batcher.submit(
+            ticker, base_year, override_rows(overrides, grid), num_years
+        )
+        return base_year, future.result()
+
+    def _run_batch(self, ticker: str, base_year: str, batch: list):
+        """
+        Runs batched requests as one forecast and resolves their futures.
+        With a forecast cache, requests already cached run through it and
+        the merged forecast of the others is cached per request.
+        """
+        with self._lock:
+            self._counters["batches"] += 1
+            self._counters["batched_requests"] += len(batch)
+        try:
+            company = self.company(ticker)
+            program = company.forecast_program
+            keys = [None] * len(batch)
+            if company.cache is not None:
+                keys = [
+                    forecast_key(company, base_year, rows, program=program)
+                    for rows, _, _ in batch
+                ]
+                cached = [
+                    company.cache.get(key, program.layout, program) for key in keys
+                ]
+                for (_, num_years, future), key, forecast in zip(batch, keys, cached):
+                    if forecast is not None:
+                        _resolve(
+                            future,
+                            company.cache.serve,
+                            ticker,
+                            key,
+                            forecast,
+                            num_years,
+                        )
+                batch = [
+                    request
+                    for request, forecast in zip(batch, cached)
+                    if forecast is None
+                ]
+                keys = [key for key, forecast in zip(keys, cached) if forecast is None]
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        if len(batch) > 1:
+            count("service.batched_requests", ticker, len(batch))
+            rows = [row for request_rows, _, _ in batch for row in request_rows]
+            try:
+                with stage("service.batch", ticker):
+                    forecast = company._forecast_scenarios(
+                        base_year,
+                        max(years for _, years, _ in batch),
+                        rows,
+                        False,
+                        program,
+                    )
+            except Exception:
+                # e.g. one request does not balance, run them one by one so
+                # only that one fails
+                forecast = None
+            if forecast is not None:
+                start = 0
+                for (request_rows, num_years, future), key in zip(batch, keys):
+                    stop = start + len(request_rows)
+                    _resolve(
+                        future,
+                        self._batch_result,
+                        company,
+                        forecast,
+                        start,
+                        stop,
+                        num_years,
+                        key,
+                    )
+                    start = stop
+                return
+
+        for request_rows, num_years, future in batch:
+            _resolve(
+                future,
+                company.forecast_scenarios,
+                base_year,
+                num_years=num_years,
+                overrides=request_rows,
+            )
+
+    @staticmethod
+    def _batch_result(
+        company: CompanyFS,
+        forecast: ScenarioForecast,
+        start: int,
+        stop: int,
+        num_years: int,
+        key: str = None,
+    ) -> ScenarioForecast:
+        """
+        The scenarios of one request in a merged forecast, cached under key
+        when it is not None.
+        """
+        if key is None:
+            return _slice_forecast(forecast, start, stop, num_years)
+        # a copy, a view would keep the whole batch cached
+        result = _slice_forecast(forecast, start, stop, forecast.num_years, copy=True)
+        company.cache.put(key, result)
+        return _slice_forecast(result, 0, result.num_scenarios, num_years)
+
+    def evict(self) -> int:
+        """
+        Evicts companies idle for longer than idle_seconds.
+
+        Returns:
+            Number of companies evicted
+        """
+        return self.companies.evict(self.idle_seconds)
+
+    def _evict_idle_loop(self):
+        while not self._closed.wait(min(max(self.idle_seconds / 2, 0.1), 30.0)):
+            self.evict()
+
+    def close(self):
+        """Stops the idle eviction thread."""
+        self._closed.set()
+
+    def record(self, error: bool = False):
+        """Counts a served request."""
+        with self._lock:
+            self._counters["requests"] += 1
+            self._counters["errors"] += error
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._counters,
+                "evictions": self.companies.evictions,
+                "companies": len(self.companies),
+                "company_bytes": self.companies.nbytes,
+                "uptime_seconds": time.time() - self.started,
+                "cache": dict(self.cache.stats) if self.cache is not None else None,
+            }
+
+
+def _json_values(values: np.ndarray) -> list:
+    """Nested lists of an array with NaN and infinities as null."""
+    values = np.asarray(values, dtype="float64")
+    return np.where(np.isfinite(values), values, None).tolist()
+
+
+def _json_safe(value):
+    """Replaces NaN and infinities in nested dicts and lists with None."""
+    if isinstance(value, dict):
+        return {key: _json_safe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_json_safe(item) for item in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    return value
+
+
+def forecast_response(ticker: str, base_year: str, forecast, format: str) -> dict:
+    """
+    JSON body of a forecast: "columnar" gives line_items and values shaped
+    (scenarios, years, line items), "nested" gives every scenario in the
+    forecast_balancesheet format.
+    """
+    assert format in ("columnar", "nested"), f"Unknown format {format}"
+    response = {
+        "ticker": ticker,
+        "base_date": base_year,
+        "num_scenarios": forecast.num_scenarios,
+        "num_years": forecast.num_years,
+    }
+    if format == "nested":
+        response["scenarios"] = [
+            [
+                {"balance_sheet": bs, "drivers": drivers}
+                for bs, drivers in forecast.scenario(scenario)
+            ]
+            for scenario in range(forecast.num_scenarios)
+        ]
+        return _json_safe(response)
+    response["line_items"] = forecast.line_items
+    response["values"] = _json_values(forecast.values)
+    return response
+
+
+def whatif_response(
+    ticker: str, base_year: str, forecast, overrides: list, items: list
+) -> dict:
+    """
+    JSON body of a what-if: the selected line items of the base case
+    (scenario 0, no overrides) and of every override set, with their
+    change from the base case.
+    """
+    positions = [forecast.line_items.index(item) for item in items]
+    values = forecast.values[:, :, positions]  # (scenarios, years, items)
+    change = values[1:] - values[:1]
+    return {
+        "ticker": ticker,
+        "base_date": base_year,
+        "items": items,
+        "base": dict(zip(items, _json_values(values[0].T))),
+        "scenarios": [
+            {
+                "overrides": _json_safe(override),
+                "values": dict(zip(items, _json_values(values[1 + position].T))),
+                "change": dict(zip(items, _json_values(change[position].T))),
+            }
+            for position, override in enumerate(overrides)
+        ],
+    }
+
+
+WHATIF_ITEMS = ("sales", "net_income", "new_debt_needed", "new_st_investment")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    GET  /health, /stats, /dates/<TICKER>
+    GET  /bs/<TICKER>/<DATE>, /pnl/<TICKER>/<DATE>, /cf/<TICKER>/<DATE>
+    POST /forecast {"ticker", "base_year", "num_years", "overrides", "grid",
+                    "format": "columnar" | "nested"}
+    POST /whatif   {"ticker", "base_year", "num_years", "overrides": [...],
+                    "items": [...]}
+    """
+
+    protocol_version = "HTTP/1.1"
+    # headers and body are separate writes, without TCP_NODELAY every
+    # keep-alive response waits for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    @property
+    def service(self) -> ForecastService:
+        return self.server.service
+
+    def do_GET(self):
+        parts = [part for part in urlparse(self.path).path.split("/") if part]
+        if parts == ["health"]:
+            self._respond(lambda: {"status": "ok"}, record=False)
+        elif parts == ["stats"]:
+            self._respond(self.service.stats, record=False)
+        elif len(parts) == 2 and parts[0] == "dates":
+            self._respond(lambda: {"dates": self.service.dates(parts[1])})
+        elif len(parts) == 3 and parts[0] in STATEMENT_GETTERS:
+            self._respond(
+                lambda: _json_safe(self.service.statement(*parts)), name=parts[0]
+            )
+        else:
+            self._send(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        path = urlparse(self.path).path.rstrip("/")
+        if path not in ("/forecast", "/whatif"):
+            self._send(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            assert isinstance(body, dict), "Request body must be a JSON object"
+            assert "ticker" in body, "Request has no ticker"
+        except (ValueError, AssertionError) as e:
+            self.service.record(error=True)
+            self._send(400, {"error": f"{type(e).__name__}: {e}"})
+            return
+        handler = self._forecast if path == "/forecast" else self._whatif
+        self._respond(lambda: handler(body), name=path[1:])
+
+    def _forecast(self, body: dict) -> dict:
+        base_year, forecast = self.service.forecast(
+            body["ticker"],
+            body.get("base_year"),
+            body.get("num_years", 1),
+            body.get("overrides"),
+            body.get("grid", False),
+        )
+        return forecast_response(
+            body["ticker"].upper(), base_year, forecast, body.get("format", "columnar")
+        )
+
+    def _whatif(self, body: dict) -> dict:
+        overrides = override_rows(body.get("overrides"), body.get("grid", False))
+        items = list(body.get("items", WHATIF_ITEMS))
+        base_year, forecast = self.service.forecast(
+            body["ticker"],
+            body.get("base_year"),
+            body.get("num_years", 1),
+            [{}] + overrides,
+        )
+        for item in items:
+            assert item in forecast.line_items, f"{item} is not a forecast line item"
+        return whatif_response(
+            body["ticker"].upper(), base_year, forecast, overrides, items
+        )
+
+    def _respond(self, handler, name: str = None, record: bool = True):
+        try:
+            if name is None:
+                body = handler()
+            else:
+                with stage(f"service.{name}"):
+                    body = handler()
+            status = 200
+        except StatementNotCachedError as e:
+            status, body = 404, {"error": f"{type(e).__name__}: {e}"}
+        except (AssertionError, KeyError, ValueError, TypeError) as e:
+            status, body = 400, {"error": f"{type(e).__name__}: {e}"}
+        except Exception as e:
+            status, body = 500, {"error": f"{type(e).__name__}: {e}"}
+        if record:
+            self.service.record(error=status != 200)
+        self._send(status, body)
+
+    def _send(self, status: int, body: dict):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def address_string(self) -> str:
+        # Unix socket clients have no address
+        if isinstance(self.client_address, tuple):
+            return super().address_string()
+        return "unix"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class _UnixHandler(_Handler):
+    disable_nagle_algorithm = False  # not a TCP socket
+
+
+class ForecastHTTPServer(ThreadingHTTPServer):
+    """Threaded HTTP/JSON server over a ForecastService, a thread per connection."""
+
+    handler_class = _Handler
+    # listen backlog, socketserver's default of 5 drops connection bursts
+    request_queue_size = 128
+
+    def __init__(self, address, service: ForecastService, verbose: bool = False):
+        self.service = service
+        self.verbose = verbose
+        super().__init__(address, self.handler_class)
+
+
+class UnixForecastServer(ForecastHTTPServer):
+    """ForecastHTTPServer listening on a Unix domain socket."""
+
+    address_family = socket.AF_UNIX
+    handler_class = _UnixHandler
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        socketserver.TCPServer.server_bind(self)
+        self.server_name = "localhost"
+        self.server_port = 0
+
+
+def make_server(
+    service: ForecastService,
+    host: str = "127.0.0.1",
+    port: int = DEFAULT_PORT,
+    unix_socket: str = None,
+    verbose: bool = False,
+) -> ForecastHTTPServer:
+    """
+    Creates the HTTP server of a service, on a Unix socket when given and
+    on host:port otherwise. Call serve_forever() to run it.
+    """
+    if unix_socket is not None:
+        return UnixForecastServer(unix_socket, service, verbose)
+    return ForecastHTTPServer((host, port), service, verbose)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Long-running HTTP/JSON forecast service with warm state."
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="TCP port")
+    parser.add_argument("--unix", help="Listen on this Unix socket instead")
+    parser.add_argument("--store-root", default=DEFAULT_STORE_ROOT)
+    parser.add_argument(
+        "--offline", action="store_true", help="Only use statements in the store"
+    )
+    parser.add_argument("--config-dir", default=DEFAULT_CONFIG_DIR)
+    parser.add_argument(
+        "--frequency", choices=("annual", "quarterly"), default="annual"
+    )
+    parser.add_argument("--validation", choices=("off", "fast", "full"), default="full")
+    parser.add_argument("--cache-dir", help="Forecast cache directory, shareable")
+    parser.add_argument(
+        "--max-companies",
+        type=int,
+        default=DEFAULT_MAX_COMPANIES,
+        help="Companies kept in memory",
+    )
+    parser.add_argument(
+        "--max-mb",
+        type=float,
+        default=DEFAULT_MAX_BYTES / 2**20,
+        help="Statement MiB kept in memory",
+    )
+    parser.add_argument(
+        "--idle-seconds",
+        type=float,
+        default=DEFAULT_IDLE_SECONDS,
+        help="Seconds before an unused ticker is evicted",
+    )
+    parser.add_argument(
+        "--no-batching", action="store_true", help="Run every forecast on its own"
+    )
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args(argv)
+
+    service = ForecastService(
+        store=StatementStore(args.store_root, offline=args.offline),
+        config_dir=args.config_dir,
+        validation=args.validation,
+        frequency=args.frequency,
+        cache=ForecastCache(directory=args.cache_dir) if args.cache_dir else None,
+        max_companies=args.max_companies,
+        max_bytes=int(args.max_mb * 2**20),
+        idle_seconds=args.idle_seconds,
+        batching=not args.no_batching,
+    )
+    server = make_server(service, args.host, args.port, args.unix, args.verbose)
+    where = args.unix or f"http://{args.host}:{server.server_port}"
+    print(f"Serving forecasts on {where}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
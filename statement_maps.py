@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import count, stage
+from utils import build_from_layout, flatten_nested
+
+DEFAULT_CONFIG_DIR = "config"
+
+# Statement name -> (map file name, description used in error messages)
+MAP_FILES = {
+    "balancesheet": ("balance_sheet_map.json", "Balance sheet"),
+    "incomestatement": ("income_statement_map.json", "Income statement"),
+    "cashflow": ("cash_flow_map.json", "Cash flow"),
+}
+
+
+class CompiledMap:
+    """
+    A statement map flattened into an index of source row labels and a
+    layout descriptor, so a statement column is extracted with one reindex.
+    """
+
+    def __init__(self, statement: str, path: str, mtime: int, tree: dict):
+        self.statement = statement
+        self.path = path
+        self.mtime = mtime
+        self.tree = tree
+        # content hash, unlike mtime equal for identical copies of a map; key
+        # order is part of the content since it fixes the layout
+        self.digest = hashlib.sha256(json.dumps(tree).encode()).hexdigest()
+        keys, labels, self.layout = flatten_nested(tree)
+        self.keys = pd.Index(keys)
+        self.labels = pd.Index(labels)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def position(self, key: str) -> int:
+        """Returns the column position of a dotted line item key."""
+        return self.keys.get_loc(key)
+
+    def extract(self, data: pd.Series) -> np.ndarray:
+        """
+        Extracts the mapped line items from a statement column, in map order.
+        Missing rows come back as NaN.
+        """
+        return data.reindex(self.labels).to_numpy()
+
+    def extract_series(self, data: pd.Series) -> pd.Series:
+        """Extracts the mapped line items as a Series keyed by dotted keys."""
+        return pd.Series(self.extract(data), index=self.keys, name=data.name)
+
+    def extract_frame(self, data: pd.DataFrame) -> pd.DataFrame:
+        """
+        Extracts the mapped line items for every date column at once, as a
+        DataFrame indexed by dotted keys with one column per date.
+        """
+        return data.reindex(self.labels).set_axis(self.keys, axis=0)
+
+    def to_dict(self, values) -> dict:
+        """Rebuilds the nested dictionary from extracted values."""
+        return build_from_layout(self.layout, values)
+
+
+_compiled_maps = {}
+_compiled_maps_lock = threading.Lock()
+
+
+def map_path(ticker: str, statement: str, config_dir: str = DEFAULT_CONFIG_DIR) -> str:
+    """
+    Returns the map file path for a ticker and statement, asserting it exists.
+    """
+    assert statement in MAP_FILES, f"Unknown statement {statement}"
+    file_name, description = MAP_FILES[statement]
+
+    # find configurations
+    folder_path = f"{config_dir}/{ticker.upper()}"
+    if not os.path.exists(folder_path):
+        assert False, f"Folder {folder_path} does not exist. Please create it."
+
+    path = f"{folder_path}/{file_name}"
+    assert os.path.exists(path), (
+        f"{description} map file {path} does not exist. Please create it."
+    )
+    return path
+
+
+def load_map(
+    ticker: str, statement: str, config_dir: str = DEFAULT_CONFIG_DIR
+) -> CompiledMap:
+    """
+    Loads and compiles a statement map, once per process. The cached map is
+    recompiled when the file's modification time changes.
+    """
+    path = map_path(ticker, statement, config_dir)
+    mtime = os.stat(path).st_mtime_ns
+
+    compiled = _compiled_maps.get(path)
+    if compiled is not None and compiled.mtime == mtime:
+        count("map_cache.hit", ticker.upper())
+        return compiled
+
+    count("map_cache.miss", ticker.upper())
+    with stage(f"map.compile.{statement}", ticker.upper()):
+        with open(path, "r") as f:
+            tree = json.load(f)
+        compiled = CompiledMap(statement, path, mtime, tree)
+    with _compiled_maps_lock:
+        _compiled_maps[path] = compiled
+    return compiled
+
+
+def clear_map_cache():
+    """Drops every compiled map, forcing them to be reloaded."""
+    with _compiled_maps_lock:
+        _compiled_maps.clear()
@@ -0,0 +1,315 @@
+import abc
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import count, is_enabled, stage
+
+# Statement name -> yfinance.Ticker attribute
+STATEMENTS = {
+    "balancesheet": "balancesheet",
+    "incomestatement": "financials",
+    "cashflow": "cashflow",
+}
+QUARTERLY_STATEMENTS = {
+    "quarterly_balancesheet": "quarterly_balancesheet",
+    "quarterly_incomestatement": "quarterly_financials",
+    "quarterly_cashflow": "quarterly_cashflow",
+}
+ALL_STATEMENTS = {**STATEMENTS, **QUARTERLY_STATEMENTS}
+
+# Reporting frequency -> statement name -> name in the store
+FREQUENCY_STATEMENTS = {
+    "annual": {statement: statement for statement in STATEMENTS},
+    "quarterly": {statement: f"quarterly_{statement}" for statement in STATEMENTS},
+}
+PERIODS_PER_YEAR = {"annual": 1, "quarterly": 4}
+
+DEFAULT_STORE_ROOT = ".fs_store"
+DEFAULT_TTL = 24 * 60 * 60  # seconds
+
+# yfinance timezone cache, relative to the working directory of the first
+# yfinance call
+YF_TZ_CACHE_LOCATION = ".yf_cache"
+
+
+class StatementNotCachedError(LookupError):
+    """Raised in offline mode when a statement is not in the store."""
+
+
+_yfinance = None
+
+
+def load_yfinance():
+    """
+    Imports yfinance on first use and points its timezone cache at
+    YF_TZ_CACHE_LOCATION, so paths served from the store never import it.
+    """
+    global _yfinance
+    if _yfinance is None:
+        import yfinance as yf
+
+        yf.set_tz_cache_location(YF_TZ_CACHE_LOCATION)
+        _yfinance = yf
+    return _yfinance
+
+
+def yfinance_fetcher(ticker: str, statement: str) -> pd.DataFrame:
+    """
+    Fetches a single statement for a ticker from Yahoo Finance.
+    """
+    return getattr(load_yfinance().Ticker(ticker), ALL_STATEMENTS[statement])
+
+
+def _statement_arrays(frame: pd.DataFrame) -> tuple:
+    """The stored arrays of a statement: values, line items and dates."""
+    return (
+        frame.to_numpy(dtype="float64"),
+        np.asarray(frame.index, dtype=str),
+        pd.DatetimeIndex(frame.columns).to_numpy(dtype="datetime64[ns]"),
+    )
+
+
+def _statement_frame(
+    values: np.ndarray, index: np.ndarray, columns: np.ndarray
+) -> pd.DataFrame:
+    """Builds a statement (line items x dates) from its stored arrays."""
+    return pd.DataFrame(
+        values,
+        index=pd.Index(index, dtype=object),
+        columns=pd.DatetimeIndex(columns),
+    )
+
+
+def normalize_statement(frame: pd.DataFrame) -> pd.DataFrame:
+    """
+    A statement as served by a store: float64 values, string line items
+    and datetime64[ns] dates.
+    """
+    return _statement_frame(*_statement_arrays(frame))
+
+
+class StatementSource(abc.ABC):
+    """
+    Where CompanyFS, the async loader and the runners read statements from:
+    a StatementStore or a columnar_store.ColumnarStore.
+
+    get serves a statement from the source (cached) and fetches it
+    through the fetcher otherwise, then stores it (write).
+
+    Attributes:
+        offline: Never fetch, only serve what is in the source
+        fetcher: Callable (ticker, statement) -> DataFrame used when a
+            statement is not in the source, None for an offline source
+    """
+
+    def __init__(self, offline: bool = False, fetcher=None):
+        assert offline or fetcher is not None, "A source that fetches needs a fetcher"
+        self.offline = offline
+        self.fetcher = fetcher
+
+    def get(self, ticker: str, statement: str) -> pd.DataFrame:
+        """
+        Gets a statement, fetching it only when it cannot be served from
+        the source.
+        """
+        frame = self.cached(ticker, statement)
+        if frame is None:
+            frame = self.fetch(ticker, statement)
+        return frame
+
+    @abc.abstractmethod
+    def cached(self, ticker: str, statement: str):
+        """
+        The lookup of get: a statement that can be served without fetching.
+
+        Returns:
+            The statement, or None when it has to be fetched (and then
+            written with write, which fetch does)
+
+        Raises:
+            StatementNotCachedError: The source is offline and does not
+                hold the statement
+        """
+
+    @abc.abstractmethod
+    def write(self, ticker: str, statement: str, frame: pd.DataFrame) -> pd.DataFrame:
+        """
+        Stores a fetched statement.
+
+        Returns:
+            The statement as the source serves it, see normalize_statement
+        """
+
+    def fetch(self, ticker: str, statement: str) -> pd.DataFrame:
+        """
+        Fetches a statement through the fetcher and writes it to the source.
+        """
+        assert not self.offline, "Cannot fetch statements in offline mode"
+        with stage(f"fetch.{statement}", ticker.upper()):
+            frame = self.fetcher(ticker.upper(), statement)
+        assert isinstance(frame, pd.DataFrame), "Fetcher must return a DataFrame"
+        if is_enabled():
+            count(
+                "store.bytes_fetched",
+                ticker.upper(),
+                int(frame.memory_usage(index=True, deep=True).sum()),
+            )
+        with stage("store.write", ticker.upper()):
+            return self.write(ticker, statement, frame)
+
+
+class StatementStore(StatementSource):
+    """
+    On-disk store of financial statements, one compressed .npz file per
+    ticker and statement (row labels, report dates and a float64 matrix).
+
+    Statements are served from disk while they are younger than the ticker's
+    TTL and fetched through the fetcher otherwise. In offline mode the fetcher
+    is never called and stale statements are served as they are.
+    """
+
+    def __init__(
+        self,
+        root: str = DEFAULT_STORE_ROOT,
+        ttl: float = DEFAULT_TTL,
+        ttls: dict = None,
+        offline: bool = False,
+        fetcher=None,
+    ):
+        """
+        Args:
+            root: Directory holding the store
+            ttl: Default time to live of a statement in seconds, None for no expiry
+            ttls: Per-ticker TTL overrides in seconds
+            offline: Never fetch, only serve what is on disk
+            fetcher: Callable (ticker, statement) -> DataFrame used on a cache
+                miss, defaults to yfinance_fetcher
+        """
+        super().__init__(offline, fetcher if fetcher is not None else yfinance_fetcher)
+        self.root = root
+        self.ttl = ttl
+        self.ttls = {key.upper(): value for key, value in (ttls or {}).items()}
+
+    def set_ttl(self, ticker: str, ttl: float):
+        """Sets the time to live in seconds for a single ticker."""
+        self.ttls[ticker.upper()] = ttl
+
+    def ttl_for(self, ticker: str):
+        return self.ttls.get(ticker.upper(), self.ttl)
+
+    def path(self, ticker: str, statement: str) -> str:
+        return os.path.join(self.root, ticker.upper(), f"{statement}.npz")
+
+    def cached(self, ticker: str, statement: str):
+        """
+        Reads a statement that can be served without fetching: any statement
+        on disk in offline mode and one younger than the ticker's TTL
+        otherwise. See StatementSource.cached.
+        """
+        assert statement in ALL_STATEMENTS, f"Unknown statement {statement}"
+        ticker = ticker.upper()
+        cached = self.read(ticker, statement)
+
+        if cached is not None:
+            frame, fetched_at = cached
+            if self.offline or not self.is_stale(ticker, fetched_at):
+                count("store.hit", ticker)
+                return frame
+            count("store.stale", ticker)
+        elif self.offline:
+            raise StatementNotCachedError(
+                f"{statement} for {ticker} is not in the store {self.root} "
+                "and the store is offline."
+            )
+
+        count("store.miss", ticker)
+        return None
+
+    def refresh(self, ticker: str, statements=None, frequency: str = "annual") -> dict:
+        """
+        Re-fetches statements for a ticker regardless of their age.
+
+        Args:
+            ticker: Ticker symbol
+            statements: Statements to re-fetch, as named in the store
+            frequency: "annual" or "quarterly", the statements of that
+                frequency are re-fetched when statements is None
+        """
+        assert frequency in FREQUENCY_STATEMENTS, f"Unknown frequency {frequency}"
+        statements = statements or list(FREQUENCY_STATEMENTS[frequency].values())
+        return {statement: self.fetch(ticker, statement) for statement in statements}
+
+    def is_fresh(self, ticker: str, statement: str) -> bool:
+        cached = self.read(ticker, statement)
+        return cached is not None and not self.is_stale(ticker, cached[1])
+
+    def invalidate(self, ticker: str, statements=None):
+        """Removes statements for a ticker from the store, all when None."""
+        for statement in statements or list(ALL_STATEMENTS):
+            path = self.path(ticker, statement)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def write(self, ticker: str, statement: str, frame: pd.DataFrame) -> pd.DataFrame:
+        """
+        Writes a statement to the store.
+
+        Returns:
+            The statement as read back from the store (float64 values, string
+            line items and datetime64[ns] dates), so a fetched statement is
+            served exactly like a cached one
+        """
+        path = self.path(ticker, statement)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        values, index, columns = _statement_arrays(frame)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            values=values,
+            index=index,
+            columns=columns,
+            fetched_at=np.float64(time.time()),
+        )
+        # atomic so concurrent readers never see a partial file
+        os.replace(tmp_path, path)
+        return _statement_frame(values, index, columns)
+
+    def read(self, ticker: str, statement: str):
+        """
+        Reads a statement from disk.
+
+        Returns:
+            Tuple of (frame, fetched_at) or None if it is not in the store
+        """
+        path = self.path(ticker, statement)
+        if not os.path.exists(path):
+            return None
+
+        with stage("store.read", ticker.upper()):
+            with np.load(path, allow_pickle=False) as data:
+                frame = _statement_frame(data["values"], data["index"], data["columns"])
+                fetched_at = float(data["fetched_at"])
+        if is_enabled():
+            count("store.bytes_read", ticker.upper(), os.path.getsize(path))
+        return frame, fetched_at
+
+    def is_stale(self, ticker: str, fetched_at: float) -> bool:
+        """Whether a statement fetched at fetched_at is older than its TTL."""
+        ttl = self.ttl_for(ticker)
+        return ttl is not None and time.time() - fetched_at > ttl
+
+
+_default_store = None
+
+
+def default_store() -> StatementStore:
+    """Returns the process-wide store used when CompanyFS gets no store."""
+    global _default_store
+    if _default_store is None:
+        _default_store = StatementStore()
+    return _default_store
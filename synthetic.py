@@ -0,0 +1,222 @@
+import os
+import shutil
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from forecast_rules import RULES_FILE
+from statement_maps import DEFAULT_CONFIG_DIR, MAP_FILES
+
+# Template ticker whose maps are reused for synthetic tickers
+TEMPLATE_TICKER = "MSFT"
+
+# Reporting unit of the synthetic statements. Companies come out around a
+# thousandth of MSFT's size: at real mega-cap scale float rounding over a
+# few forecast years exceeds the absolute balance check tolerance (1e-4).
+UNIT = 1e3
+
+# Balance sheet line items in units, shaped like MSFT's
+BALANCE_SHEET_ITEMS = {
+    "Cash Cash Equivalents And Short Term Investments": 75543,
+    "Receivables": 56924,
+    "Inventory": 1246,
+    "Hedging Assets Current": 91,
+    "Other Current Assets": 25872,
+    "Net PPE": 154552,
+    "Investments And Advances": 14600,
+    "Goodwill And Other Intangible Assets": 146400,
+    "Other Non Current Assets": 37028,
+    "Payables And Accrued Expenses": 51217,
+    "Pensionand Other Post Retirement Benefit Plans Current": 12689,
+    "Current Debt And Capital Lease Obligation": 8942,
+    "Current Deferred Liabilities": 57582,
+    "Other Current Liabilities": 4881,
+    "Long Term Debt And Capital Lease Obligation": 60588,
+    "Non Current Deferred Liabilities": 4060,
+    "Tradeand Other Payables Non Current": 27931,
+    "Other Non Current Liabilities": 27064,
+    "Capital Stock": 100923,
+    "Retained Earnings": 173144,
+}
+ASSET_ITEMS = list(BALANCE_SHEET_ITEMS)[:9]
+LIABILITY_ITEMS = list(BALANCE_SHEET_ITEMS)[9:18]
+EQUITY_PLUG = "Gains Losses Not Affecting Retained Earnings"
+
+# Rows Yahoo reports that the maps do not use, kept so extraction has to
+# pick the mapped rows out of a realistically sized statement
+FILLER_ROWS = 40
+
+
+def _seed_for(ticker: str, seed: int) -> int:
+    """Derives a stable per-ticker seed, independent of PYTHONHASHSEED."""
+    return zlib.crc32(ticker.upper().encode()) ^ seed
+
+
+def _columns(num_dates: int, last_date: str, frequency: str) -> pd.DatetimeIndex:
+    """Statement dates, most recent first like yfinance."""
+    last = pd.Timestamp(last_date)
+    if frequency == "quarterly":
+        # quarter ends stay on month ends (2024-03-31, not 2024-03-30)
+        offset = pd.offsets.MonthEnd(3) if last.is_month_end else pd.DateOffset(months=3)
+    else:
+        offset = pd.DateOffset(years=1)
+    return pd.DatetimeIndex([last - offset * i for i in range(num_dates)])
+
+
+def _units(values: np.ndarray) -> np.ndarray:
+    """Rounds to whole units so every subtotal is exact in float64."""
+    return np.round(values) * UNIT
+
+
+def generate_statements(
+    ticker: str,
+    num_dates: int = 4,
+    seed: int = 0,
+    last_date: str = "2024-06-30",
+    frequency: str = "annual",
+) -> dict:
+    """
+    Generates yfinance-shaped statements for a synthetic company.
+
+    Line items are whole units (thousands), so the balance sheet identity and the
+    income statement chain hold exactly and the statements pass the same
+    validation as real ones. The same ticker and seed always give the same
+    statements.
+
+    Args:
+        ticker: Ticker symbol, also seeds the generator
+        num_dates: Number of statement dates
+        seed: Extra seed, vary it for different companies per ticker
+        last_date: Most recent statement date in YYYY-MM-DD format
+        frequency: "annual" or "quarterly" spacing of the dates
+
+    Returns:
+        Dict of statement name -> DataFrame (line items x dates)
+    """
+    assert num_dates > 0, "Number of dates must be greater than 0"
+    assert frequency in ("annual", "quarterly"), "Frequency must be annual or quarterly"
+    rng = np.random.default_rng(_seed_for(ticker, seed))
+    columns = _columns(num_dates, last_date, frequency)
+    periods_per_year = 1 if frequency == "annual" else 4
+
+    # company size and growth, t = 0 is the most recent date
+    size = rng.uniform(0.05, 2.0)
+    growth = rng.uniform(-0.02, 0.15) / periods_per_year
+    t = np.arange(num_dates)
+    trend = size * (1 + growth) ** -t
+
+    def path(base: float) -> np.ndarray:
+        noise = rng.normal(1.0, 0.03, num_dates)
+        return _units(base * trend * noise)
+
+    balance_sheet = {label: path(base) for label, base in BALANCE_SHEET_ITEMS.items()}
+    total_assets = sum(balance_sheet[label] for label in ASSET_ITEMS)
+    total_liabilities = sum(balance_sheet[label] for label in LIABILITY_ITEMS)
+    balance_sheet[EQUITY_PLUG] = (
+        total_assets
+        - total_liabilities
+        - balance_sheet["Capital Stock"]
+        - balance_sheet["Retained Earnings"]
+    )
+    balance_sheet["Total Assets"] = total_assets
+    balance_sheet["Total Liabilities Net Minority Interest"] = total_liabilities
+    balance_sheet["Total Equity Gross Minority Interest"] = total_assets - total_liabilities
+    balance_sheet["Current Assets"] = sum(balance_sheet[label] for label in ASSET_ITEMS[:5])
+    for i in range(FILLER_ROWS):
+        balance_sheet[f"Other Balance Sheet Item {i}"] = path(1000)
+
+    revenue = path(245122 / periods_per_year)
+    cost_of_revenue = _units(revenue / UNIT * rng.uniform(0.25, 0.6))
+    gross_profit = revenue - cost_of_revenue
+    operating_expenses = _units(revenue / UNIT * rng.uniform(0.1, 0.25))
+    operating_income = gross_profit - operating_expenses
+    interest = path(-2935 / periods_per_year)
+    other = path(-1646 / periods_per_year)
+    pretax_income = operating_income + interest + other
+    tax_provision = _units(pretax_income / UNIT * rng.uniform(0.15, 0.25))
+    net_income = pretax_income - tax_provision
+    income_statement = {
+        "Total Revenue": revenue,
+        "Cost Of Revenue": cost_of_revenue,
+        "Gross Profit": gross_profit,
+        "Operating Expense": operating_expenses,
+        "Operating Income": operating_income,
+        "Net Non Operating Interest Income Expense": interest,
+        "Other Income Expense": other,
+        "Pretax Income": pretax_income,
+        "Tax Provision": tax_provision,
+        "Net Income Common Stockholders": net_income,
+    }
+    for i in range(FILLER_ROWS):
+        income_statement[f"Other Income Statement Item {i}"] = path(1000)
+
+    cash_flow = {
+        "Capital Expenditure": -_units(revenue / UNIT * rng.uniform(0.05, 0.2)),
+        "Depreciation Amortization Depletion": _units(
+            balance_sheet["Net PPE"] / UNIT * rng.uniform(0.08, 0.15) / periods_per_year
+        ),
+        "Cash Dividends Paid": -_units(net_income / UNIT * rng.uniform(0.0, 0.4)),
+    }
+    for i in range(FILLER_ROWS):
+        cash_flow[f"Other Cash Flow Item {i}"] = path(1000)
+
+    return {
+        statement: pd.DataFrame(rows, index=columns).T
+        for statement, rows in (
+            ("balancesheet", balance_sheet),
+            ("incomestatement", income_statement),
+            ("cashflow", cash_flow),
+        )
+    }
+
+
+class SyntheticFetcher:
+    """
+    StatementStore fetcher serving synthetic statements instead of yfinance.
+    Picklable, so it can be used by the universe runner's worker processes.
+    The quarterly_* statements are always generated at quarterly spacing.
+    """
+
+    def __init__(
+        self,
+        num_dates: int = 4,
+        seed: int = 0,
+        last_date: str = "2024-06-30",
+        frequency: str = "annual",
+    ):
+        self.num_dates = num_dates
+        self.seed = seed
+        self.last_date = last_date
+        self.frequency = frequency
+
+    def __call__(self, ticker: str, statement: str) -> pd.DataFrame:
+        frequency = self.frequency
+        if statement.startswith("quarterly_"):
+            statement, frequency = statement[len("quarterly_") :], "quarterly"
+        return generate_statements(
+            ticker, self.num_dates, self.seed, self.last_date, frequency
+        )[statement]
+
+
+def synthetic_tickers(count: int, prefix: str = "SYN") -> list:
+    """Returns count synthetic ticker symbols, e.g. SYN0000, SYN0001, ..."""
+    return [f"{prefix}{i:04d}" for i in range(count)]
+
+
+def write_synthetic_config(tickers: list, config_dir: str = DEFAULT_CONFIG_DIR):
+    """
+    Writes statement maps and forecast rules for synthetic tickers by
+    copying those of the template ticker, the synthetic statements use the
+    same Yahoo labels.
+    """
+    file_names = [file_name for file_name, _ in MAP_FILES.values()] + [RULES_FILE]
+    for ticker in tickers:
+        ticker_dir = os.path.join(config_dir, ticker.upper())
+        os.makedirs(ticker_dir, exist_ok=True)
+        for file_name in file_names:
+            source = os.path.join(DEFAULT_CONFIG_DIR, TEMPLATE_TICKER, file_name)
+            target = os.path.join(ticker_dir, file_name)
+            if not os.path.exists(target):
+                shutil.copyfile(source, target)
+
@@ -0,0 +1,116 @@
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from company_fs import CompanyFS  # noqa: E402
+from forecast_rules import RULES_FILE, STANDARD_RULES  # noqa: E402
+from statement_store import FREQUENCY_STATEMENTS, StatementStore  # noqa: E402
+from synthetic import (  # noqa: E402
+    SyntheticFetcher,
+    generate_statements,
+    write_synthetic_config,
+)
+from universe import latest_date  # noqa: E402
+
+TICKERS = ["SYN0000", "SYN0001", "SYN0002"]
+# Synthetic ticker with its own forecast rules, see rules_company
+RULES_TICKER = "RUL0000"
+# Synthetic ticker missing one statement date, see gapped_company
+GAP_TICKER = "GAP0000"
+NUM_DATES = 6
+SEED = 7
+
+# Standard rules plus sales driven working capital
+SALES_DRIVEN_RULES = {
+    **STANDARD_RULES,
+    "line_items": {
+        **STANDARD_RULES["line_items"],
+        "total_assets.current_assets.receivables": "sales",
+        "total_assets.current_assets.Inventory": "sales",
+        "total_liabilities.current_liabilities.payables_and_accrued_expenses": "sales",
+    },
+}
+
+
+@pytest.fixture(scope="session", autouse=True)
+def repo_root():
+    """Runs the tests from the repository root, where config/ is."""
+    cwd = os.getcwd()
+    os.chdir(ROOT)
+    yield ROOT
+    os.chdir(cwd)
+
+
+@pytest.fixture(scope="session")
+def synthetic(tmp_path_factory, repo_root):
+    """
+    Config directory and statement store of the synthetic tickers, the
+    statements generated on first use.
+
+    Returns:
+        Tuple of (config_dir, store)
+    """
+    root = tmp_path_factory.mktemp("synthetic")
+    config_dir = str(root / "config")
+    write_synthetic_config(TICKERS + [RULES_TICKER, GAP_TICKER], config_dir)
+    with open(os.path.join(config_dir, RULES_TICKER, RULES_FILE), "w") as f:
+        json.dump(SALES_DRIVEN_RULES, f)
+    store = StatementStore(
+        str(root / "store"), ttl=None, fetcher=SyntheticFetcher(NUM_DATES, SEED)
+    )
+    return config_dir, store
+
+
+@pytest.fixture
+def company(synthetic) -> CompanyFS:
+    config_dir, store = synthetic
+    return CompanyFS(TICKERS[0], store=store, config_dir=config_dir)
+
+
+@pytest.fixture
+def rules_company(synthetic) -> CompanyFS:
+    """A company whose forecast rules are not the standard ones."""
+    config_dir, store = synthetic
+    return CompanyFS(RULES_TICKER, store=store, config_dir=config_dir)
+
+
+@pytest.fixture
+def base_date(company) -> str:
+    return latest_date(company)
+
+
+def offline_company(
+    root: str, ticker: str, config_dir: str, statements: dict, **kwargs
+) -> CompanyFS:
+    """
+    A company reading the given annual statements (statement -> DataFrame)
+    from an offline store under root, e.g. statements edited to break an
+    identity.
+    """
+    store = StatementStore(root, ttl=None, offline=True)
+    for statement, frame in statements.items():
+        store.write(ticker, statement, frame)
+    return CompanyFS(ticker, store=store, config_dir=config_dir, **kwargs)
+
+
+@pytest.fixture(params=["annual", "quarterly"])
+def gapped_company(request, synthetic, tmp_path) -> CompanyFS:
+    """
+    A company whose statements skip the third most recent date, of each
+    frequency.
+    """
+    config_dir, _ = synthetic
+    frequency = request.param
+    statements = generate_statements(GAP_TICKER, NUM_DATES, SEED, frequency=frequency)
+    store = StatementStore(str(tmp_path / "store"), ttl=None, offline=True)
+    for name, statement in FREQUENCY_STATEMENTS[frequency].items():
+        frame = statements[name]
+        store.write(GAP_TICKER, statement, frame.drop(columns=frame.columns[2]))
+    return CompanyFS(
+        GAP_TICKER, store=store, config_dir=config_dir, frequency=frequency
+    )
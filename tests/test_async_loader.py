@@ -0,0 +1,90 @@
+import pandas as pd
+import pytest
+
+from async_loader import load_companies
+from conftest import NUM_DATES, SEED, TICKERS
+from statement_store import STATEMENTS, StatementStore
+from synthetic import SyntheticFetcher
+
+
+class FlakyTransport:
+    """
+    Serves synthetic statements, raising error for the first failures
+    requests of each (ticker, statement).
+    """
+
+    def __init__(self, failures: int, error: Exception):
+        self.failures = failures
+        self.error = error
+        self.fetcher = SyntheticFetcher(NUM_DATES, SEED)
+        self.calls = {}
+
+    async def __call__(self, ticker: str, statement: str) -> pd.DataFrame:
+        key = (ticker, statement)
+        self.calls[key] = self.calls.get(key, 0) + 1
+        if self.calls[key] <= self.failures:
+            raise self.error
+        return self.fetcher(ticker, statement)
+
+
+@pytest.fixture
+def store(tmp_path) -> StatementStore:
+    return StatementStore(
+        str(tmp_path), ttl=None, fetcher=SyntheticFetcher(NUM_DATES, SEED)
+    )
+
+
+def test_retries_transient_errors(synthetic, store):
+    config_dir, _ = synthetic
+    transport = FlakyTransport(2, ConnectionError("reset by peer"))
+    result = load_companies(
+        TICKERS, store=store, transport=transport, backoff=0, config_dir=config_dir
+    )
+    assert not result.errors and sorted(result.companies) == TICKERS
+    fetches = len(TICKERS) * len(STATEMENTS)
+    assert result.stats["requests"] == 3 * fetches
+    assert result.stats["retries"] == 2 * fetches
+
+    # written back to the store, served from disk the second time
+    result = load_companies(
+        TICKERS, store=store, transport=transport, backoff=0, config_dir=config_dir
+    )
+    assert result.stats["cache_hits"] == fetches
+    assert result.stats["requests"] == 0
+
+
+def test_gives_up_after_the_last_retry(synthetic, store):
+    config_dir, _ = synthetic
+    transport = FlakyTransport(3, ConnectionError("reset by peer"))
+    result = load_companies(
+        TICKERS[:1],
+        store=store,
+        transport=transport,
+        statements=["balancesheet"],
+        retries=2,
+        backoff=0,
+        config_dir=config_dir,
+    )
+    assert result.stats["requests"] == 3 and result.stats["retries"] == 2
+    assert result.errors == {
+        TICKERS[0]: "balancesheet: ConnectionError: reset by peer"
+    }
+
+
+@pytest.mark.parametrize("error", [KeyError("balancesheet"), AssertionError("bad")])
+def test_does_not_retry_permanent_errors(synthetic, store, error):
+    config_dir, _ = synthetic
+    transport = FlakyTransport(1, error)
+    result = load_companies(
+        TICKERS[:1],
+        store=store,
+        transport=transport,
+        statements=["balancesheet"],
+        backoff=0,
+        config_dir=config_dir,
+    )
+    assert result.stats["requests"] == 1 and result.stats["retries"] == 0
+    assert not result.companies
+    assert result.errors[TICKERS[0]].startswith(
+        f"balancesheet: {type(error).__name__}"
+    )
@@ -0,0 +1,33 @@
+from backtest import backtest
+from driver_estimation import DriverEstimator
+
+
+def test_horizons_match_dates(gapped_company):
+    result = backtest(
+        [gapped_company],
+        horizons=(1, 2),
+        estimators={"base_year": None, "median": DriverEstimator(window=3)},
+        workers=0,
+    )
+    assert not result.failures
+    errors = result.errors
+
+    def month(dates):
+        return dates.dt.year * 12 + dates.dt.month
+
+    months = 12 // gapped_company.periods_per_year * errors["horizon"]
+    assert (month(errors["target_date"]) == month(errors["base_date"]) + months).all()
+
+    # 5 of 6 dates, the fourth missing: dates 1 and 2 are compared one and
+    # two periods ahead, date 3 two periods ahead over the gap, date 5 one
+    # period ahead, and nothing is compared with the missing date
+    dates = gapped_company.get_bs_history().columns.sort_values()
+    pairs = errors[["base_date", "horizon"]].drop_duplicates()
+    assert list(pairs.itertuples(index=False, name=None)) == [
+        (dates[0], 1),
+        (dates[0], 2),
+        (dates[1], 1),
+        (dates[2], 2),
+        (dates[3], 1),
+    ]
+    assert set(errors["estimator"]) == {"base_year", "median"}
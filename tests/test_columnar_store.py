@@ -0,0 +1,107 @@
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from async_loader import load_companies
+from columnar_store import ColumnarStore
+from company_fs import CompanyFS
+from conftest import NUM_DATES, SEED, TICKERS
+from statement_store import STATEMENTS, StatementNotCachedError, StatementStore
+from synthetic import SyntheticFetcher
+
+
+@pytest.fixture(scope="module")
+def columnar(synthetic, tmp_path_factory):
+    config_dir, store = synthetic
+    root = str(tmp_path_factory.mktemp("columnar"))
+    return ColumnarStore.build(root, TICKERS + ["NOMAP"], store, config_dir)
+
+
+def test_parity_with_statement_store(synthetic, columnar, base_date):
+    config_dir, store = synthetic
+    assert columnar.tickers == TICKERS and list(columnar.skipped) == ["NOMAP"]
+    for ticker in TICKERS:
+        packed = CompanyFS(ticker, store=columnar, config_dir=config_dir)
+        stored = CompanyFS(ticker, store=store, config_dir=config_dir)
+        pd.testing.assert_frame_equal(packed.get_bs_history(), stored.get_bs_history())
+        pd.testing.assert_frame_equal(
+            packed.get_pnl_history(), stored.get_pnl_history()
+        )
+        pd.testing.assert_frame_equal(packed.get_cf_history(), stored.get_cf_history())
+        assert packed.validate().ok == stored.validate().ok
+        assert np.array_equal(
+            packed.forecast_scenarios(base_date, 3).values,
+            stored.forecast_scenarios(base_date, 3).values,
+        )
+
+
+def test_statements_are_views(columnar):
+    frame = columnar.get(TICKERS[0], "balancesheet")
+    assert np.shares_memory(frame.to_numpy(), columnar.values["balancesheet"])
+    with pytest.raises(ValueError):
+        frame.iloc[0, 0] = 0.0
+
+
+def test_offline_and_online(columnar):
+    assert columnar.offline and columnar.fetcher is None
+    with pytest.raises(StatementNotCachedError):
+        columnar.get("MISSING", "balancesheet")
+    with pytest.raises(StatementNotCachedError):
+        columnar.get(TICKERS[0], "quarterly_balancesheet")
+
+    fetcher = SyntheticFetcher(NUM_DATES, SEED)
+    online = ColumnarStore(columnar.root, offline=False, fetcher=fetcher)
+    frame = online.get("MISSING", "balancesheet")
+    assert frame.to_numpy().dtype == np.float64
+    assert isinstance(frame.columns, pd.DatetimeIndex)
+    # nothing is added to the packed files
+    assert "MISSING" not in ColumnarStore(columnar.root)
+
+    with pytest.raises(AssertionError):
+        ColumnarStore(columnar.root, offline=False)
+
+
+def test_pickle_keeps_settings(columnar):
+    fetcher = SyntheticFetcher(NUM_DATES, SEED)
+    online = pickle.loads(
+        pickle.dumps(ColumnarStore(columnar.root, offline=False, fetcher=fetcher))
+    )
+    assert not online.offline and online.fetcher.seed == SEED
+    assert pickle.loads(pickle.dumps(columnar)).offline
+
+
+def test_async_loader_reads_it(synthetic, columnar):
+    config_dir, _ = synthetic
+    loaded = load_companies(
+        TICKERS + ["MISSING"], store=columnar, config_dir=config_dir
+    )
+    assert sorted(loaded.companies) == TICKERS
+    assert "StatementNotCachedError" in loaded.errors["MISSING"]
+    assert loaded.stats["requests"] == 0
+    assert loaded.stats["cache_hits"] == len(TICKERS) * len(STATEMENTS)
+
+
+class _RefetchingStore(StatementStore):
+    """Serves a balance sheet with one date less on every later read."""
+
+    def __init__(self, store: StatementStore):
+        super().__init__(store.root, ttl=None, offline=True)
+        self.reads = {}
+
+    def cached(self, ticker: str, statement: str):
+        frame = super().cached(ticker, statement)
+        reads = self.reads.get((ticker, statement), 0)
+        self.reads[ticker, statement] = reads + 1
+        if statement == "balancesheet" and reads:
+            return frame.iloc[:, 1:]
+        return frame
+
+
+def test_build_rejects_statements_changed_between_passes(synthetic, tmp_path):
+    config_dir, store = synthetic
+    with pytest.raises(AssertionError, match="changed while building"):
+        ColumnarStore.build(
+            str(tmp_path), TICKERS[:1], _RefetchingStore(store), config_dir
+        )
@@ -0,0 +1,67 @@
+import json
+
+from async_loader import load_companies
+from cli import Server, main
+from company_pool import CompanyPool
+from conftest import TICKERS
+from driver_estimation import DriverEstimator
+from forecast_cache import ForecastCache
+from forecast_output import JSONLSink
+
+
+def test_pool_reuses_and_evicts(synthetic):
+    config_dir, store = synthetic
+    pool = CompanyPool(max_companies=2, store=store, config_dir=config_dir)
+    first = pool.get(TICKERS[0].lower())
+    assert pool.get(TICKERS[0]) is first
+    pool.get(TICKERS[1])
+    pool.get(TICKERS[0])
+    pool.get(TICKERS[2])
+    # the least recently used one goes
+    assert TICKERS[1] not in pool and TICKERS[0] in pool
+    assert pool.evictions == 1 and pool.nbytes > 0
+
+    assert pool.evict(idle_seconds=0.0) == 2
+    assert len(pool) == 0
+
+
+def test_loaded_companies_keep_their_settings(synthetic, tmp_path):
+    config_dir, store = synthetic
+    company_kwargs = {
+        "store": store,
+        "config_dir": config_dir,
+        "estimator": DriverEstimator("mean", window=2),
+        "cache": ForecastCache(),
+    }
+    loaded = load_companies(TICKERS[:2], **company_kwargs)
+    assert not loaded.errors
+
+    with JSONLSink(str(tmp_path / "rows.jsonl")) as sink:
+        server = Server(sink, **company_kwargs)
+        server.add_companies(loaded.companies)
+        for ticker, company in loaded.companies.items():
+            assert server.company(ticker) is company
+            assert company.estimator is company_kwargs["estimator"]
+            assert company.cache is company_kwargs["cache"]
+
+
+def test_cli_offline(synthetic, tmp_path, capsys):
+    config_dir, store = synthetic
+    for ticker in TICKERS:
+        store.get(ticker, "balancesheet")
+        store.get(ticker, "incomestatement")
+        store.get(ticker, "cashflow")
+    output = tmp_path / "rows.jsonl"
+    status = main(
+        TICKERS
+        + ["MISSING"]
+        + ["--horizons", "1", "2", "--offline", "--store-root", store.root]
+        + ["--config-dir", config_dir, "--output", str(output)]
+        + ["--estimator", "median", "--cache-dir", str(tmp_path / "cache")]
+    )
+    assert status == 1
+    rows = [json.loads(line) for line in output.read_text().splitlines()]
+    assert {row["ticker"] for row in rows} == set(TICKERS)
+
+    stats = json.loads(capsys.readouterr().err.splitlines()[-1])
+    assert stats["failed"] == 1 and stats["succeeded"] == len(TICKERS)
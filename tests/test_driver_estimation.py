@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from conftest import GAP_TICKER, NUM_DATES, SEED, offline_company
+from driver_estimation import DriverEstimator, period_positions
+from synthetic import generate_statements
+
+
+def test_sales_growth_follows_dates(gapped_company):
+    history = gapped_company.driver_history()
+    ratios = history.ratios.xs(gapped_company.ticker_name, level="ticker")
+    missing = history.missing.xs(gapped_company.ticker_name, level="ticker")
+    revenue = gapped_company.get_pnl_history().loc["total_revenue", ratios.index]
+
+    previous = period_positions(ratios.index, gapped_company.periods_per_year, -1)
+    # the oldest date and the one after the dropped statement have none
+    assert list(np.flatnonzero(previous < 0)) == [0, len(ratios) - 2]
+    growth = ratios["sales_growth_rate"].to_numpy()
+    assert np.isnan(growth[previous < 0]).all()
+    assert missing["sales_growth_rate"].to_numpy()[previous < 0].all()
+
+    expected = revenue.to_numpy()[1:] / revenue.to_numpy()[:-1]
+    defined = previous[1:] >= 0
+    assert np.allclose(growth[1:][defined], expected[defined], rtol=1e-15)
+
+
+def test_estimator_needs_a_reported_base_date(synthetic, tmp_path):
+    config_dir, _ = synthetic
+    statements = generate_statements(GAP_TICKER, NUM_DATES, SEED)
+    # the latest income statement is not reported yet
+    income_statement = statements["incomestatement"]
+    income_statement[income_statement.columns[0]] = np.nan
+    company = offline_company(
+        str(tmp_path),
+        GAP_TICKER,
+        config_dir,
+        statements,
+        validation="off",
+        estimator=DriverEstimator("median"),
+    )
+    base_date = company.balancesheet.columns[0].strftime("%Y-%m-%d")
+    with pytest.raises(AssertionError, match=f"{GAP_TICKER} at {base_date}"):
+        company.forecast_scenarios(base_date, 2)
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from company_fs import CompanyFS
+from conftest import TICKERS
+from forecast_cache import ForecastCache, forecast_key
+
+OVERRIDE = {"sales_growth_rate": 1.1}
+
+
+@pytest.fixture
+def cached_company(synthetic, tmp_path):
+    """A company forecasting through a cache with an on-disk tier."""
+    config_dir, store = synthetic
+    cache = ForecastCache(directory=str(tmp_path / "forecasts"))
+    return CompanyFS(TICKERS[1], store=store, config_dir=config_dir, cache=cache)
+
+
+def test_hit_and_shorter_horizon(cached_company, base_date):
+    cache = cached_company.cache
+    first = cached_company.forecast_scenarios(base_date, 5, OVERRIDE)
+    again = cached_company.forecast_scenarios(base_date, 5, OVERRIDE)
+    shorter = cached_company.forecast_scenarios(base_date, 3, OVERRIDE)
+    assert cache.stats["misses"] == 1 and cache.stats["hits"] == 2
+
+    assert again.values is first.values
+    assert np.array_equal(shorter.values, first.values[:, :3])
+    with pytest.raises(ValueError):
+        again.values[0, 0, 0] = 0.0
+
+
+def test_equal_overrides_share_an_entry(cached_company, base_date):
+    cache = cached_company.cache
+    cached_company.forecast_scenarios(base_date, 2, OVERRIDE)
+    cached_company.forecast_scenarios(base_date, 2, [{**OVERRIDE, "unknown": 1.0}])
+    cached_company.forecast_scenarios(base_date, 2, pd.DataFrame([OVERRIDE]))
+    assert cache.stats["misses"] == 1 and cache.stats["hits"] == 2
+    assert forecast_key(cached_company, base_date, OVERRIDE) != forecast_key(
+        cached_company, base_date, {"sales_growth_rate": 1.2}
+    )
+
+
+def test_extension_matches_full_forecast(cached_company, base_date):
+    cache = cached_company.cache
+    cached_company.forecast_scenarios(base_date, 2, OVERRIDE)
+    extended = cached_company.forecast_scenarios(base_date, 6, OVERRIDE)
+    assert cache.stats["extensions"] == 1
+
+    uncached = CompanyFS(
+        TICKERS[1],
+        store=cached_company.store,
+        config_dir=cached_company.config_dir,
+    )
+    assert np.array_equal(
+        extended.values, uncached.forecast_scenarios(base_date, 6, OVERRIDE).values
+    )
+    assert cached_company.forecast_balancesheet(
+        base_date, 6, OVERRIDE
+    ) == uncached.forecast_balancesheet(base_date, 6, OVERRIDE)
+
+
+def test_disk_round_trip(cached_company, base_date):
+    stored = cached_company.forecast_scenarios(base_date, 4, OVERRIDE)
+
+    # a new process pointing at the same directory
+    cache = ForecastCache(directory=cached_company.cache.directory)
+    company = CompanyFS(
+        TICKERS[1],
+        store=cached_company.store,
+        config_dir=cached_company.config_dir,
+        cache=cache,
+    )
+    loaded = company.forecast_scenarios(base_date, 4, OVERRIDE)
+    assert cache.stats["disk_hits"] == 1 and cache.stats["misses"] == 0
+    assert np.array_equal(loaded.values, stored.values)
+    assert np.array_equal(loaded.imbalance, stored.imbalance)
+    assert loaded.scenario(0) == stored.scenario(0)
+
+    # the program travels with it, so the loaded forecast extends
+    extended = company.forecast_scenarios(base_date, 6, OVERRIDE)
+    assert cache.stats["extensions"] == 1
+    assert np.array_equal(extended.values[:, :4], stored.values)
+
+
+def test_statement_change_invalidates(cached_company, base_date):
+    cache = cached_company.cache
+    cached_company.forecast_scenarios(base_date, 2, OVERRIDE)
+    cached_company.balancesheet = cached_company.balancesheet * 2.0
+    cached_company.forecast_scenarios(base_date, 2, OVERRIDE)
+    assert cache.stats["misses"] == 2
+
+
+def test_limits_evict(cached_company, base_date):
+    cache = ForecastCache(max_entries=2)
+    cached_company.cache = cache
+    for growth in (1.0, 1.1, 1.2):
+        cached_company.forecast_scenarios(base_date, 2, {"sales_growth_rate": growth})
+    assert len(cache) == 2 and cache.stats["evictions"] == 1
@@ -0,0 +1,67 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import TICKERS
+from forecast_output import (
+    KEY_COLUMNS,
+    CSVSink,
+    forecast_frame,
+    iter_forecast_frames,
+    open_sink,
+    write_forecast,
+)
+
+OVERRIDES = [{"sales_growth_rate": growth} for growth in (1.0, 1.1, 1.2)]
+
+
+@pytest.fixture
+def frame(company, base_date) -> pd.DataFrame:
+    forecast = company.forecast_scenarios(base_date, 4, OVERRIDES)
+    return forecast_frame(company.ticker_name, base_date, forecast)
+
+
+def test_frames(company, base_date, frame):
+    assert list(frame.columns[: len(KEY_COLUMNS)]) == KEY_COLUMNS
+    assert len(frame) == len(OVERRIDES) * 4
+    assert (frame["ticker"] == TICKERS[0]).all()
+
+    # one frame per year, the same rows in year order
+    yearly = pd.concat(iter_forecast_frames(company, base_date, 4, OVERRIDES))
+    yearly = yearly.sort_values(["scenario", "year"]).reset_index(drop=True)
+    pd.testing.assert_frame_equal(yearly, frame, check_dtype=False)
+
+
+@pytest.mark.parametrize("extension", [".csv", ".jsonl", ".parquet"])
+def test_round_trip(frame, tmp_path, extension):
+    if extension == ".parquet":
+        pytest.importorskip("pyarrow")
+    path = str(tmp_path / f"rows{extension}")
+    frames = [frame.iloc[i : i + 5] for i in range(0, len(frame), 5)]
+    with open_sink(path) as sink:
+        assert write_forecast(frames, sink, batch_rows=7) == len(frame)
+        assert sink.rows_written == len(frame)
+
+    if extension == ".csv":
+        read = pd.read_csv(path, dtype={"base_date": str})
+    elif extension == ".jsonl":
+        read = pd.read_json(path, lines=True, dtype={"base_date": str})
+    else:
+        read = pd.read_parquet(path)
+    pd.testing.assert_frame_equal(read, frame, check_dtype=False)
+
+
+def test_jsonl_nulls(tmp_path):
+    path = str(tmp_path / "rows.jsonl")
+    with open_sink(path) as sink:
+        sink.write(pd.DataFrame({"ticker": ["A"], "value": [np.nan]}))
+    with open(path) as f:
+        assert json.loads(f.readline()) == {"ticker": "A", "value": None}
+
+
+def test_open_sink(tmp_path):
+    assert isinstance(open_sink(str(tmp_path / "rows.CSV")), CSVSink)
+    with pytest.raises(AssertionError, match="Unsupported output format"):
+        open_sink(str(tmp_path / "rows.xlsx"))
@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+from forecast_engine import BALANCE_TOLERANCE, RELATIVE_BALANCE_TOLERANCE
+from forecast_rules import CASH, RETAINED_EARNINGS, NonStandardRulesError
+
+OVERRIDES = [
+    None,
+    {"sales_growth_rate": 1.1},
+    {"dividend_payout_ratio": 3.0},
+    {"sales_growth_rate": 0.9, "operating_margin": -0.2},
+]
+
+
+@pytest.mark.parametrize("override", OVERRIDES)
+def test_forecast_balancesheet_matches_scenarios(company, base_date, override):
+    legacy = company.forecast_balancesheet(base_date, 5, override)
+
+    assert list(company.iter_forecast_balancesheet(base_date, 5, override)) == legacy
+    # the same scenario as one row of a larger batch
+    batch = company.forecast_scenarios(
+        base_date, 5, [{"operating_margin": 0.1}, override or {}]
+    )
+    assert batch.scenario(1) == legacy
+
+
+@pytest.mark.parametrize("override", OVERRIDES)
+def test_forecast_long_matches_scenarios(company, base_date, override):
+    forecast = company.forecast_scenarios(base_date, 60, override)
+    long = company.forecast_long(base_date, 60, override)
+
+    assert long.values.shape == forecast.values.shape
+    scale = np.abs(forecast.balance_sheet.total_assets)[..., np.newaxis]
+    assert np.all(np.abs(long.values - forecast.values) <= 1e-11 * scale)
+
+
+def test_session_matches_forecast(company, base_date):
+    session = company.forecast_session(base_date, 6)
+    assert session.results() == company.forecast_balancesheet(base_date, 6)
+
+    session.set_override("dividend_payout_ratio", 0.7)
+    expected = company.forecast_balancesheet(
+        base_date, 6, {"dividend_payout_ratio": 0.7}
+    )
+    assert session.results() == expected
+    assert session.get(RETAINED_EARNINGS, 6) == (
+        expected[5][0]["total_equity"]["retained_earnings"]
+    )
+
+    session.extend(8)
+    assert session.results() == company.forecast_balancesheet(
+        base_date, 8, {"dividend_payout_ratio": 0.7}
+    )
+
+
+def test_session_recomputes_only_what_changed(company, base_date):
+    session = company.forecast_session(base_date, 6)
+    session.set_override("minimum_cash_required", 1e9, years=[6])
+    assert 0 < session.last_recomputed < len(session.program.graph)
+
+    graph = session.dependency_graph()
+    assert CASH in graph["minimum_cash_required"]
+    assert "sales" not in graph["minimum_cash_required"]
+
+
+def test_session_follows_custom_rules(rules_company, base_date):
+    assert not rules_company.forecast_program.standard
+    session = rules_company.forecast_session(base_date, 4)
+    assert session.results() == rules_company.forecast_balancesheet(base_date, 4)
+
+    session.set_override("sales_growth_rate", 1.2)
+    assert session.results() == rules_company.forecast_balancesheet(
+        base_date, 4, {"sales_growth_rate": 1.2}
+    )
+
+
+def test_forecast_long_rejects_custom_rules(rules_company, base_date):
+    with pytest.raises(NonStandardRulesError, match="use forecast_scenarios"):
+        rules_company.forecast_long(base_date, 40)
+    # rejected before any work, nothing is memoized
+    assert not rules_company._forecast_bases
+
+
+@pytest.mark.parametrize(
+    "override", [{"sales_growth_rate": 1.1}, {"dividend_payout_ratio": 3.0}]
+)
+def test_only_forecast_long_scales_the_balance_check(company, base_date, override):
+    # over a century of compounding the rounding error of the totals
+    # exceeds the absolute tolerance of the exact engine
+    with pytest.raises(AssertionError, match="does not balance"):
+        company.forecast_scenarios(base_date, 200, override)
+
+    long = company.forecast_long(base_date, 400, override)
+    assert long.num_years == 400
+    total_assets = np.abs(long.balance_sheet.total_assets)
+    assert np.abs(long.imbalance).max() > BALANCE_TOLERANCE
+    assert np.all(
+        np.abs(long.imbalance)
+        < BALANCE_TOLERANCE + RELATIVE_BALANCE_TOLERANCE * total_assets
+    )
+    with pytest.raises(AssertionError, match="does not balance"):
+        company.forecast_long(base_date, 400, override, tolerance=0.0)
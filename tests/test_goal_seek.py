@@ -0,0 +1,65 @@
+import pytest
+
+from company_fs import CompanyFS
+from conftest import TICKERS
+from goal_seek import Target, goal_seek
+
+
+def test_hits_a_target(synthetic, base_date):
+    config_dir, store = synthetic
+    companies = [
+        CompanyFS(ticker, store=store, config_dir=config_dir) for ticker in TICKERS
+    ]
+    # sales growing by 30% from the first to the third year, every ticker
+    # in one batch
+    result = goal_seek(
+        companies,
+        base_date,
+        "sales[-1] / sales[0]",
+        1.3,
+        "sales_growth_rate",
+        (0.5, 2.0),
+        num_years=3,
+    )
+    assert (result.to_frame()["status"] == "converged").all()
+    for ticker in TICKERS:
+        assert result.solution(ticker, "sales_growth_rate") == pytest.approx(
+            1.3**0.5, rel=1e-9
+        )
+
+
+def test_finds_the_edge_of_a_floored_target(company, base_date):
+    # new short-term investment falls to 0 where minimum cash absorbs the
+    # first year's surplus, and stays there
+    _, _, driver_attributes = company._forecast_base(base_date)
+    drivers = company.forecast_balancesheet(base_date, 1)[0][1]
+    kink = driver_attributes["minimum_cash_required"] + drivers["new_st_investment"]
+    result = goal_seek(
+        company,
+        base_date,
+        "new_st_investment[0]",
+        0.0,
+        {"minimum_cash_required": (0.0, 10 * kink)},
+    )
+    assert result.solution(TICKERS[0], "minimum_cash_required") == pytest.approx(
+        kink, rel=1e-9
+    )
+
+
+def test_reports_missing_brackets(company, base_date):
+    result = goal_seek(
+        company, base_date, "new_debt_needed[0]", 1.0, {"tax_rate": (0.0, 0.01)}
+    )
+    row = result.to_frame().loc[(TICKERS[0], "tax_rate")]
+    assert row["status"] == "no_bracket"
+
+
+def test_target_expressions():
+    assert Target("max(new_debt_needed) - sales[0]").names == {
+        "new_debt_needed",
+        "sales",
+    }
+    with pytest.raises(AssertionError, match="Unsupported"):
+        Target("__import__('os')")
+    with pytest.raises(AssertionError, match="Unsupported syntax"):
+        Target("sales.real")
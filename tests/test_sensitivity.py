@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from sensitivity import sensitivity
+
+
+def _kink(company, base_date) -> float:
+    """Minimum cash at which the first year stops investing its surplus."""
+    _, _, driver_attributes = company._forecast_base(base_date)
+    drivers = company.forecast_balancesheet(base_date, 1)[0][1]
+    assert drivers["new_debt_needed"] == 0
+    return driver_attributes["minimum_cash_required"] + drivers["new_st_investment"]
+
+
+def test_central_differences(company, base_date):
+    result = sensitivity(company, base_date, 3, ["tax_rate", "operating_margin"])
+    assert (result.method == "central").all()
+    assert not result.regime_switch.any() and not result.unbalanced.any()
+
+    step = result.steps[:, np.newaxis, np.newaxis]
+    assert np.allclose(result.jacobian, (result.up - result.down) / (2 * step))
+    tornado = result.tornado("net_income")
+    assert list(tornado.index) == ["operating_margin", "tax_rate"]
+
+
+def test_one_sided_differences_at_the_kink(company, base_date):
+    # just below the kink, more minimum cash raises debt instead
+    kink = _kink(company, base_date)
+    result = sensitivity(
+        company,
+        base_date,
+        3,
+        ["minimum_cash_required"],
+        override={"minimum_cash_required": kink - 1000.0},
+    )
+    assert (result.method == "backward").all() and result.regime_switch.all()
+
+    jacobian = result.to_frame().loc[("minimum_cash_required", 1)]
+    assert jacobian["new_st_investment"] == pytest.approx(-1.0)
+    assert jacobian["new_debt_needed"] == 0
+
+
+def test_unbalanced_perturbations_are_flagged(company, base_date):
+    # decades of fast growth: only the larger growth rate stops balancing
+    result = sensitivity(
+        company,
+        base_date,
+        60,
+        ["sales_growth_rate"],
+        relative_step=0.05,
+        override={"sales_growth_rate": 1.1},
+    )
+    unbalanced = result.unbalanced[0]
+    assert unbalanced[-1] and not unbalanced[0]
+    assert (result.method[0, unbalanced] == "backward").all()
+    assert (result.method[0, ~unbalanced] == "central").all()
+
+    with pytest.raises(AssertionError, match="does not balance"):
+        sensitivity(
+            company,
+            base_date,
+            90,
+            ["sales_growth_rate"],
+            override={"sales_growth_rate": 1.1},
+        )
@@ -0,0 +1,167 @@
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+import pytest
+
+from conftest import TICKERS
+from forecast_cache import ForecastCache
+from service import ForecastService
+
+TICKER = TICKERS[2]
+
+
+@pytest.fixture
+def service(synthetic):
+    config_dir, store = synthetic
+    service = ForecastService(store, config_dir=config_dir, idle_seconds=None)
+    yield service
+    service.close()
+
+
+def _wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Timed out"
+        time.sleep(0.001)
+
+
+def test_batches_and_owner_latency(service, base_date):
+    run_batch = service._run_batch
+    sizes, started = [], [threading.Event(), threading.Event()]
+    gates = [threading.Event(), threading.Event()]
+
+    def gated_run_batch(ticker, base_year, batch):
+        position = len(sizes)
+        sizes.append(len(batch))
+        started[position].set()
+        assert gates[position].wait(5)
+        run_batch(ticker, base_year, batch)
+
+    service._run_batch = gated_run_batch
+    growths = [1.0, 1.1, 1.2]
+    results = {}
+
+    def request(growth):
+        results[growth] = service.forecast(
+            TICKER, base_date, 3, {"sales_growth_rate": growth}
+        )[1]
+
+    owner, *others = [
+        threading.Thread(target=request, args=(growth,), daemon=True)
+        for growth in growths
+    ]
+    try:
+        owner.start()
+        assert started[0].wait(5)
+        for thread in others:
+            thread.start()
+        _wait_for(
+            lambda: len(service.batcher.pending.get((TICKER, base_date), [])) == 2
+        )
+
+        gates[0].set()
+        # the owner answers while the next batch is still running
+        assert started[1].wait(5)
+        owner.join(5)
+        assert not owner.is_alive()
+    finally:
+        for gate in gates:
+            gate.set()
+    for thread in others:
+        thread.join(5)
+
+    assert sizes == [1, 2]
+    assert service.stats()["batches"] == 2
+    company = service.company(TICKER)
+    for growth, forecast in results.items():
+        expected = company.forecast_scenarios(
+            base_date, 3, {"sales_growth_rate": growth}
+        )
+        assert np.array_equal(forecast.values, expected.values)
+    assert not service.batcher.running
+
+
+def test_batches_go_through_the_cache(synthetic, base_date):
+    config_dir, store = synthetic
+    cache = ForecastCache()
+    service = ForecastService(
+        store, config_dir=config_dir, cache=cache, idle_seconds=None
+    )
+    batch = [
+        ([{"sales_growth_rate": growth}], num_years, Future())
+        for growth, num_years in [(1.0, 2), (1.1, 4)]
+    ]
+    service._run_batch(TICKER, base_date, batch)
+    assert len(cache) == 2 and cache.stats["misses"] == 0
+    assert [future.result().num_years for _, _, future in batch] == [2, 4]
+
+    # served from the cache, a shorter horizon of the cached batch
+    _, forecast = service.forecast(TICKER, base_date, 3, {"sales_growth_rate": 1.1})
+    assert cache.stats["hits"] == 1
+    assert np.array_equal(forecast.values, batch[1][2].result().values[:, :3])
+
+    # a cached request in a batch runs through the cache, the others merge
+    batch = [
+        ([{"sales_growth_rate": growth}], 2, Future()) for growth in (1.0, 1.3, 1.4)
+    ]
+    service._run_batch(TICKER, base_date, batch)
+    assert cache.stats["hits"] == 2 and len(cache) == 4
+    service.close()
+
+
+def test_failed_batch_resolves_every_request(synthetic, base_date):
+    config_dir, store = synthetic
+    cache = ForecastCache()
+    service = ForecastService(
+        store, config_dir=config_dir, cache=cache, idle_seconds=None
+    )
+
+    def failing_put(key, forecast):
+        raise OSError("disk full")
+
+    cache.put = failing_put
+    batch = [
+        ([{"sales_growth_rate": growth}], 2, Future()) for growth in (1.0, 1.1)
+    ]
+    service.batcher.pending[(TICKER, base_date)] = batch
+    service.batcher.running.add((TICKER, base_date))
+    service.batcher._drain((TICKER, base_date))
+    for _, _, future in batch:
+        with pytest.raises(OSError, match="disk full"):
+            future.result(0)
+    assert not service.batcher.running
+
+    # a batch that raises fails its requests instead of leaving them waiting
+    def broken_run_batch(ticker, base_year, batch):
+        raise RuntimeError("broken")
+
+    service._run_batch = broken_run_batch
+    with pytest.raises(RuntimeError, match="broken"):
+        service.forecast(TICKER, base_date, 2)
+    assert not service.batcher.running
+    service.close()
+
+
+def test_disk_hits_are_read_once(synthetic, base_date, tmp_path):
+    config_dir, store = synthetic
+    overrides = [{"sales_growth_rate": 1.2}]
+    ForecastService(
+        store,
+        config_dir=config_dir,
+        cache=ForecastCache(directory=str(tmp_path)),
+        idle_seconds=None,
+    ).company(TICKER).forecast_scenarios(base_date, 3, overrides)
+
+    # nothing fits in memory, every lookup reads the disk
+    cache = ForecastCache(max_bytes=1, directory=str(tmp_path))
+    service = ForecastService(
+        store, config_dir=config_dir, cache=cache, idle_seconds=None
+    )
+    batch = [(overrides, 2, Future()), (overrides, 5, Future())]
+    service._run_batch(TICKER, base_date, batch)
+    assert cache.stats["disk_hits"] == 2
+    assert cache.stats["hits"] == 1 and cache.stats["extensions"] == 1
+    assert [future.result().num_years for _, _, future in batch] == [2, 5]
+    service.close()
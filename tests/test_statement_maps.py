@@ -0,0 +1,49 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from conftest import TICKERS
+from statement_maps import MAP_FILES, clear_map_cache, load_map
+from utils import build_recursively
+
+
+@pytest.mark.parametrize("statement", list(MAP_FILES))
+def test_extraction_matches_the_nested_maps(synthetic, company, statement):
+    config_dir, _ = synthetic
+    compiled = load_map(TICKERS[0], statement, config_dir)
+    data = getattr(company, statement)
+    column = data.iloc[:, 0]
+
+    values = compiled.extract(column)
+    assert compiled.to_dict(values) == build_recursively(compiled.tree, column)
+    series = compiled.extract_series(column)
+    assert list(series.index) == list(compiled.keys)
+    np.testing.assert_array_equal(series.to_numpy(), values)
+    frame = compiled.extract_frame(data)
+    np.testing.assert_array_equal(frame[column.name].to_numpy(), values)
+
+    # a row missing from the statement comes back as NaN
+    values = compiled.extract(column.drop(compiled.labels[0]))
+    assert np.isnan(values[0]) and not np.isnan(values[1:]).any()
+
+
+def test_recompiles_changed_maps(synthetic, tmp_path):
+    config_dir, _ = synthetic
+    shutil.copytree(config_dir, tmp_path, dirs_exist_ok=True)
+    copy = str(tmp_path)
+    clear_map_cache()
+
+    compiled = load_map(TICKERS[0], "balancesheet", copy)
+    assert load_map(TICKERS[0], "balancesheet", copy) is compiled
+    stat = os.stat(compiled.path)
+    os.utime(compiled.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    recompiled = load_map(TICKERS[0], "balancesheet", copy)
+    assert recompiled is not compiled
+
+    # identical content, equal digest wherever the map lives
+    assert recompiled.digest == compiled.digest
+    assert load_map(TICKERS[0], "balancesheet", config_dir).digest == compiled.digest
+    clear_map_cache()
+    assert load_map(TICKERS[0], "balancesheet", copy) is not recompiled
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from company_fs import CompanyFS
+from conftest import TICKERS
+from universe import build_jobs, run_universe
+
+OVERRIDES = [{"sales_growth_rate": growth} for growth in (1.0, 1.1)]
+
+
+def test_build_jobs():
+    assert build_jobs(["syn0000", "SYN0000", "SYN0001"]) == [
+        ("SYN0000", None),
+        ("SYN0001", None),
+    ]
+    assert build_jobs(
+        ["SYN0000", "SYN0001"],
+        {"SYN0000": ["2023-06-30", "2024-06-30", "2023-06-30"]},
+    ) == [("SYN0000", "2023-06-30"), ("SYN0000", "2024-06-30"), ("SYN0001", None)]
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_runs_every_job(synthetic, base_date, workers):
+    config_dir, store = synthetic
+    # a ticker without statement maps fails alone
+    result = run_universe(
+        TICKERS + ["NOMAP"],
+        overrides=OVERRIDES,
+        num_years=3,
+        workers=workers,
+        chunksize=2,
+        store=store,
+        config_dir=config_dir,
+    )
+    assert sorted(result.results) == [(ticker, base_date) for ticker in TICKERS]
+    assert list(result.errors) == [("NOMAP", base_date)]
+    assert result.stats["succeeded"] == len(TICKERS) and result.stats["failed"] == 1
+
+    for (ticker, date), forecast in result.results.items():
+        company = CompanyFS(ticker, store=store, config_dir=config_dir)
+        expected = company.forecast_scenarios(date, 3, OVERRIDES)
+        assert forecast.num_scenarios == len(OVERRIDES)
+        np.testing.assert_array_equal(forecast.values, expected.values)
@@ -0,0 +1,90 @@
+import pytest
+
+from company_fs import CompanyFS
+from conftest import GAP_TICKER, NUM_DATES, SEED, TICKERS, offline_company
+from synthetic import UNIT, generate_statements
+from validation import (
+    TOTAL_ASSETS,
+    TOTAL_LIABILITIES,
+    ValidationError,
+    validate_companies,
+)
+
+
+@pytest.fixture
+def broken_totals(synthetic, tmp_path):
+    """
+    A company whose Yahoo total assets and liabilities are both one unit
+    above the mapped line items: the reported balance sheet still balances.
+    """
+    config_dir, _ = synthetic
+    statements = generate_statements(GAP_TICKER, NUM_DATES, SEED)
+    statements["balancesheet"].loc[[TOTAL_ASSETS, TOTAL_LIABILITIES]] += UNIT
+    return config_dir, str(tmp_path), statements
+
+
+def test_levels(broken_totals):
+    config_dir, root, statements = broken_totals
+    full = offline_company(root, GAP_TICKER, config_dir, statements)
+    date = full.balancesheet.columns[1].strftime("%Y-%m-%d")
+    with pytest.raises(ValidationError, match="Total assets do not match") as info:
+        full.get_bs(date)
+    assert set(info.value.report.violations["check"]) == {
+        "total_assets",
+        "total_liabilities",
+        "total_balance_sheet",
+    }
+
+    # only the identities within the statement
+    fast = offline_company(root, GAP_TICKER, config_dir, statements, validation="fast")
+    assert fast.get_compact_bs(date).total_assets == (
+        full.balancesheet.loc[TOTAL_ASSETS, date] - UNIT
+    )
+    off = offline_company(root, GAP_TICKER, config_dir, statements, validation="off")
+    off.get_bs(date)
+
+
+def test_report(broken_totals):
+    config_dir, root, statements = broken_totals
+    company = offline_company(root, GAP_TICKER, config_dir, statements)
+    report = company.validate()
+    assert not report.ok and len(report) == 3 * NUM_DATES
+    differences = report.violations.groupby("check")["difference"].unique()
+    assert differences.to_dict() == {
+        "total_assets": [-UNIT],
+        "total_liabilities": [-UNIT],
+        "total_balance_sheet": [-2 * UNIT],
+    }
+    assert list(report.summary()["violations"]) == [NUM_DATES] * 3
+    assert company.validate(level="fast").ok
+
+
+def test_income_statement_chain(synthetic, tmp_path):
+    config_dir, _ = synthetic
+    statements = generate_statements(GAP_TICKER, NUM_DATES, SEED)
+    income_statement = statements["incomestatement"]
+    date = income_statement.columns[0]
+    income_statement.loc["Gross Profit", date] += UNIT
+    company = offline_company(
+        str(tmp_path), GAP_TICKER, config_dir, statements, validation="fast"
+    )
+    with pytest.raises(ValidationError, match="Gross profit"):
+        company.get_pnl(date.strftime("%Y-%m-%d"))
+
+    # gross profit feeds the operating income check too
+    violations = company.validate().violations
+    assert list(violations["check"]) == ["gross_profit", "operating_income"]
+    assert set(violations["date"]) == {date.strftime("%Y-%m-%d")}
+
+
+def test_validate_companies(synthetic, broken_totals):
+    config_dir, store = synthetic
+    _, root, statements = broken_totals
+    companies = [
+        CompanyFS(ticker, store=store, config_dir=config_dir) for ticker in TICKERS
+    ] + [offline_company(root, GAP_TICKER, config_dir, statements)]
+    report = validate_companies(companies)
+    assert set(report.violations["ticker"]) == {GAP_TICKER}
+    assert len(report) == 3 * NUM_DATES
+    assert validate_companies(companies, level="fast").ok
+    assert validate_companies(companies, level="off").num_checked == 0
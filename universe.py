@@ -0,0 +1,218 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import instrumentation
+from company_fs import CompanyFS
+from statement_maps import DEFAULT_CONFIG_DIR
+from statement_store import StatementSource, default_store
+
+
+class UniverseResult:
+    """
+    Results of a universe run.
+
+    Attributes:
+        results: (ticker, base_date) -> ScenarioForecast
+        errors: (ticker, base_date) -> "ErrorType: message"
+        stats: Throughput statistics of the run
+    """
+
+    def __init__(self, results: dict, errors: dict, stats: dict):
+        self.results = results
+        self.errors = errors
+        self.stats = stats
+
+    def __repr__(self):
+        return (
+            f"UniverseResult({len(self.results)} succeeded, "
+            f"{len(self.errors)} failed, {self.stats['elapsed_seconds']:.2f}s)"
+        )
+
+
+def latest_date(company: CompanyFS) -> str:
+    """Returns the most recent balance sheet date of a company."""
+    return max(company.balancesheet.columns).strftime("%Y-%m-%d")
+
+
+def build_jobs(tickers: list, base_dates=None) -> list:
+    """
+    Expands tickers and base dates into unique (ticker, base_date) jobs.
+
+    Args:
+        tickers: Ticker symbols
+        base_dates: None for each ticker's latest date, a date for every
+            ticker, or a dict of ticker -> date or list of dates
+    """
+    assert isinstance(tickers, (list, tuple)), "Tickers must be a list"
+    jobs = []
+    for ticker in tickers:
+        dates = base_dates
+        if isinstance(base_dates, dict):
+            dates = base_dates.get(ticker, base_dates.get(ticker.upper()))
+        if dates is None or isinstance(dates, str):
+            dates = [dates]
+        jobs.extend((ticker.upper(), date) for date in dates)
+    return list(dict.fromkeys(jobs))
+
+
+def _run_chunk(
+    jobs: list,
+    num_years: int,
+    overrides,
+    store: StatementSource,
+    config_dir: str,
+    instrument: bool = False,
+    estimator=None,
+):
+    """
+    Runs a chunk of jobs in a worker, capturing errors per job.
+
+    Args:
+        instrument: Record instrumentation in the worker and return it
+        estimator: DriverEstimator of the CompanyFS objects
+
+    Returns:
+        Tuple of (outcomes, instrumentation snapshot or None), outcomes a
+        list of (ticker, base_date, result, error, elapsed_seconds)
+    """
+    recorder = instrumentation.enable() if instrument else None
+    outcomes = []
+    # jobs of the same ticker share one CompanyFS, its statements and
+    # estimated drivers
+    companies = {}
+    for ticker, base_date in jobs:
+        start = time.perf_counter()
+        try:
+            if ticker not in companies:
+                companies[ticker] = CompanyFS(
+                    ticker, store=store, config_dir=config_dir, estimator=estimator
+                )
+            company = companies[ticker]
+            if base_date is None:
+                base_date = latest_date(company)
+            result = company.forecast_scenarios(
+                base_date, num_years=num_years, overrides=overrides
+            )
+            error = None
+        except Exception as e:
+            result, error = None, f"{type(e).__name__}: {e}"
+        outcomes.append(
+            (ticker, base_date, result, error, time.perf_counter() - start)
+        )
+    if recorder is None:
+        return outcomes, None
+    instrumentation.disable()
+    return outcomes, recorder.snapshot()
+
+
+def run_universe(
+    tickers: list,
+    base_dates=None,
+    overrides=None,
+    num_years: int = 1,
+    workers: int = None,
+    chunksize: int = 8,
+    store: StatementSource = None,
+    config_dir: str = DEFAULT_CONFIG_DIR,
+    estimator=None,
+) -> UniverseResult:
+    """
+    Forecasts a universe of tickers over a process pool.
+
+    Every (ticker, base date) job runs all override sets in a single
+    vectorized forecast_scenarios call. A failing job is recorded in the
+    errors of the result and never aborts the run. When instrumentation is
+    enabled, what the workers record is merged into the active recorder.
+
+    Args:
+        tickers: Ticker symbols
+        base_dates: None for each ticker's latest date, a date for every
+            ticker, or a dict of ticker -> date or list of dates
+        overrides: Override sets accepted by CompanyFS.forecast_scenarios
+        num_years: Number of years to forecast
+        workers: Number of worker processes, defaults to the CPU count;
+            0 or 1 runs in the current process
+        chunksize: Number of jobs sent to a worker at once
+        store: Statement store used by the workers, it must be picklable
+        config_dir: Directory holding the <TICKER>/*_map.json files
+        estimator: DriverEstimator estimating the drivers from each
+            ticker's history, None to derive them from the base date alone
+
+    Returns:
+        UniverseResult with results, errors and throughput statistics
+    """
+    assert isinstance(num_years, int), "Number of years must be an integer"
+    assert chunksize > 0, "Chunk size must be greater than 0"
+    store = store if store is not None else default_store()
+    workers = (os.cpu_count() or 1) if workers is None else workers
+
+    jobs = build_jobs(tickers, base_dates)
+    chunks = [jobs[i : i + chunksize] for i in range(0, len(jobs), chunksize)]
+
+    start = time.perf_counter()
+    outcomes = []
+    if workers <= 1:
+        for chunk in chunks:
+            outcomes.extend(
+                _run_chunk(
+                    chunk, num_years, overrides, store, config_dir, estimator=estimator
+                )[0]
+            )
+    else:
+        # workers record into their own recorder, merged into the caller's
+        recorder = instrumentation.recorder()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(
+                    _run_chunk,
+                    chunk,
+                    num_years,
+                    overrides,
+                    store,
+                    config_dir,
+                    recorder is not None,
+                    estimator,
+                ): chunk
+                for chunk in chunks
+            }
+            for future in as_completed(futures):
+                try:
+                    chunk_outcomes, snapshot = future.result()
+                    outcomes.extend(chunk_outcomes)
+                    if snapshot is not None:
+                        recorder.merge(snapshot)
+                except Exception as e:
+                    # the worker itself died, fail every job of the chunk
+                    error = f"{type(e).__name__}: {e}"
+                    outcomes.extend(
+                        (ticker, base_date, None, error, 0.0)
+                        for ticker, base_date in futures[future]
+                    )
+    elapsed = time.perf_counter() - start
+
+    results, errors = {}, {}
+    job_seconds = []
+    for ticker, base_date, result, error, seconds in outcomes:
+        job_seconds.append(seconds)
+        if error is None:
+            results[(ticker, base_date)] = result
+        else:
+            errors[(ticker, base_date)] = error
+
+    num_scenarios = sum(result.num_scenarios for result in results.values())
+    stats = {
+        "jobs": len(jobs),
+        "succeeded": len(results),
+        "failed": len(errors),
+        "workers": max(workers, 1),
+        "chunksize": chunksize,
+        "elapsed_seconds": elapsed,
+        "jobs_per_second": len(jobs) / elapsed if elapsed > 0 else float("inf"),
+        "scenarios_per_second": (
+            num_scenarios / elapsed if elapsed > 0 else float("inf")
+        ),
+        "mean_job_seconds": sum(job_seconds) / len(job_seconds) if job_seconds else 0.0,
+        "max_job_seconds": max(job_seconds, default=0.0),
+    }
+    return UniverseResult(results, errors, stats)
@@ -20,3 +20,63 @@ def build_recursively(sub_map, data_source):
         else:
             result[key] = data_source.get(value)
     return result
+
+
+def flatten_nested(d, prefix=""):
+    """
+    Flattens a nested dictionary into dotted keys and a layout descriptor.
+
+    Returns:
+        Tuple of (keys, values, layout) where keys are dotted paths in
+        insertion order, values are the matching leaf values and layout
+        mirrors the nested structure with column positions as leaves.
+    """
+    keys, values, layout = [], [], {}
+    for key, value in d.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            sub_keys, sub_values, sub_layout = flatten_nested(value, f"{path}.")
+            offset = len(keys)
+            keys.extend(sub_keys)
+            values.extend(sub_values)
+            layout[key] = shift_layout(sub_layout, offset)
+        else:
+            layout[key] = len(keys)
+            keys.append(path)
+            values.append(value)
+    return keys, values, layout
+
+
+def shift_layout(layout, offset):
+    """Recursively adds an offset to every column position in a layout."""
+    return {
+        key: shift_layout(value, offset) if isinstance(value, dict) else value + offset
+        for key, value in layout.items()
+    }
+
+
+def sum_layout(values, layout):
+    """
+    Sums the columns of values following a layout, in the same order as
+    sum_dict_values, so results match the nested dictionary exactly.
+    Works on scalars per column or on numpy arrays (last axis = column).
+    """
+    total = 0
+    for value in layout.values():
+        if isinstance(value, dict):
+            total = total + sum_layout(values, value)
+        else:
+            total = total + values[..., value]
+    return total
+
+
+def build_from_layout(layout, values):
+    """Rebuilds a nested dictionary from a layout and a flat sequence of values."""
+    return {
+        key: (
+            build_from_layout(value, values)
+            if isinstance(value, dict)
+            else values[value]
+        )
+        for key, value in layout.items()
+    }
@@ -0,0 +1,442 @@
+import numpy as np
+import pandas as pd
+
+from balance_sheet import BalanceSheetLayout, CompactBalanceSheet
+from instrumentation import stage
+from statement_maps import load_map
+
+# "off" skips validation, "fast" checks the identities within a statement,
+# "full" also checks the mapped totals against the Yahoo totals and that
+# every mapped line item was found
+VALIDATION_LEVELS = ("off", "fast", "full")
+
+# Yahoo rows holding the reported totals
+TOTAL_ASSETS = "Total Assets"
+TOTAL_LIABILITIES = "Total Liabilities Net Minority Interest"
+TOTAL_EQUITY = "Total Equity Gross Minority Interest"
+
+# (check, level, message, actual, expected), evaluated in order on a dict of
+# arrays with one entry per balance sheet (date and ticker)
+BALANCE_SHEET_CHECKS = (
+    (
+        "total_assets",
+        "full",
+        "Total assets do not match the sum of current and non-current assets.",
+        lambda c: c["mapped_assets"],
+        lambda c: c["total_assets"],
+    ),
+    (
+        "total_liabilities",
+        "full",
+        "Total liabilities do not match the sum of current and non-current liabilities.",
+        lambda c: c["mapped_liabilities"],
+        lambda c: c["total_liabilities"],
+    ),
+    (
+        "total_equity",
+        "full",
+        "Total equity does not match the sum of capital stock, retained earnings, and gains/losses not affecting retained earnings.",
+        lambda c: c["mapped_equity"],
+        lambda c: c["total_equity"],
+    ),
+    (
+        "balance_equation",
+        "fast",
+        "The balance sheet equation does not hold: Total Assets = Total Liabilities + Total Equity.",
+        lambda c: c["mapped_assets"] - c["mapped_liabilities"] - c["mapped_equity"],
+        lambda c: 0.0,
+    ),
+    (
+        "real_balance_equation",
+        "fast",
+        "The real balance sheet equation does not hold: Total Assets = Total Liabilities + Total Equity.",
+        lambda c: c["total_assets"] - c["total_liabilities"] - c["total_equity"],
+        lambda c: 0.0,
+    ),
+    (
+        "total_balance_sheet",
+        "full",
+        "Total balance sheet does not match the actual sum of total assets, total liabilities, and total equity.",
+        lambda c: c["mapped_total"],
+        lambda c: c["total_assets"] + c["total_liabilities"] + c["total_equity"],
+    ),
+    (
+        "missing_line_items",
+        "full",
+        "Mapped balance sheet line items are missing from the statement.",
+        lambda c: c["missing"],
+        lambda c: 0.0,
+    ),
+)
+
+INCOME_STATEMENT_CHECKS = (
+    (
+        "gross_profit",
+        "fast",
+        "Gross profit does not match total revenue minus cost of revenue.",
+        lambda c: c["total_revenue"] - c["cost_of_revenue"],
+        lambda c: c["gross_profit"],
+    ),
+    (
+        "operating_income",
+        "fast",
+        "Operating income does not match gross profit minus operating expenses.",
+        lambda c: c["gross_profit"] - c["operating_expenses"],
+        lambda c: c["operating_income"],
+    ),
+    (
+        "pretax_income",
+        "fast",
+        "Pretax income does not match operating income minus net non-operating interest income/expense and other income/expense.",
+        lambda c: c["operating_income"]
+        + c["net_non_operating_interest_income_expense"]
+        + c["other_income_expense"],
+        lambda c: c["pretax_income"],
+    ),
+    (
+        "net_income",
+        "fast",
+        "Net income does not match pretax income minus tax provision.",
+        lambda c: c["pretax_income"] - c["tax_provision"],
+        lambda c: c["net_income_common_stockholders"],
+    ),
+    (
+        "missing_line_items",
+        "full",
+        "Mapped income statement line items are missing from the statement.",
+        lambda c: c["missing"],
+        lambda c: 0.0,
+    ),
+)
+
+
+class ValidationError(AssertionError):
+    """Raised by ValidationReport.raise_if_failed, carries the full report."""
+
+    def __init__(self, message: str, report: "ValidationReport"):
+        super().__init__(message)
+        self.report = report
+
+
+class ValidationReport:
+    """
+    Every violated identity of a validation run, one row per check and
+    statement (ticker, date) with the values compared and the difference.
+
+    Attributes:
+        violations: DataFrame with the columns in COLUMNS
+        level: Validation level the report was produced with
+        num_checked: Number of (check, statement) pairs evaluated
+    """
+
+    COLUMNS = [
+        "ticker",
+        "date",
+        "statement",
+        "check",
+        "actual",
+        "expected",
+        "difference",
+        "message",
+    ]
+
+    def __init__(self, violations: pd.DataFrame, level: str, num_checked: int):
+        # None when clean, an empty DataFrame per successful get_bs would
+        # cost more than the checks themselves
+        self._violations = violations
+        self.level = level
+        self.num_checked = num_checked
+
+    @classmethod
+    def empty(cls, level: str = "off") -> "ValidationReport":
+        return cls(None, level, 0)
+
+    @property
+    def violations(self) -> pd.DataFrame:
+        if self._violations is None:
+            return pd.DataFrame(columns=self.COLUMNS)
+        return self._violations
+
+    @property
+    def ok(self) -> bool:
+        return self._violations is None or self._violations.empty
+
+    def __len__(self) -> int:
+        return 0 if self._violations is None else len(self._violations)
+
+    def __repr__(self):
+        return (
+            f"ValidationReport({len(self)} violations in {self.num_checked} "
+            f"checks, level={self.level!r})"
+        )
+
+    def __add__(self, other: "ValidationReport") -> "ValidationReport":
+        return ValidationReport.concat([self, other])
+
+    @classmethod
+    def concat(cls, reports: list) -> "ValidationReport":
+        reports = list(reports)
+        frames = [report.violations for report in reports if not report.ok]
+        return cls(
+            pd.concat(frames, ignore_index=True) if frames else None,
+            reports[0].level if reports else "off",
+            sum(report.num_checked for report in reports),
+        )
+
+    def to_frame(self) -> pd.DataFrame:
+        return self.violations
+
+    def summary(self) -> pd.DataFrame:
+        """Returns the number of violations and largest difference per check."""
+        violations = self.violations.assign(
+            abs_difference=self.violations["difference"].astype("float64").abs()
+        )
+        return violations.groupby(["statement", "check"], sort=False).agg(
+            violations=("check", "size"),
+            max_abs_difference=("abs_difference", "max"),
+        )
+
+    def raise_if_failed(self):
+        """
+        Raises a ValidationError for the first failing check, naming its
+        failing dates when the statements were validated with dates.
+        """
+        if self.ok:
+            return
+        first = self.violations.iloc[0]
+        message = first["message"]
+        failing = self.violations[
+            (self.violations["statement"] == first["statement"])
+            & (self.violations["check"] == first["check"])
+        ]
+        if failing["date"].notna().any():
+            message = f"{message} Failing dates: {failing['date'].tolist()}"
+        raise ValidationError(message, self)
+
+
+def _as_rows(values, size: int) -> np.ndarray:
+    """Broadcasts a scalar or array to one float per statement."""
+    return np.broadcast_to(np.asarray(values, dtype="float64"), (size,))
+
+
+def _run_checks(
+    checks: tuple,
+    statement: str,
+    context: dict,
+    size: int,
+    tickers,
+    dates,
+    level: str,
+    tolerance: float,
+) -> ValidationReport:
+    """
+    Evaluates the checks enabled at a level on arrays of size entries and
+    collects the violations. A NaN on either side is a violation.
+    """
+    assert level in VALIDATION_LEVELS, f"Unknown validation level {level}"
+    if level == "off":
+        return ValidationReport.empty(level)
+
+    frames, num_checked = [], 0
+    with np.errstate(invalid="ignore"):
+        for check, check_level, message, actual, expected in checks:
+            if level == "fast" and check_level == "full":
+                continue
+            # compared as they come, broadcast only to report a failure
+            actual_values = actual(context)
+            expected_values = expected(context)
+            difference = np.subtract(actual_values, expected_values)
+            passed = (actual_values == expected_values) | (
+                np.abs(difference) <= tolerance
+            )
+            num_checked += size
+            if passed.all():
+                continue
+
+            failing = np.broadcast_to(~np.asarray(passed), (size,))
+            if not frames:
+                tickers = np.broadcast_to(np.asarray(tickers, dtype=object), (size,))
+                dates = (
+                    np.full(size, None, dtype=object)
+                    if dates is None
+                    else np.array(
+                        [str(date)[:10] for date in np.asarray(dates)], dtype=object
+                    )
+                )
+            frames.append(
+                pd.DataFrame(
+                    {
+                        "ticker": tickers[failing],
+                        "date": dates[failing],
+                        "statement": statement,
+                        "check": check,
+                        "actual": _as_rows(actual_values, size)[failing],
+                        "expected": _as_rows(expected_values, size)[failing],
+                        "difference": _as_rows(difference, size)[failing],
+                        "message": message,
+                    },
+                    columns=ValidationReport.COLUMNS,
+                )
+            )
+
+    violations = pd.concat(frames, ignore_index=True) if frames else None
+    return ValidationReport(violations, level, num_checked)
+
+
+def _yahoo_totals(statement_df) -> list:
+    """
+    Returns the Yahoo total assets, liabilities and equity rows of a column
+    (Series) or columns (DataFrame), NaN where a row is absent.
+    """
+    index = statement_df.index
+    values = statement_df.to_numpy(dtype="float64")
+    return [
+        values[index.get_loc(label)]
+        if label in index
+        else np.full(values.shape[1:], np.nan)
+        for label in (TOTAL_ASSETS, TOTAL_LIABILITIES, TOTAL_EQUITY)
+    ]
+
+
+def validate_balance_sheet(
+    bs: CompactBalanceSheet,
+    bs_df,
+    dates=None,
+    ticker=None,
+    level: str = "full",
+    tolerance: float = 0.0,
+) -> ValidationReport:
+    """
+    Validates mapped balance sheets against each other and the Yahoo totals.
+
+    Args:
+        bs: Mapped balance sheets, a single one or shape (N,)
+        bs_df: Source statement column (Series) or columns (DataFrame, N columns)
+        dates: Date of each balance sheet, used in the report
+        ticker: Ticker, or one ticker per balance sheet
+        level: "off", "fast" or "full"
+        tolerance: Absolute difference accepted, 0.0 for exact identities
+
+    Returns:
+        ValidationReport
+    """
+    size = int(np.prod(bs.shape))
+    total_assets, total_liabilities, total_equity = _yahoo_totals(bs_df)
+    context = {
+        "mapped_assets": bs.total_assets,
+        "mapped_liabilities": bs.total_liabilities,
+        "mapped_equity": bs.total_equity,
+        "mapped_total": bs.subtotal(),
+        "total_assets": total_assets,
+        "total_liabilities": total_liabilities,
+        "total_equity": total_equity,
+        "missing": np.isnan(bs.values).sum(axis=-1),
+    }
+    return _run_checks(
+        BALANCE_SHEET_CHECKS,
+        "balancesheet",
+        context,
+        size,
+        ticker,
+        dates,
+        level,
+        tolerance,
+    )
+
+
+def validate_income_statement(
+    pnl, dates=None, ticker=None, level: str = "full", tolerance: float = 0.0
+) -> ValidationReport:
+    """
+    Validates the income statement chain on a Series (one date) or a
+    DataFrame (line items x N dates) keyed by mapped line items.
+    """
+    values = pnl.to_numpy(dtype="float64")
+    context = {key: values[position] for position, key in enumerate(pnl.index)}
+    context["missing"] = np.isnan(values).sum(axis=0)
+    size = 1 if values.ndim == 1 else values.shape[1]
+    return _run_checks(
+        INCOME_STATEMENT_CHECKS,
+        "incomestatement",
+        context,
+        size,
+        ticker,
+        dates,
+        level,
+        tolerance,
+    )
+
+
+def validate_companies(
+    companies: list, level: str = "full", tolerance: float = 0.0
+) -> ValidationReport:
+    """
+    Validates every date of every company's balance sheet and income
+    statement. Statements sharing a layout are stacked and checked in one
+    pass per statement instead of one pass per ticker.
+
+    Args:
+        companies: CompanyFS instances
+        level: "fast" or "full" ("off" returns an empty report)
+        tolerance: Absolute difference accepted, 0.0 for exact identities
+
+    Returns:
+        ValidationReport covering all companies
+    """
+    assert level in VALIDATION_LEVELS, f"Unknown validation level {level}"
+    if level == "off":
+        return ValidationReport.empty(level)
+
+    balance_sheets, income_statements = {}, {}
+    for company in companies:
+        ticker = company.ticker_name
+        with stage("validate.collect", ticker):
+            bs_map = load_map(ticker, "balancesheet", company.config_dir)
+            bs_df = company.balancesheet
+            bs_layout = BalanceSheetLayout.from_map(bs_map)
+            balance_sheets.setdefault(bs_layout, []).append(
+                (ticker, bs_map.extract_frame(bs_df), bs_df)
+            )
+
+            pnl_map = load_map(ticker, "incomestatement", company.config_dir)
+            pnl = pnl_map.extract_frame(company.incomestatement)
+            income_statements.setdefault(tuple(pnl.index), []).append((ticker, pnl))
+
+    reports = []
+    with stage("validate.balancesheet_universe"):
+        for bs_layout, entries in balance_sheets.items():
+            values = np.concatenate([history.to_numpy().T for _, history, _ in entries])
+            totals = pd.concat(
+                [
+                    bs_df.reindex([TOTAL_ASSETS, TOTAL_LIABILITIES, TOTAL_EQUITY])
+                    for _, _, bs_df in entries
+                ],
+                axis=1,
+            )
+            reports.append(
+                validate_balance_sheet(
+                    CompactBalanceSheet(values, bs_layout),
+                    totals,
+                    dates=totals.columns,
+                    ticker=np.concatenate(
+                        [[ticker] * history.shape[1] for ticker, history, _ in entries]
+                    ),
+                    level=level,
+                    tolerance=tolerance,
+                )
+            )
+    with stage("validate.incomestatement_universe"):
+        for entries in income_statements.values():
+            pnl = pd.concat([history for _, history in entries], axis=1)
+            reports.append(
+                validate_income_statement(
+                    pnl,
+                    dates=pnl.columns,
+                    ticker=np.concatenate(
+                        [[ticker] * history.shape[1] for ticker, history in entries]
+                    ),
+                    level=level,
+                    tolerance=tolerance,
+                )
+            )
+    return ValidationReport.concat(reports) if reports else ValidationReport.empty(level)